@@ -60,7 +60,11 @@ SUBMODULE_NAMES = ['spatial_access.p2p',
                    'spatial_access.NetworkInterface',
                    'spatial_access.MatrixInterface',
                    'spatial_access.SpatialAccessExceptions',
-                   'spatial_access._parsers']
+                   'spatial_access._parsers',
+                   'spatial_access._readers',
+                   'spatial_access._osm',
+                   'spatial_access._network_cache',
+                   'spatial_access._arrow']
 
 
 if 'READTHEDOCS' in os.environ:
@@ -10,14 +10,13 @@ import matplotlib.patches as mpatches
 import matplotlib.pyplot
 import json
 from spatial_access.p2p import TransitMatrix
+from spatial_access import _readers
 
 from spatial_access.SpatialAccessExceptions import UnrecognizedCategoriesException
 from spatial_access.SpatialAccessExceptions import SourceDataNotFoundException
 from spatial_access.SpatialAccessExceptions import DestDataNotFoundException
 from spatial_access.SpatialAccessExceptions import SourceDataNotParsableException
 from spatial_access.SpatialAccessExceptions import DestDataNotParsableException
-from spatial_access.SpatialAccessExceptions import PrimaryDataNotFoundException
-from spatial_access.SpatialAccessExceptions import SecondaryDataNotFoundException
 from spatial_access.SpatialAccessExceptions import ShapefileNotFoundException
 from spatial_access.SpatialAccessExceptions import ModelNotAggregatedException
 from spatial_access.SpatialAccessExceptions import ModelNotCalculatedException
@@ -44,8 +43,8 @@ class ModelData:
         """
         Args:
             network_type: string, one of {'walk', 'bike', 'drive', 'otp'}.
-            sources_filename: string, csv filename.
-            destinations_filename: string, csv filename.
+            sources_filename: string, csv, parquet or feather filename, or a DataFrame.
+            destinations_filename: string, csv, parquet or feather filename, or a DataFrame.
             source_column_names: dictionary, map column names to expected values.
             dest_column_names: dictionary, map column names to expected values.
             configs: defaults to None, else pass in an instance of Configs to override
@@ -85,6 +84,11 @@ class ModelData:
         self.sources_in_range = {}
         self.dests_in_range = {}
 
+        # thresholds binned by precompute_thresholds, and the
+        # histograms built from them (built lazily, once each)
+        self._thresholds = None
+        self._threshold_histograms = {}
+
         # initialize logger
         self.debug = debug
         self.logger = None
@@ -203,40 +207,60 @@ class ModelData:
             self.transit_matrix = TransitMatrix(self.network_type,
                                                 read_from_file=read_from_file,
                                                 debug=self.debug)
+            self.reload_sources()
+            self.reload_dests()
         else:
+            # parse the inputs once and hand the frames to the transit matrix
+            self.reload_sources()
+            self.reload_dests()
             self.transit_matrix = TransitMatrix(self.network_type,
-                                                primary_input=self.sources_filename,
-                                                secondary_input=self.destinations_filename,
-                                                primary_hints=self.source_column_names,
-                                                secondary_hints=self.dest_column_names,
+                                                primary_input=self.sources[['lat', 'lon']],
+                                                secondary_input=self.dests[['lat', 'lon']],
+                                                primary_hints=self._get_location_hints(self.sources),
+                                                secondary_hints=self._get_location_hints(self.dests),
                                                 configs=None,
                                                 debug=self.debug)
-            try:
-                self.transit_matrix.process()
-            except PrimaryDataNotFoundException:
-                raise SourceDataNotFoundException()
-            except SecondaryDataNotFoundException:
-                raise DestDataNotFoundException()
+            self.transit_matrix.process()
 
-            # borrow hints for use in load_sources() and load_dests() if not user supplied
-            if self._source_file_hints is None:
-                self._source_file_hints = self.transit_matrix.primary_hints
-            if self._dest_file_hints is None:
-                self._dest_file_hints = self.transit_matrix.secondary_hints
+    @staticmethod
+    def _get_location_hints(data):
+        """
+        Args:
+            data: DataFrame with lat and lon columns.
+        Returns: TransitMatrix hints for data.
+        """
+        return {'idx': data.index.name, 'lat': 'lat', 'lon': 'lon'}
 
-        self.reload_sources()
-        self.reload_dests()
+    @staticmethod
+    def _read_columns(source, idx, rename_cols):
+        """
+        Read only the index and the renamed columns of a table.
+        Args:
+            source: DataFrame, or csv, parquet or feather filename.
+            idx: name of the index column.
+            rename_cols: dictionary of {column name: new column name}.
+        Returns: DataFrame indexed by idx with the renamed columns.
+        Raises:
+            KeyError: a column is not in the table.
+        """
+        columns = [idx] + [column for column in rename_cols if column != idx]
+        dtype = {column: 'float64' for column, renamed in rename_cols.items()
+                 if renamed in {'lat', 'lon'}}
+        table = _readers.read_table(source, columns, dtype=dtype)
+        table.set_index(idx, inplace=True)
+        table.rename(columns=rename_cols, inplace=True)
+        return table
 
     def reload_sources(self, filename=None):
         """
-        Load the source points for the model (from csv).
+        Load the source points for the model (from csv, parquet or feather).
         For each point, the table should contain:
         -unique identifier (integer or string)
         -latitude & longitude
         -population (integer) [only for some models]
 
         Args:
-            filename: string
+            filename: string or DataFrame
         Raises:
             SourceDataNotFoundException: Cannot find source
                 data.
@@ -244,11 +268,9 @@ class ModelData:
                 do not correspond to column names.
         """
 
-        if filename:
+        if filename is not None:
             self.sources_filename = filename
-        try:
-            self.sources = pd.read_csv(self.sources_filename)
-        except FileNotFoundError:
+        if not _readers.table_exists(self.sources_filename):
             raise SourceDataNotFoundException()
 
         if self.source_column_names is None:
@@ -270,7 +292,7 @@ class ModelData:
 
             # extract the column names from the table for whichever fields
             # were not gleaned from self.source_file_hints
-            source_data_columns = self.sources.columns.values
+            source_data_columns = _readers.read_column_names(self.sources_filename)
             print('The variables in your data set are:')
             for var in source_data_columns:
                 print('> ', var)
@@ -289,27 +311,27 @@ class ModelData:
                                         'population': population}
 
         try:
-            # insert filler values for the population column if
-            # user does not want to include it. need it for coverage
-            if self.source_column_names['population'] == 'skip':
-                self.sources['population'] = 1
-
-            # rename columns, clean the data frame
-            rename_cols = {self.source_column_names['population']: 'population',
-                           self.source_column_names['lat']: 'lat',
+            # only read the columns we need
+            rename_cols = {self.source_column_names['lat']: 'lat',
                            self.source_column_names['lon']: 'lon'}
-            self.sources.set_index(self.source_column_names['idx'], inplace=True)
-            self.sources.rename(columns=rename_cols, inplace=True)
+            if self.source_column_names['population'] != 'skip':
+                rename_cols[self.source_column_names['population']] = 'population'
+            self.sources = self._read_columns(self.sources_filename,
+                                              self.source_column_names['idx'],
+                                              rename_cols)
         except KeyError:
             raise SourceDataNotParsableException()
 
-        # drop unused columns
-        columns_to_keep = list(rename_cols.values())
-        self.sources = self.sources[columns_to_keep]
+        # insert filler values for the population column if
+        # user does not want to include it. need it for coverage
+        if self.source_column_names['population'] == 'skip':
+            self.sources['population'] = 1
+
+        self._threshold_histograms = {}
 
     def reload_dests(self, filename=None):
         """
-        Load the dest points for the model (from csv).
+        Load the dest points for the model (from csv, parquet or feather).
         For each point, the table should contain:
         -unique identifier (integer or string)
         -latitude & longitude
@@ -317,7 +339,7 @@ class ModelData:
         -capacity (numeric) [only for some models]
 
         Args:
-            filename: string
+            filename: string or DataFrame
         Raises:
             DestDataNotFoundException: Cannot find dest
                 data.
@@ -325,12 +347,10 @@ class ModelData:
                 do not correspond to column names.
         """
 
-        if filename:
+        if filename is not None:
             self.destinations_filename = filename
 
-        try:
-            self.dests = pd.read_csv(self.destinations_filename)
-        except FileNotFoundError:
+        if not _readers.table_exists(self.destinations_filename):
             raise DestDataNotFoundException()
 
         if self.dest_column_names is None:
@@ -355,7 +375,7 @@ class ModelData:
 
             # extract the column names from the table for whichever fields
             # were not gleaned from self.dest_file_hints
-            dest_data_columns = self.dests.columns.values
+            dest_data_columns = _readers.read_column_names(self.destinations_filename)
             print('The variables in your data set are:')
             for var in dest_data_columns:
                 print('> ', var)
@@ -375,33 +395,27 @@ class ModelData:
                                       'category': category, 'capacity': capacity}
 
         try:
-            # insert filler values for the capacity column if
-            # user does not want to include it.
-            if self.dest_column_names['capacity'] == 'skip':
-                self.dests['capacity'] = 1
-
-            # insert filler values for the category column if
-            # user does not want to include it.
-            if self.dest_column_names['category'] == 'skip':
-                self.dests['category'] = 1
-
-            # rename columns, clean the data frame
+            # only read the columns we need
             rename_cols = {self.dest_column_names['lat']: 'lat', self.dest_column_names['lon']: 'lon'}
             if self.dest_column_names['capacity'] != 'skip':
                 rename_cols[self.dest_column_names['capacity']] = 'capacity'
             if self.dest_column_names['category'] != 'skip':
                 rename_cols[self.dest_column_names['category']] = 'category'
-
-            self.dests.set_index(self.dest_column_names['idx'], inplace=True)
-            self.dests.rename(columns=rename_cols, inplace=True)
-
+            self.dests = self._read_columns(self.destinations_filename,
+                                            self.dest_column_names['idx'],
+                                            rename_cols)
         except KeyError:
             raise DestDataNotParsableException()
 
-        # drop unused columns
-        columns_to_keep = list(rename_cols.values())
-        self.dests = self.dests[columns_to_keep]
+        # insert filler values for the capacity and category columns if
+        # user does not want to include them.
+        if self.dest_column_names['capacity'] == 'skip':
+            self.dests['capacity'] = 1
+        if self.dest_column_names['category'] == 'skip':
+            self.dests['category'] = 1
+
         self.all_categories = set(self.dests['category'])
+        self._threshold_histograms = {}
 
     def get_dests_in_range_of_source(self, source_id):
         """
@@ -538,6 +552,112 @@ class ModelData:
                 running_sum += self.get_capacity(dest_id)
         return running_sum
 
+    def precompute_thresholds(self, thresholds):
+        """
+        Bin the transit matrix by the given thresholds so that
+        calculate() can be called for any of them without
+        rescanning the matrix. Each histogram a model needs is
+        built in a single pass the first time it is used.
+        Args:
+            thresholds: list of numeric thresholds (seconds).
+        """
+        self._thresholds = sorted(set(int(threshold) for threshold in thresholds))
+        self._threshold_histograms = {}
+
+    def _is_precomputed_threshold(self, upper_threshold):
+        """
+        Args:
+            upper_threshold: numeric.
+        Returns: True if upper_threshold was passed to
+            precompute_thresholds.
+        """
+        return self._thresholds is not None and upper_threshold in self._thresholds
+
+    def _get_threshold_histograms(self, key, build):
+        """
+        Args:
+            key: hashable, identifies the histograms.
+            build: function returning the histograms.
+        Returns: the cached histograms for key, building
+            them if needed.
+        """
+        if key not in self._threshold_histograms:
+            self._threshold_histograms[key] = build()
+        return self._threshold_histograms[key]
+
+    def _build_category_histograms(self, categories, dest_weights):
+        """
+        Args:
+            categories: list of categories to bin by.
+            dest_weights: dest_id->[weight at each threshold] map
+                for the dests to include.
+        Returns: a source_id->[list of sums] map, see
+            MatrixInterface.get_source_threshold_histograms.
+        """
+        category_to_group = {category: group for group, category in enumerate(categories)}
+        dest_ids = [dest_id for dest_id in dest_weights
+                    if self.get_category(dest_id) in category_to_group]
+        dest_groups = [category_to_group[self.get_category(dest_id)] for dest_id in dest_ids]
+        return self.transit_matrix.matrix_interface.get_source_threshold_histograms(self._thresholds,
+                                                                                   dest_ids,
+                                                                                   dest_groups,
+                                                                                   [dest_weights[dest_id] for dest_id in dest_ids],
+                                                                                   len(categories))
+
+    def _read_category_histograms(self, histograms, categories, upper_threshold):
+        """
+        Args:
+            histograms: output of _build_category_histograms.
+            categories: list of categories the histograms were built with.
+            upper_threshold: numeric, a precomputed threshold.
+        Returns: a source_id->[value per category] map.
+        """
+        num_thresholds = len(self._thresholds)
+        threshold_index = self._thresholds.index(upper_threshold)
+        return {source_id: [histograms[source_id][group * num_thresholds + threshold_index]
+                            for group in range(len(categories))]
+                for source_id in self.get_all_source_ids()}
+
+    def get_category_sums_in_range(self, categories, upper_threshold, weight_column=None):
+        """
+        Args:
+            categories: list of categories.
+            upper_threshold: numeric, a threshold passed to
+                precompute_thresholds.
+            weight_column: column of the dests table to sum,
+                or None to count dests.
+        Returns: a source_id->[sum per category] map of the
+            dests in range of each source.
+        """
+        categories = list(categories)
+
+        def build():
+            num_thresholds = len(self._thresholds)
+            if weight_column is None:
+                weights = pd.Series(1, index=self.dests.index)
+            else:
+                weights = self.dests[weight_column]
+            dest_weights = {dest_id: [float(weight)] * num_thresholds
+                            for dest_id, weight in weights.items()}
+            return self._build_category_histograms(categories, dest_weights)
+
+        histograms = self._get_threshold_histograms(('category_sums', tuple(categories), weight_column),
+                                                    build)
+        return self._read_category_histograms(histograms, categories, upper_threshold)
+
+    def get_population_in_range_histograms(self):
+        """
+        Returns: a dest_id->[population in range at each
+            precomputed threshold] map.
+        """
+        def build():
+            population = self.sources['population'].clip(lower=0)
+            return self.transit_matrix.matrix_interface.get_dest_threshold_histograms(self._thresholds,
+                                                                                     list(population.index),
+                                                                                     [float(value) for value in population])
+
+        return self._get_threshold_histograms('population_in_range', build)
+
     def _print_data_frame(self):
         """
         Print the transit matrix.
@@ -4,6 +4,8 @@
 
 import pandas as pd
 
+from spatial_access import _readers
+
 
 class Configs:
     """
@@ -58,7 +60,20 @@ class Configs:
                  use_meters=False,
                  disable_area_threshold=False,
                  require_extended_range=False,
-                 epsilon=0.05
+                 epsilon=0.05,
+                 thread_limit=None,
+                 pin_threads=False,
+                 snap_to_edges=False,
+                 edge_multipliers=None,
+                 cache_tile_size=0.05,
+                 max_cache_size=2 * 1024 ** 3,
+                 osm_extract=None,
+                 simplify_network=False,
+                 overpass_url=None,
+                 fetch_workers=4,
+                 fetch_retries=3,
+                 max_memory=None,
+                 spill_directory=None
                  ):
         """
         Args:
@@ -77,6 +92,39 @@ class Configs:
             epsilon: numeric, factor by which to increase the requested bounding box.
                 Increasing epsilon may result in increased accuracy for points
                 at the edge of the bounding box, but will increase computation times.
+            thread_limit: int, number of worker threads used to compute the matrix.
+                Defaults to the number of CPUs available to this process (respecting
+                CPU affinity and cgroup quotas).
+            pin_threads: boolean, pin each worker thread to one CPU so its scratch
+                buffers are allocated on the local NUMA node (Linux only).
+            snap_to_edges: boolean, snap each point to the nearest point on the
+                nearest edge (splitting the edge there) instead of to the nearest
+                node. More accurate on sparse networks.
+            edge_multipliers: optional DataFrame, or csv, parquet or feather filename,
+                with columns from, to (osm node ids) and multiplier. The travel time
+                of each matching edge is multiplied by multiplier (for example
+                to model congestion in a time of day profile). Ignored if
+                use_meters is true.
+            cache_tile_size: numeric, size (degrees) of the grid tiles networks are
+                fetched from OSM and cached in.
+            max_cache_size: int, maximum size (bytes) of the network tile cache. The
+                least recently used tiles are evicted beyond it (None for no limit).
+            osm_extract: optional, local .osm or .osm.pbf (requires pyosmium) filename.
+                If given, networks are built from it instead of querying OSM.
+            simplify_network: boolean, merge chains of degree-2 network nodes into
+                single edges before computing the matrix. Results are unchanged,
+                but fewer nodes are visited by the shortest path search.
+            overpass_url: optional, url of the Overpass API interpreter networks are
+                fetched from (defaults to the public server osmnet uses).
+            fetch_workers: int, number of network tiles fetched concurrently.
+            fetch_retries: int, number of times a failed tile request is retried,
+                with exponential backoff.
+            max_memory: optional int, maximum size (bytes) of the matrix values held
+                in memory. Larger matrices are kept in a memory mapped file instead,
+                which the OS pages in and out of memory as needed (slower, but
+                bounded by disk rather than memory).
+            spill_directory: optional, directory for the memory mapped matrix files
+                (defaults to the system temporary directory).
         """
         self.ONE_HOUR = 3600  # seconds
         self.ONE_KM = 1000  # meters
@@ -93,6 +141,19 @@ class Configs:
         self.disable_area_threshold = disable_area_threshold
         self.require_extended_range = require_extended_range
         self.epsilon = epsilon
+        self.thread_limit = thread_limit
+        self.pin_threads = pin_threads
+        self.snap_to_edges = snap_to_edges
+        self.edge_multipliers = edge_multipliers
+        self.cache_tile_size = cache_tile_size
+        self.max_cache_size = max_cache_size
+        self.osm_extract = osm_extract
+        self.simplify_network = simplify_network
+        self.overpass_url = overpass_url
+        self.fetch_workers = fetch_workers
+        self.fetch_retries = fetch_retries
+        self.max_memory = max_memory
+        self.spill_directory = spill_directory
 
         if speed_limit_dict is None:
             self.speed_limit_dict = Configs.DEFAULT_SPEED_LIMITS
@@ -107,6 +168,17 @@ class Configs:
                                       orient='index',
                                       columns=['unit_cost'])
 
+    def _get_edge_multipliers(self):
+        """
+        Returns: Series of edge travel time multipliers indexed
+            by (from, to), or None.
+        """
+        if self.edge_multipliers is None:
+            return None
+        multipliers = _readers.read_table(self.edge_multipliers, ['from', 'to', 'multiplier'],
+                                          dtype={'multiplier': 'float64'})
+        return multipliers.groupby(['from', 'to'])['multiplier'].last()
+
     def _get_walk_speed(self):
         """
         Returns: walk speed in meters/second.
@@ -3,47 +3,73 @@
 # ©2017-2019, Center for Spatial Data Science
 
 import multiprocessing
+import math
 import time
 import os
 import csv
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 from spatial_access.SpatialAccessExceptions import WriteCSVFailedException
 from spatial_access.SpatialAccessExceptions import WriteTMXFailedException
 from spatial_access.SpatialAccessExceptions import ReadTMXFailedException
 from spatial_access.SpatialAccessExceptions import ReadCSVFailedException
+from spatial_access.SpatialAccessExceptions import WriteArrowFailedException
+from spatial_access.SpatialAccessExceptions import ReadArrowFailedException
 from spatial_access.SpatialAccessExceptions import ReadOTPCSVFailedException
 from spatial_access.SpatialAccessExceptions import UnrecognizedFileTypeException
 from spatial_access.SpatialAccessExceptions import IndecesNotFoundException
 from spatial_access.SpatialAccessExceptions import SourceNotBuiltException
 from spatial_access.SpatialAccessExceptions import UnableToBuildMatrixException
+from spatial_access.SpatialAccessExceptions import MatrixBuildCancelledException
 from spatial_access.SpatialAccessExceptions import UnexpectedShapeException
 from spatial_access._parsers import BaseParser, IntStringParser, StringIntParser, StringStringParser
+from spatial_access import _arrow
 
 try:
     import _p2pExtension
 except ImportError:
     raise SourceNotBuiltException()
 
+# values copied into or out of the matrix at a time, by row blocks
+VALUES_PER_CHUNK = 2 ** 20
+
 
 class MatrixInterface:
     """
     A wrapper for C++ based transit matrix.
     """
 
-    def __init__(self, logger=None, require_extended_range=False):
+    def __init__(self, logger=None, require_extended_range=False,
+                 thread_limit=None, pin_threads=False, max_memory=None,
+                 spill_directory=None):
         """
         Args:
             logger: optional
             require_extended_range: Bool. If true, use unsigned integers
                 instead of unsigned shorts for value type to increase
                 max range.
+            thread_limit: optional int, number of worker threads. Defaults
+                to the number of CPUs available to this process.
+            pin_threads: Bool. If true, pin worker threads to CPUs.
+            max_memory: optional int, bytes. Matrices whose values would
+                exceed it are kept in a memory mapped file instead, which
+                the OS pages in and out of memory as needed.
+            spill_directory: optional, directory for the memory mapped
+                files (defaults to the system temporary directory).
         """
         self.logger = logger
+        self.thread_limit = thread_limit
+        self.pin_threads = pin_threads
+        self.max_memory = max_memory
+        self.spill_directory = spill_directory
         self.transit_matrix = None
         self.primary_ids_are_string = False
         self.secondary_ids_are_string = False
         self.is_extended = require_extended_range
         self._parser = None
+        self._cancel_requested = False
         self._map_id_type_enum_to_is_string_boolean = {
             0: False,
             1: True
@@ -76,12 +102,52 @@ class MatrixInterface:
 
         self._load_parser()
         self._load_extension()
+        spill_directory = self._get_spill_directory(tmx_type_reader.get_is_compressible(),
+                                                    tmx_type_reader.get_rows(),
+                                                    tmx_type_reader.get_cols())
 
         try:
-            self.transit_matrix.readTMX(self._parser.encode_filename(filename))
+            self.transit_matrix.readTMX(self._parser.encode_filename(filename),
+                                        self._parser.encode_filename(spill_directory or ''))
         except BaseException:
             raise ReadTMXFailedException("Unable to read tmx from {}".format(filename))
 
+    def read_tmx_shards(self, filenames):
+        """
+        Read a matrix that was computed in row blocks (see
+        p2p.TransitMatrix.process_partitioned) and merge the
+        blocks, in the given order, into one matrix.
+        Args:
+            filenames: list of filenames with .tmx extension.
+        Raises:
+            ReadTMXFailedException: a file does not exist, is corrupted,
+                or the shards do not share the same columns.
+        """
+        if len(filenames) == 0:
+            raise ReadTMXFailedException("no shards given")
+        for filename in filenames:
+            if not os.path.exists(filename):
+                raise ReadTMXFailedException("{} does not exist".format(filename))
+        tmx_type_reader = _p2pExtension.pyTMXTypeReader(filenames[0].encode('utf-8'))
+
+        self.primary_ids_are_string = self._map_id_type_enum_to_is_string_boolean[
+            tmx_type_reader.get_row_type_enum()]
+        self.secondary_ids_are_string = self._map_id_type_enum_to_is_string_boolean[
+            tmx_type_reader.get_col_type_enum()]
+        self.is_extended = self._map_value_type_enum_to_is_extended_boolean[
+            tmx_type_reader.get_value_type_enum()]
+
+        self._load_parser()
+        self._load_extension()
+        rows = sum(_p2pExtension.pyTMXTypeReader(filename.encode('utf-8')).get_rows() for filename in filenames)
+        spill_directory = self._get_spill_directory(False, rows, tmx_type_reader.get_cols())
+
+        try:
+            self.transit_matrix.readTMXShards([self._parser.encode_filename(filename) for filename in filenames],
+                                              self._parser.encode_filename(spill_directory or ''))
+        except BaseException:
+            raise ReadTMXFailedException("Unable to read tmx shards from {}".format(filenames))
+
     def _read_csv(self, filename):
         """
         Read the transit matrix from MxN csv. Warning:
@@ -98,6 +164,7 @@ class MatrixInterface:
             reader = csv.reader(csvfile)
             header = next(reader)
             first_line = next(reader)
+            rows = 1 + sum(1 for _ in reader)
 
         try:
             int(header[1])
@@ -110,30 +177,81 @@ class MatrixInterface:
 
         self._load_parser()
         self._load_extension()
+        # (the header ends with a comma)
+        columns = len([label for label in header[1:] if label])
+        spill_directory = self._get_spill_directory(False, rows, columns)
 
         try:
-            self.transit_matrix.readCSV(self._parser.encode_filename(filename))
+            self.transit_matrix.readCSV(self._parser.encode_filename(filename),
+                                        self._parser.encode_filename(spill_directory or ''))
         except BaseException:
             raise ReadCSVFailedException(filename)
 
+    def _read_arrow(self, filename):
+        """
+        Read the transit matrix from a parquet or arrow (IPC) file
+        written by write_arrow, or by another tool in the long
+        (origin, dest, cost) layout or the wide layout (an origin
+        column, then one column per dest). Costs should be integers.
+        Requires pyarrow.
+        Args:
+            filename: filename with a parquet or arrow extension.
+        Raises:
+            ReadArrowFailedException: file does not exist or is not
+                a transit matrix.
+        """
+        if not os.path.exists(filename):
+            raise ReadArrowFailedException("{} does not exist".format(filename))
+        try:
+            value_chunks, source_ids, dest_ids, sources_are_string, dests_are_string, value_dtype = \
+                _arrow.table_to_matrix(_arrow.read_table(filename), VALUES_PER_CHUNK)
+
+            self.primary_ids_are_string = sources_are_string
+            self.secondary_ids_are_string = dests_are_string
+            self.is_extended = value_dtype == np.uint32
+
+            self._load_parser()
+            self._load_extension()
+            spill_directory = self._get_spill_directory(False, len(source_ids), len(dest_ids))
+
+            self.transit_matrix.setIds(self._parser.encode_vector_source_ids(source_ids),
+                                       self._parser.encode_vector_dest_ids(dest_ids),
+                                       self._parser.encode_filename(spill_directory or ''))
+            for first_row, values in value_chunks:
+                self.transit_matrix.setRowValueArray(values, first_row)
+        except (KeyError, ValueError) as error:
+            raise ReadArrowFailedException("Unable to read matrix from {}: {}".format(filename, error))
+
     def read_file(self, filename):
         """
         Read the transit matrix from binary format.
         (suitable for quickly saving/reloading for
         extended computations).
         Args:
-            filename: filename with .tmx or .csv extension
+            filename: filename with .tmx, .csv, parquet or arrow extension,
+                or a directory of .tmx shards (read in filename order).
+
+        Matrices over max_memory are kept in a memory mapped file
+        in spill_directory, as in prepare_matrix.
+
         Raises:
-            UnrecognizedFileTypeException: filename without .tmx or .csv
-                extension.
+            UnrecognizedFileTypeException: filename without .tmx, .csv,
+                parquet or arrow extension.
         """
         if not os.path.exists(filename):
             raise FileNotFoundError(filename)
+        if os.path.isdir(filename):
+            shards = sorted(os.path.join(filename, shard) for shard in os.listdir(filename)
+                            if shard.endswith('.tmx'))
+            self.read_tmx_shards(shards)
+            return
         extension = filename.split('.')[-1]
         if extension == 'tmx':
             self._read_tmx(filename)
         elif extension == 'csv':
             self._read_csv(filename)
+        elif _arrow.is_arrow_filename(filename):
+            self._read_arrow(filename)
         else:
             raise UnrecognizedFileTypeException(extension)
 
@@ -155,6 +273,39 @@ class MatrixInterface:
         if self.logger:
             self.logger.info('Wrote to {} in {:,.2f} seconds'.format(filename, time.time() - start))
 
+    def write_arrow(self, filename, layout='long', row_group_size=None):
+        """
+        Write the transit matrix to parquet or arrow (IPC), for
+        tools like Spark or DuckDB. String ids are dictionary
+        encoded. Requires pyarrow.
+        Args:
+            filename: filename with a parquet (.parquet, .pq) or
+                arrow (.arrow, .ipc, .feather) extension.
+            layout: 'long', one (origin, dest, cost) row per reachable
+                pair, or 'wide', one row per origin with a cost column
+                per dest (null where unreachable).
+            row_group_size: optional int, maximum rows per parquet row
+                group (or arrow record batch).
+        Raises:
+            WriteArrowFailedException: unknown layout or extension, or
+                unable to write the file.
+        """
+        start = time.time()
+        if not _arrow.is_arrow_filename(filename):
+            raise WriteArrowFailedException('{} is not a parquet or arrow filename'.format(filename))
+        value_chunks, source_ids, dest_ids = self.get_values_array_chunks()
+        try:
+            schema, batches = _arrow.matrix_to_batches(value_chunks, source_ids, dest_ids,
+                                                       self.primary_ids_are_string,
+                                                       self.secondary_ids_are_string,
+                                                       self._get_value_dtype(),
+                                                       layout=layout)
+            _arrow.write_batches(schema, batches, filename, row_group_size=row_group_size)
+        except (ValueError, OSError) as error:
+            raise WriteArrowFailedException('Unable to write {}: {}'.format(filename, error))
+        if self.logger:
+            self.logger.info('Wrote to {} in {:,.2f} seconds'.format(filename, time.time() - start))
+
     def add_edges_to_graph(self, from_column, to_column, edge_weight_column,
                            is_bidirectional_column):
         """
@@ -163,8 +314,37 @@ class MatrixInterface:
             to_column: array of integers, network node ids.
             edge_weight_column: array of integers, edge weights.
             is_bidirectional_column:, array of booleans, is the edge bidirectional.
+        Raises:
+            OverflowError: an edge weight is out of range of the value type.
+        """
+        self.transit_matrix.addEdgesToGraph(np.ascontiguousarray(from_column, dtype='L'),
+                                            np.ascontiguousarray(to_column, dtype='L'),
+                                            self._as_value_array(edge_weight_column),
+                                            np.ascontiguousarray(is_bidirectional_column, dtype=bool))
+
+    def contract_edges(self, from_column, to_column, edge_weight_column,
+                       is_bidirectional_column, keep_mask):
+        """
+        Merge chains of degree-2 vertices into single edges, so fewer
+        vertices are visited by the shortest path search. Merged edges
+        get the sum of the weights, so the shortest paths between the
+        remaining vertices are unchanged.
+        Args:
+            from_column: array of integers, network node ids.
+            to_column: array of integers, network node ids.
+            edge_weight_column: array of integers, edge weights.
+            is_bidirectional_column:, array of booleans, is the edge bidirectional.
+            keep_mask: array of booleans, one per network node, true for the
+                nodes that must not be contracted (for example those user
+                data is matched to).
+        Returns: the contracted from, to, edge weight and is bidirectional columns.
+        Raises:
+            OverflowError: an edge weight is out of range of the value type.
         """
-        self.transit_matrix.addEdgesToGraph(from_column, to_column, edge_weight_column, is_bidirectional_column)
+        return _p2pExtension.getContractedNetwork(from_column, to_column,
+                                                  self._as_value_array(edge_weight_column),
+                                                  is_bidirectional_column, keep_mask,
+                                                  np.iinfo(self._get_value_dtype()).max)
 
     def read_otp(self, filename):
         """
@@ -220,12 +400,54 @@ class MatrixInterface:
         return self._parser.decode_vector_of_source_tuples(self.transit_matrix.getValuesByDest(self._parser.encode_dest_id(dest_id),
                                                                                                sort))
 
-    @staticmethod
-    def _get_thread_limit():
+    def _get_thread_limit(self):
         """
         Returns: int (num threads to use)
         """
-        return multiprocessing.cpu_count()
+        if self.thread_limit:
+            return self.thread_limit
+        return self._get_available_cpus()
+
+    @staticmethod
+    def _get_available_cpus():
+        """
+        Returns: int, the number of CPUs this process may use, taking
+            CPU affinity and cgroup (v1 or v2) CPU quotas into account.
+        """
+        try:
+            available = len(os.sched_getaffinity(0))
+        except AttributeError:
+            available = multiprocessing.cpu_count()
+        quota = MatrixInterface._get_cgroup_cpu_quota()
+        if quota is not None:
+            available = min(available, quota)
+        return max(available, 1)
+
+    @staticmethod
+    def _get_cgroup_cpu_quota():
+        """
+        Returns: int, CPUs allowed by the cgroup CPU quota, or None
+            if there is no quota.
+        """
+        try:
+            with open('/sys/fs/cgroup/cpu.max') as cpu_max_file:
+                quota, period = cpu_max_file.read().split()
+            if quota == 'max':
+                return None
+            return int(math.ceil(int(quota) / int(period)))
+        except (OSError, ValueError):
+            pass
+        for directory in ['/sys/fs/cgroup/cpu', '/sys/fs/cgroup/cpu,cpuacct']:
+            try:
+                with open(os.path.join(directory, 'cpu.cfs_quota_us')) as quota_file:
+                    quota = int(quota_file.read())
+                with open(os.path.join(directory, 'cpu.cfs_period_us')) as period_file:
+                    period = int(period_file.read())
+            except (OSError, ValueError):
+                continue
+            if quota > 0 and period > 0:
+                return int(math.ceil(quota / period))
+        return None
 
     def add_user_source_data(self, network_id, user_id, weight, is_also_dest):
         """
@@ -256,6 +478,90 @@ class MatrixInterface:
                                                        self._parser.encode_dest_id(user_id),
                                                        weight)
 
+    def add_user_source_data_bulk(self, network_ids, user_ids, weights, is_also_dest):
+        """
+        Add many of the user's source data points to the pyTransitMatrix
+        in one call.
+        Args:
+            network_ids: array of int, osm node locs
+            user_ids: array of string or int
+            weights: array of int, edge weights
+            is_also_dest: boolean, true for symmetric matrices
+        Raises:
+            OverflowError: a weight is out of range of the value type.
+        """
+        network_ids = np.ascontiguousarray(network_ids, dtype='L')
+        weights = self._as_value_array(weights)
+        user_ids = np.asarray(user_ids).tolist()
+        self.transit_matrix.addUserSourceDataBulk(network_ids,
+                                                  self._parser.encode_vector_source_ids(user_ids),
+                                                  weights)
+        if is_also_dest:
+            self.transit_matrix.addUserDestDataBulk(network_ids,
+                                                    self._parser.encode_vector_dest_ids(user_ids),
+                                                    weights)
+
+    def add_user_dest_data_bulk(self, network_ids, user_ids, weights):
+        """
+        Add many of the user's dest data points to the pyTransitMatrix
+        in one call.
+        Args:
+            network_ids: array of int, osm node locs
+            user_ids: array of string or int
+            weights: array of int, edge weights
+        Raises:
+            OverflowError: a weight is out of range of the value type.
+        """
+        self.transit_matrix.addUserDestDataBulk(np.ascontiguousarray(network_ids, dtype='L'),
+                                                self._parser.encode_vector_dest_ids(np.asarray(user_ids).tolist()),
+                                                self._as_value_array(weights))
+
+    def _get_value_dtype(self):
+        """
+        Returns: numpy dtype of the matrix values.
+        """
+        if self.is_extended:
+            return np.uint32
+        return np.uint16
+
+    def _as_value_array(self, values):
+        """
+        Args:
+            values: array of int.
+        Returns: contiguous numpy array of the matrix value type.
+        Raises:
+            OverflowError: a value is out of range of the value type.
+        """
+        values = np.asarray(values)
+        value_dtype = self._get_value_dtype()
+        if values.size > 0 and (values.min() < 0 or values.max() > np.iinfo(value_dtype).max):
+            raise OverflowError('values should be between 0 and {}'.format(np.iinfo(value_dtype).max))
+        return np.ascontiguousarray(values, dtype=value_dtype)
+
+    def _get_spill_directory(self, is_compressible, rows, columns):
+        """
+        Args:
+            is_compressible: boolean, true if only the upper triangle is stored.
+            rows: number of user rows.
+            columns: number of user columns.
+        Returns: directory to memory map the matrix values in, or None
+            if they fit within max_memory.
+        """
+        if self.max_memory is None:
+            return None
+        if is_compressible:
+            num_values = rows * (rows + 1) // 2
+        else:
+            num_values = rows * columns
+        matrix_size = num_values * np.dtype(self._get_value_dtype()).itemsize
+        if matrix_size <= self.max_memory:
+            return None
+        spill_directory = self.spill_directory if self.spill_directory is not None else tempfile.gettempdir()
+        if self.logger:
+            self.logger.info('Matrix needs {:,} bytes, more than max_memory ({:,}): memory mapping it in {}'.format(
+                matrix_size, self.max_memory, spill_directory))
+        return spill_directory
+
     def _load_parser(self):
         """
         Load the relevant variant of parser.
@@ -298,7 +604,8 @@ class MatrixInterface:
         """
         self.transit_matrix = self._get_extension()()
 
-    def prepare_matrix(self, is_symmetric, is_compressible, rows, columns, network_vertices):
+    def prepare_matrix(self, is_symmetric, is_compressible, rows, columns, network_vertices,
+                       row_offset=None, stream_filename=None, stream_cutoff=None):
         """
         Instantiate a pyTransitMatrix.
         Args:
@@ -309,21 +616,55 @@ class MatrixInterface:
             rows: number of user rows.
             columns: number of user columns.
             network_vertices: number of vertices in osm network.
+            row_offset: optional int. If given, this matrix is the block of
+                rows [row_offset, row_offset + rows) of a partitioned matrix.
+            stream_filename: optional. If given, build_matrix writes each row
+                to this file as it is computed (as headerless source,dest,value
+                lines, the format read by read_otp) instead of keeping the
+                matrix in memory. Unreachable cells are dropped.
+            stream_cutoff: optional int. If given, streamed cells with a
+                value above stream_cutoff are dropped.
+
+        If the matrix values would exceed max_memory, they are kept
+        in a memory mapped file in spill_directory.
 
         Raises:
             UnexpectedShapeException: if a matrix is symmetric but has mismatched rows and
-                columns, or if matrix is marked is_compressible but not is_symmetric.
-        """
-        if is_symmetric and rows != columns:
+                columns, or if matrix is marked is_compressible but not is_symmetric,
+                or if a partition or a streamed matrix is compressible or does not fit
+                in the matrix.
+        """
+        if row_offset is not None:
+            if is_compressible:
+                raise UnexpectedShapeException("Partitioned matrices cannot be compressible")
+            if is_symmetric and row_offset + rows > columns:
+                raise UnexpectedShapeException("Rows {}-{} exceed the {} columns of the matrix".format(
+                    row_offset, row_offset + rows, columns))
+        elif is_symmetric and rows != columns:
             raise UnexpectedShapeException("Symmetric matrices should be nxn, not {}x{}".format(rows, columns))
         if is_compressible and not is_symmetric:
             raise UnexpectedShapeException("If matrix is compressible, it is also symmetric")
+        if is_compressible and stream_filename is not None:
+            raise UnexpectedShapeException("Streamed matrices cannot be compressible")
         if is_symmetric:
             self.secondary_ids_are_string = self.primary_ids_are_string
 
         self._load_parser()
 
-        self.transit_matrix = self._get_extension()(is_compressible, is_symmetric, rows, columns)
+        spill_directory = None
+        if stream_filename is None:
+            spill_directory = self._get_spill_directory(is_compressible, rows, columns)
+        self.transit_matrix = self._get_extension()(is_compressible, is_symmetric, rows, columns,
+                                                    stream_filename is not None,
+                                                    self._parser.encode_filename(spill_directory or ''))
+        if row_offset is not None:
+            self.transit_matrix.setRowOffset(row_offset)
+        if stream_filename is not None:
+            max_value = int(np.iinfo(self._get_value_dtype()).max)
+            if stream_cutoff is None or stream_cutoff > max_value:
+                stream_cutoff = max_value
+            self.transit_matrix.setStreamingOutput(self._parser.encode_filename(stream_filename),
+                                                   max(0, int(stream_cutoff)))
 
         self.transit_matrix.prepareGraphWithVertices(network_vertices)
 
@@ -348,23 +689,77 @@ class MatrixInterface:
         Raises:
             UnableToBuildMatrixException: transit matrix encountered
                 an internal error.
+            MatrixBuildCancelledException: cancel_build was called
+                before or during the computation.
         """
 
         start_time = time.time()
 
+        self._raise_if_cancelled()
         thread_limit = self._get_thread_limit()
         if self.logger:
             self.logger.debug('Processing matrix with {} threads'.format(thread_limit))
         try:
-            self.transit_matrix.compute(thread_limit)
+            self.transit_matrix.compute(thread_limit, self.pin_threads)
         except BaseException:
             raise UnableToBuildMatrixException()
+        self._raise_if_cancelled()
 
         logger_vars = time.time() - start_time
         if self.logger:
             self.logger.debug('Shortest path matrix computed in {:,.2f} seconds'
                               .format(logger_vars))
 
+    def build_matrix_async(self, executor=None):
+        """
+        Build the matrix in the background. The computation releases
+        the GIL, so get_build_progress and cancel_build may be called
+        from other threads while the future is pending. To await the
+        result from a coroutine, wrap the future with asyncio.wrap_future.
+        Args:
+            executor: optional, a thread based concurrent.futures.Executor.
+                If None, a single use thread pool is created.
+        Returns: concurrent.futures.Future which resolves when the
+            matrix is built, or raises the exceptions of build_matrix.
+        """
+        if executor is not None:
+            return executor.submit(self.build_matrix)
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.build_matrix)
+        executor.shutdown(wait=False)
+        return future
+
+    def get_build_progress(self):
+        """
+        Returns: tuple of (rows completed, total rows) for the
+            current (or last) call to build_matrix.
+        """
+        if self.transit_matrix is None:
+            return 0, 0
+        return self.transit_matrix.getRowsCompleted(), self.transit_matrix.getRows()
+
+    def cancel_build(self):
+        """
+        Request cooperative cancellation of build_matrix. Worker threads
+        finish the row they are on and stop; build_matrix then raises
+        MatrixBuildCancelledException. The matrix is left incomplete.
+        If no build is running, the next one is cancelled.
+        """
+        self._cancel_requested = True
+        if self.transit_matrix is not None:
+            self.transit_matrix.requestCancel()
+
+    def _raise_if_cancelled(self):
+        """
+        Raises:
+            MatrixBuildCancelledException: cancel_build has been called
+                (since the last time this was raised).
+        """
+        if self._cancel_requested or (self.transit_matrix is not None and self.transit_matrix.wasCancelled()):
+            # the cancellation is delivered, later builds run
+            self._cancel_requested = False
+            raise MatrixBuildCancelledException()
+
     def get_dests_in_range(self, threshold):
         """
         Args:
@@ -387,6 +782,98 @@ class MatrixInterface:
         """
         return self._parser.decode_dest_to_source_array_dict(self.transit_matrix.getSourcesInRange(threshold))
 
+    def get_values_array(self):
+        """
+        Returns: (values, source_ids, dest_ids) where values is
+            a dense numpy array of shape (len(source_ids), len(dest_ids)),
+            row i and column j holding the value from source_ids[i]
+            to dest_ids[j].
+        """
+        values = self.transit_matrix.getValueArray()
+        source_ids = self._parser.decode_vector_source_ids(self.transit_matrix.getRowIds())
+        dest_ids = self._parser.decode_vector_dest_ids(self.transit_matrix.getColIds())
+        return values, source_ids, dest_ids
+
+    def get_values_array_chunks(self, rows_per_chunk=None):
+        """
+        Like get_values_array, without copying the whole matrix at once.
+        Args:
+            rows_per_chunk: optional int, number of rows per block.
+                Defaults to about VALUES_PER_CHUNK values per block.
+        Returns: (value_chunks, source_ids, dest_ids) where value_chunks
+            yields (first_row, values) for each block of rows in order,
+            values holding rows [first_row, first_row + len(values))
+            of the dense array given by get_values_array.
+        """
+        source_ids = self._parser.decode_vector_source_ids(self.transit_matrix.getRowIds())
+        dest_ids = self._parser.decode_vector_dest_ids(self.transit_matrix.getColIds())
+        if rows_per_chunk is None:
+            rows_per_chunk = max(1, VALUES_PER_CHUNK // max(1, len(dest_ids)))
+        value_chunks = ((first_row, self.transit_matrix.getRowValueArray(
+                            first_row, min(rows_per_chunk, len(source_ids) - first_row)))
+                        for first_row in range(0, len(source_ids), rows_per_chunk))
+        return value_chunks, source_ids, dest_ids
+
+    def get_scaled_copy(self, scale):
+        """
+        Args:
+            scale: numeric, factor to multiply every value by.
+        Returns: a new MatrixInterface holding a copy of this matrix
+            with every value multiplied by scale (truncated). Values
+            that no longer fit in the value type become unreachable.
+        """
+        scaled = MatrixInterface(logger=self.logger,
+                                 require_extended_range=self.is_extended,
+                                 thread_limit=self.thread_limit,
+                                 pin_threads=self.pin_threads,
+                                 max_memory=self.max_memory,
+                                 spill_directory=self.spill_directory)
+        scaled.primary_ids_are_string = self.primary_ids_are_string
+        scaled.secondary_ids_are_string = self.secondary_ids_are_string
+        scaled._load_parser()
+        scaled._load_extension()
+        scaled.transit_matrix.copyScaledFrom(self.transit_matrix, scale)
+        return scaled
+
+    def get_source_threshold_histograms(self, thresholds, dest_ids, dest_groups,
+                                        dest_weights, num_groups):
+        """
+        Bin every source's dests by group and threshold in one
+        pass over the matrix.
+        Args:
+            thresholds: sorted list of integer thresholds.
+            dest_ids: list of dest_ids to include.
+            dest_groups: list of group indices (0 to num_groups - 1),
+                one per dest_id.
+            dest_weights: list of lists, the weight of each dest_id
+                at each threshold.
+            num_groups: integer, number of groups.
+        Returns:
+            a source_id->[list of sums] map. Entry
+            group * len(thresholds) + i holds the sum of the weights
+            of dests in group that are within thresholds[i] of the source.
+        """
+        histograms = self.transit_matrix.getRowThresholdHistograms(thresholds,
+                                                                   self._parser.encode_vector_dest_ids(dest_ids),
+                                                                   dest_groups, dest_weights, num_groups)
+        return dict(self._parser.decode_vector_of_source_tuples(histograms))
+
+    def get_dest_threshold_histograms(self, thresholds, source_ids, source_weights):
+        """
+        Bin every dest's sources by threshold in one pass over the matrix.
+        Args:
+            thresholds: sorted list of integer thresholds.
+            source_ids: list of source_ids to include.
+            source_weights: list of weights, one per source_id.
+        Returns:
+            a dest_id->[list of sums] map. Entry i holds the sum of the
+            weights of sources that are within thresholds[i] of the dest.
+        """
+        histograms = self.transit_matrix.getColThresholdHistograms(thresholds,
+                                                                   self._parser.encode_vector_source_ids(source_ids),
+                                                                   source_weights)
+        return dict(self._parser.decode_vector_of_dest_tuples(histograms))
+
     def _get_value_by_id(self, source_id, dest_id):
         """
         Warning: should not be used in production.
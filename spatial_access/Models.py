@@ -11,6 +11,7 @@ from spatial_access.SpatialAccessExceptions import UnexpectedNormalizeColumnsExc
 from spatial_access.SpatialAccessExceptions import UnexpectedEmptyColumnException
 
 import math
+import numpy as np
 
 # TODO: Don't prompt for variable for models which don't use them
 def linear_decay_function(time, upper):
@@ -43,6 +44,33 @@ def logit_decay_function(time, upper):
     else:
         return 1-(1/(math.exp((upper/180)-(.48/60)*time)+1))
 
+def linear_decay_array(times, upper):
+    """
+    linear_decay_function applied to an array of times.
+    """
+    return np.where(times > upper, 0, (upper - times) / upper)
+
+
+def root_decay_array(times, upper):
+    """
+    root_decay_function applied to an array of times.
+    """
+    return np.where(times > upper, 0, (1 / math.sqrt(upper)) * (-times ** 0.5) + 1)
+
+
+def logit_decay_array(times, upper):
+    """
+    logit_decay_function applied to an array of times.
+    """
+    with np.errstate(over='ignore'):
+        return np.where(times > upper, 0, 1 - (1 / (np.exp((upper / 180) - (.48 / 60) * times) + 1)))
+
+
+DECAY_ARRAY_FUNCTIONS = {linear_decay_function: linear_decay_array,
+                         root_decay_function: root_decay_array,
+                         logit_decay_function: logit_decay_array}
+
+
 # TODO: separate each category into its own column
 class Coverage(ModelData):
     """
@@ -224,6 +252,10 @@ class TSFCA(ModelData):
 
         Returns: DataFrame
         """
+        if self._is_precomputed_threshold(upper_threshold):
+            self._calculate_from_histograms(upper_threshold)
+            return
+
         self.calculate_sources_in_range(upper_threshold)
         self.calculate_dests_in_range(upper_threshold)
 
@@ -256,6 +288,37 @@ class TSFCA(ModelData):
                 if category in self.focus_categories:
                     results[source_id][column_name_to_index[category]] += dests_capacity[dest_id]
 
+        self._set_results(results, column_names)
+
+    def _calculate_from_histograms(self, upper_threshold):
+        """
+        Calculate for a threshold passed to precompute_thresholds.
+        Args:
+            upper_threshold: numeric, time in seconds.
+        """
+        categories = list(self.focus_categories)
+        column_names = ['percap_spend_' + category for category in categories]
+
+        def build():
+            # per dest, the capacity per resident in range at each threshold
+            population_in_range = self.get_population_in_range_histograms()
+            dest_weights = {}
+            for dest_id in self.get_all_dest_ids():
+                capacity = self.get_capacity(dest_id)
+                dest_weights[dest_id] = [capacity / population if population > 0 else 0
+                                         for population in population_in_range[dest_id]]
+            return self._build_category_histograms(categories, dest_weights)
+
+        histograms = self._get_threshold_histograms(('percap_spend', tuple(categories)), build)
+        results = self._read_category_histograms(histograms, categories, upper_threshold)
+        self._set_results(results, column_names)
+
+    def _set_results(self, results, column_names):
+        """
+        Args:
+            results: source_id->[percap spend per category] map.
+            column_names: list of result column names.
+        """
         self.model_results = pd.DataFrame.from_dict(results, orient='index',
                                                     columns=column_names)
         self.model_results['percap_spend_all_categories'] = self.model_results.sum(axis=1)
@@ -367,14 +430,19 @@ class AccessCount(ModelData):
         results = {}
         focus_categories_list = list(self.focus_categories)
         column_names = ['count_in_range_' + category for category in focus_categories_list]
-        self.calculate_dests_in_range(upper_threshold)
-        for source_id in self.get_all_source_ids():
-            results[source_id] = []
-            for category in focus_categories_list:
-                count_in_range = self.count_dests_in_range_by_categories(source_id=source_id,
-                                                                                category=category,
-                                                                                    upper_threshold=upper_threshold)
-                results[source_id].append(count_in_range)
+        if self._is_precomputed_threshold(upper_threshold):
+            counts = self.get_category_sums_in_range(focus_categories_list, upper_threshold)
+            for source_id, source_counts in counts.items():
+                results[source_id] = [int(count) for count in source_counts]
+        else:
+            self.calculate_dests_in_range(upper_threshold)
+            for source_id in self.get_all_source_ids():
+                results[source_id] = []
+                for category in focus_categories_list:
+                    count_in_range = self.count_dests_in_range_by_categories(source_id=source_id,
+                                                                                    category=category,
+                                                                                        upper_threshold=upper_threshold)
+                    results[source_id].append(count_in_range)
 
         self.model_results = pd.DataFrame.from_dict(results, orient='index',
                                                     columns=column_names)
@@ -432,13 +500,17 @@ class AccessSum(ModelData):
         results = {}
         focus_categories_list = list(self.focus_categories)
         column_names = ['sum_in_range_' + category for category in focus_categories_list]
-        self.calculate_dests_in_range(upper_threshold)
-        for source_id in self.get_all_source_ids():
-            results[source_id] = []
-            for category in focus_categories_list:
-                sum_in_range = self.count_sum_in_range_by_categories(source_id,
-                                                                                    category)
-                results[source_id].append(sum_in_range)
+        if self._is_precomputed_threshold(upper_threshold):
+            results = self.get_category_sums_in_range(focus_categories_list, upper_threshold,
+                                                      weight_column='capacity')
+        else:
+            self.calculate_dests_in_range(upper_threshold)
+            for source_id in self.get_all_source_ids():
+                results[source_id] = []
+                for category in focus_categories_list:
+                    sum_in_range = self.count_sum_in_range_by_categories(source_id,
+                                                                                        category)
+                    results[source_id].append(sum_in_range)
 
         self.model_results = pd.DataFrame.from_dict(results, orient='index',
                                                     columns=column_names)
@@ -458,7 +530,7 @@ class AccessModel(ModelData):
 
     def __init__(self, network_type, sources_filename=None, source_column_names=None,
                  destinations_filename=None, dest_column_names=None, transit_matrix_filename=None,
-                 decay_function='linear', configs=None, debug=False):
+                 decay_function='linear', categories=None, configs=None, debug=False):
         """
         Args:
             network_type: string, one of {'walk', 'bike', 'drive', 'otp'}.
@@ -470,6 +542,7 @@ class AccessModel(ModelData):
                 default values for p2p.
             debug: boolean, enable to see more detailed logging output.
             decay_function: lambda or string
+            categories: list of categories, defaults to all categories.
             transit_matrix_filename: string, optional
         """
         self.decay_function = None
@@ -543,7 +616,7 @@ class AccessModel(ModelData):
         self.logger.info("Using weights: {}".format(presented_weight_dict))
 
     def calculate(self, upper_threshold, category_weight_dict=None,
-                  normalize=False, normalize_type='minmax'):
+                  normalize=False, normalize_type='minmax', vectorized=True):
         """
         Args:
             category_weight_dict: category_weight_dict: dictionary of {category : [numeric weights]} or None
@@ -551,6 +624,9 @@ class AccessModel(ModelData):
             normalize: boolean. If true, results will be normalized
                 from 0 to 100.
             normalize_type: 'z_score', 'minmax'
+            vectorized: boolean. If true, score the whole transit
+                matrix as a numpy array, else score each source
+                in turn.
         Returns: DataFrame.
         Raises:
             UnexpectedNormalizeColumnsException
@@ -570,9 +646,7 @@ class AccessModel(ModelData):
 
         self._log_category_weight_dict(category_weight_dict)
 
-        # reserve results dict for each column
         num_columns = len(self.all_categories) + 1
-        results = {source_id: [0] * num_columns for source_id in self.get_all_source_ids()}
 
         # map of column names
         category_to_index_map = {}
@@ -583,7 +657,47 @@ class AccessModel(ModelData):
             category_to_index_map[category] = index
             index += 1
 
-        # calculate score for each source_id
+        if vectorized:
+            results = self._score_vectorized(upper_threshold, category_weight_dict,
+                                             category_to_index_map, num_columns)
+        else:
+            # reserve results dict for each column
+            results = {source_id: [0] * num_columns for source_id in self.get_all_source_ids()}
+            self._score_by_source(results, upper_threshold, category_weight_dict,
+                                  max_category_occurances, category_to_index_map)
+
+        self.model_results = pd.DataFrame.from_dict(results, orient='index',
+                                                    columns=column_names)
+
+        if isinstance(normalize, list):
+            for column in normalize:
+                column_key = column + '_score'
+                self._normalize(column_key, normalize_type)
+        elif normalize is True:
+            for column in self.model_results.columns:
+                self._normalize(column, normalize_type)
+        elif normalize is False:
+            pass
+        else:
+            raise UnexpectedNormalizeColumnsException('Argument ({}) is not of expected type: boolean, list'
+                                                      .format(normalize))
+
+        for column in self.model_results.columns:
+            self._aggregation_args[column] = 'mean'
+
+        #return self.model_results
+
+    def _score_by_source(self, results, upper_threshold, category_weight_dict,
+                         max_category_occurances, category_to_index_map):
+        """
+        Score each source in turn.
+        Args:
+            results: source_id->[score per column] map to add to.
+            upper_threshold: time in seconds.
+            category_weight_dict: dictionary of {category : [weights in decreasing order]}.
+            max_category_occurances: dictionary of {category: number of weights}.
+            category_to_index_map: dictionary of {category: column index}.
+        """
         for source_id in self.get_all_source_ids():
             category_encounters = {category: 0 for category in self.all_categories}
             for dest_id, time in self.get_values_by_source(source_id, sort=True):
@@ -605,26 +719,71 @@ class AccessModel(ModelData):
                 else:
                     continue
 
-        self.model_results = pd.DataFrame.from_dict(results, orient='index',
-                                                    columns=column_names)
-
-        if isinstance(normalize, list):
-            for column in normalize:
-                column_key = column + '_score'
-                self._normalize(column_key, normalize_type)
-        elif normalize is True:
-            for column in self.model_results.columns:
-                self._normalize(column, normalize_type)
-        elif normalize is False:
-            pass
-        else:
-            raise UnexpectedNormalizeColumnsException('Argument ({}) is not of expected type: boolean, list'
-                                                      .format(normalize))
-
-        for column in self.model_results.columns:
-            self._aggregation_args[column] = 'mean'
+    def _get_decayed_array(self, times, upper_threshold):
+        """
+        Args:
+            times: numpy array of times.
+            upper_threshold: time in seconds.
+        Returns: numpy array of decayed times.
+        """
+        if self.decay_function in DECAY_ARRAY_FUNCTIONS:
+            return DECAY_ARRAY_FUNCTIONS[self.decay_function](times.astype(np.float64), upper_threshold)
+        # user supplied decay function: evaluate it once per distinct time
+        unique_times, inverse = np.unique(times, return_inverse=True)
+        decayed_times = np.array([self.decay_function(time, upper_threshold) for time in unique_times.tolist()],
+                                 dtype=np.float64)
+        return decayed_times[inverse].reshape(times.shape)
 
-        #return self.model_results
+    def _score_vectorized(self, upper_threshold, category_weight_dict,
+                          category_to_index_map, num_columns, rows_per_chunk=None):
+        """
+        Score all sources at once from the transit matrix as a numpy array.
+        Args:
+            upper_threshold: time in seconds.
+            category_weight_dict: dictionary of {category : [weights in decreasing order]}.
+            category_to_index_map: dictionary of {category: column index}.
+            num_columns: number of result columns.
+            rows_per_chunk: number of sources to score at a time, defaults
+                to about a million matrix cells per chunk.
+        Returns: source_id->[score per column] map.
+        """
+        value_chunks, source_ids, dest_ids = \
+            self.transit_matrix.matrix_interface.get_values_array_chunks(rows_per_chunk)
+        dest_categories = self.dests.loc[dest_ids, 'category'].values
+        category_columns = {category: np.flatnonzero(dest_categories == category)
+                            for category in category_to_index_map}
+        # weights for categories with no dests are never used
+        category_weights = {category: np.array(weights[:len(category_columns[category])], dtype=np.float64)
+                            for category, weights in category_weight_dict.items()
+                            if category in category_columns}
+
+        scores = np.zeros((len(source_ids), num_columns))
+        for start, chunk in value_chunks:
+            for category, index in category_to_index_map.items():
+                columns = category_columns[category]
+                if len(columns) == 0:
+                    continue
+                times = chunk[:, columns]
+                # no weights supplied for this category; so don't decay
+                if category not in category_weights:
+                    scores[start:start + len(chunk), index] = self._get_decayed_array(times,
+                                                                                      upper_threshold).sum(axis=1)
+                    continue
+                weights = category_weights[category]
+                if len(weights) == 0:
+                    continue
+                # only the closest len(weights) dests are scored, the closest
+                # dest with the highest weight
+                if len(weights) < times.shape[1]:
+                    closest = np.argpartition(times, len(weights) - 1, axis=1)[:, :len(weights)]
+                    times = np.take_along_axis(times, closest, axis=1)
+                times = np.sort(times, axis=1)
+                scores[start:start + len(chunk), index] = self._get_decayed_array(times,
+                                                                                  upper_threshold).dot(weights)
+        scores[:, 0] = scores[:, 1:].sum(axis=1)
+
+        source_locs = {source_id: loc for loc, source_id in enumerate(source_ids)}
+        return {source_id: scores[source_locs[source_id]].tolist() for source_id in self.get_all_source_ids()}
 
     def _normalize(self, column, normalize_type):
         """
@@ -3,11 +3,23 @@
 # ©2017-2019, Center for Spatial Data Science
 
 import os
+import re
 import time
+import hashlib
+import math
+import json
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import scipy.spatial
+import numpy as np
 import pandas as pd
-from osmnet.load import network_from_bbox
+import shapely
+from shapely.strtree import STRtree
 from geopy import distance
 
+from spatial_access import _osm
+from spatial_access import _network_cache
 from spatial_access.SpatialAccessExceptions import BoundingBoxTooLargeException
 from spatial_access.SpatialAccessExceptions import UnableToConnectException
 from spatial_access.SpatialAccessExceptions import SourceNotBuiltException
@@ -16,6 +28,25 @@ from spatial_access.SpatialAccessExceptions import ConnectedComponentTrimmingFai
 import logging
 logging.getLogger('osmnet').disabled = True
 
+EARTH_RADIUS_METERS = 6371008.8
+
+# directory of cached networks, tiles and the manifest
+CACHE_DIRECTORY = 'data/osm_query_cache/'
+
+OSM_BIKE_FILTER = '["highway"!~"motor|proposed|construction|abandoned|platform|raceway"]["foot"!~"no"]["bicycle"!~"no"]'
+
+# cache entries are named <network type><lat_min>_<lon_min>_<lat_max>_<lon_max>
+# (with a .h5 extension for legacy entries)
+_CACHE_FILENAME_PATTERN = re.compile(r'^(walk|bike|drive)(-?[0-9.]+)_(-?[0-9.]+)_(-?[0-9.]+)_(-?[0-9.]+)(\.h5)?$')
+
+# bump when the connected component trimming changes, so
+# cached trimming results are recomputed
+TRIMMING_VERSION = 2
+
+# pytables is not thread safe: serialize cache reads, writes and
+# migrations when networks are loaded concurrently
+_CACHE_LOCK = threading.Lock()
+
 try:
     import _p2pExtension
 except ImportError:
@@ -27,7 +58,9 @@ class NetworkInterface:
     Manages OSM network retrieval for p2p.TransitMatrix.
     """
 
-    def __init__(self, network_type, logger=None, disable_area_threshold=False):
+    def __init__(self, network_type, logger=None, disable_area_threshold=False,
+                 tile_size=0.05, max_cache_size=None, osm_extract=None,
+                 overpass_url=None, fetch_workers=4, fetch_retries=3):
         """
 
         Args:
@@ -35,13 +68,36 @@ class NetworkInterface:
             logger: optional, logger.
             disable_area_threshold: boolean, enable if computation fails due to
             exceeding bounding box area constraint.
+            tile_size: numeric, size (degrees) of the grid tiles networks are
+                fetched and cached in.
+            max_cache_size: optional int, maximum size (bytes) of the cached
+                tiles (and of the node indexes and trimming results cached
+                with them). The least recently used are evicted beyond it.
+            osm_extract: optional, local .osm or .osm.pbf filename to build
+                networks from instead of querying OSM.
+            overpass_url: optional, url of the Overpass API interpreter
+                to query (defaults to the one osmnet uses).
+            fetch_workers: int, number of tiles fetched concurrently.
+            fetch_retries: int, number of times a failed tile request is
+                retried (with exponential backoff).
         """
         self.logger = logger
         self.network_type = network_type
         self.bbox = None
         self.nodes = None
         self.edges = None
+        self._projection_origin = None
+        self._node_index = None
+        self._edge_index = None
         self.area_threshold = None if disable_area_threshold else 5000  # km
+        self.tile_size = tile_size
+        self.max_cache_size = max_cache_size
+        self.tile_directory = CACHE_DIRECTORY + 'tiles/'
+        self.osm_extract = osm_extract
+        self.overpass_url = _osm.OVERPASS_URL if overpass_url is None else overpass_url
+        self.fetch_workers = fetch_workers
+        self.fetch_retries = fetch_retries
+        self.fetch_backoff = 1.0  # seconds
         assert isinstance(network_type, str)
         self._try_create_cache()
 
@@ -51,8 +107,8 @@ class NetworkInterface:
         Remove the contents of the NetworkInterface cache.
         """
         import shutil
-        if os.path.exists('data/osm_query_cache'):
-            shutil.rmtree('data/osm_query_cache')
+        if os.path.exists(CACHE_DIRECTORY):
+            shutil.rmtree(CACHE_DIRECTORY)
 
     @staticmethod
     def _try_create_cache():
@@ -60,10 +116,8 @@ class NetworkInterface:
         Create the directory for the cache
         if it does not already exist.
         """
-        if not os.path.exists('data/'):
-            os.makedirs('data/')
-        if not os.path.exists('data/osm_query_cache'):
-            os.makedirs('data/osm_query_cache')
+        if not os.path.exists(CACHE_DIRECTORY):
+            os.makedirs(CACHE_DIRECTORY)
 
     def number_of_nodes(self):
         """
@@ -141,17 +195,29 @@ class NetworkInterface:
         Returns: cache filename formatted for this request.
         """
         bbox_string = '_'.join([str(coord) for coord in self.bbox])
-        return 'data/osm_query_cache/' + self.network_type + bbox_string + '.h5'
+        return CACHE_DIRECTORY + self.network_type + bbox_string
 
     def _network_exists(self):
         """
         Returns: true if a filename matching these
             network parameters is in the cache.
         """
-        return os.path.exists(self._get_filename())
+        return _network_cache.network_exists(self._get_filename())
+
+    @staticmethod
+    def _read_cached_network(filename):
+        """
+        Read only the node and edge columns used to build transit
+        matrices from a cached network.
+        Args:
+            filename: cache filename of the network.
+        Returns: nodes and edges DataFrames.
+        """
+        with _CACHE_LOCK:
+            return _network_cache.read_network(filename)
 
     def load_network(self, primary_data, secondary_data,
-                     secondary_input, epsilon):
+                     secondary_input, epsilon, bbox=None):
         """
         Attempt to load the nodes and edges tables for
         the current query from the local cache; query OSM
@@ -163,6 +229,9 @@ class NetworkInterface:
             secondary_input: boolean, true if secondary_data
                 was provided.
             epsilon: Safety margin around bounding box.
+            bbox: optional, [lat_min, lon_min, lat_max, lon_max] already
+                computed (and checked) for this data by another
+                NetworkInterface.
 
         Raises:
             AssertionError: argument is not of expected type
@@ -174,46 +243,234 @@ class NetworkInterface:
         assert isinstance(epsilon, float) or isinstance(epsilon, int)
 
         self._try_create_cache()
-        self._get_bbox(primary_data, secondary_data,
-                       secondary_input, epsilon)
-        if self._network_exists():
+        if bbox is None:
+            self._get_bbox(primary_data, secondary_data,
+                           secondary_input, epsilon)
+        else:
+            self.bbox = list(bbox)
+        if self.osm_extract is None and self._network_exists():
             filename = self._get_filename()
-            self.nodes = pd.read_hdf(filename, 'nodes')
-            self.edges = pd.read_hdf(filename, 'edges')
+            self.nodes, self.edges = self._read_cached_network(filename)
             if self.logger:
                 self.logger.debug('Read network from cache: %s', filename)
         else:
-            self._request_network()
+            filename = self._find_cached_superset()
+            if filename is not None:
+                self.nodes, self.edges = self._read_cached_network(filename)
+                self._clip_to_bbox()
+                if self.logger:
+                    self.logger.debug('Clipped network from cache: %s', filename)
+            else:
+                self._request_network()
         self._remove_disconnected_components()
+        self._projection_origin = None
+        self._node_index = None
+        self._edge_index = None
+
+    @staticmethod
+    def _get_fetch_parameters(network_type, osm_extract=None):
+        """
+        Args:
+            network_type: string, network type.
+            osm_extract: optional, osm extract filename.
+        Returns: dictionary of the parameters networks of
+            this type are fetched from OSM (or built from
+            osm_extract) with.
+        """
+        fetch_parameters = {'network_type': network_type,
+                            'custom_osm_filter': OSM_BIKE_FILTER if network_type == 'bike' else None}
+        if osm_extract is not None:
+            fetch_parameters['osm_extract'] = os.path.abspath(osm_extract)
+            fetch_parameters['osm_extract_modified'] = os.path.getmtime(osm_extract)
+        return fetch_parameters
+
+    @staticmethod
+    def _get_manifest_filename():
+        """
+        Returns: filename of the manifest of cached networks.
+        """
+        return CACHE_DIRECTORY + 'manifest.json'
+
+    def _read_manifest(self):
+        """
+        Read the manifest of cached networks, adding any cached
+        network missing from it (parsed from its filename) and
+        dropping entries of networks no longer cached. The manifest
+        is only rewritten if it changed.
+        Returns: list of {'filename', 'network_type', 'bbox',
+            'fetch_parameters'} entries of existing cached networks.
+        """
+        with _CACHE_LOCK:
+            try:
+                with open(self._get_manifest_filename(), 'r') as file:
+                    manifest = json.load(file)
+            except (OSError, ValueError):
+                manifest = []
+            is_changed = False
+            for entry in manifest:
+                path = _network_cache.get_path(entry['filename'])
+                is_changed |= path != entry['filename']
+                entry['filename'] = path
+            num_entries = len(manifest)
+            manifest = [entry for entry in manifest if _network_cache.network_exists(entry['filename'])]
+            is_changed |= len(manifest) != num_entries
+            listed_filenames = {entry['filename'] for entry in manifest}
+            for filename in sorted(os.listdir(CACHE_DIRECTORY)):
+                match = _CACHE_FILENAME_PATTERN.match(filename)
+                filename = _network_cache.get_path(CACHE_DIRECTORY + filename)
+                if match is None or filename in listed_filenames:
+                    continue
+                network_type = match.group(1)
+                manifest.append({'filename': filename,
+                                 'network_type': network_type,
+                                 'bbox': [float(coord) for coord in match.groups()[1:5]],
+                                 'fetch_parameters': self._get_fetch_parameters(network_type)})
+                is_changed = True
+            if is_changed:
+                self._write_manifest(manifest)
+        return manifest
+
+    def _write_manifest(self, manifest):
+        """
+        Args:
+            manifest: list of manifest entries.
+        """
+        manifest_filename = self._get_manifest_filename()
+        with open(manifest_filename + '.tmp', 'w') as file:
+            json.dump(manifest, file)
+        os.replace(manifest_filename + '.tmp', manifest_filename)
+
+    def _add_to_manifest(self, filename, bbox):
+        """
+        List a cached network in the manifest.
+        Args:
+            filename: cache filename of the network.
+            bbox: [lat_min, lon_min, lat_max, lon_max] of the network.
+        """
+        manifest = [entry for entry in self._read_manifest() if entry['filename'] != filename]
+        manifest.append({'filename': filename,
+                         'network_type': self.network_type,
+                         'bbox': [float(coord) for coord in bbox],
+                         'fetch_parameters': self._get_fetch_parameters(self.network_type, self.osm_extract)})
+        with _CACHE_LOCK:
+            self._write_manifest(manifest)
+
+    def _find_cached_superset(self):
+        """
+        Networks assembled from tiles are not cached as a whole (the
+        tiles are), so the only candidates are whole networks built
+        from osm extracts and networks cached by earlier versions.
+
+        Returns: filename of the smallest cached network of this type
+            (and fetch parameters) whose bbox contains the current
+            query, or None.
+        """
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        fetch_parameters = self._get_fetch_parameters(self.network_type, self.osm_extract)
+        best_filename = None
+        best_area = None
+        for entry in self._read_manifest():
+            if entry['network_type'] != self.network_type or entry['fetch_parameters'] != fetch_parameters:
+                continue
+            entry_lat_min, entry_lon_min, entry_lat_max, entry_lon_max = entry['bbox']
+            if entry_lat_min <= lat_min and entry_lon_min <= lon_min and \
+                    entry_lat_max >= lat_max and entry_lon_max >= lon_max:
+                area = (entry_lat_max - entry_lat_min) * (entry_lon_max - entry_lon_min)
+                if best_area is None or area < best_area:
+                    best_filename = entry['filename']
+                    best_area = area
+        return best_filename
 
     def _request_network(self):
         """
-        Fetch a street network from OSM for the
-        current query.
+        Build the network for the current query from the osm extract,
+        if there is one. Otherwise assemble it from the tile cache,
+        fetching the missing tiles from OSM concurrently.
+        Raises:
+            UnableToConnectException: network connection is unavailable.
+        """
+        if self.osm_extract is not None:
+            self._load_osm_extract()
+            return
+        tiles = self._get_tiles()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.fetch_workers, len(tiles)))) as executor:
+            loaded_tiles = list(executor.map(self._load_tile, tiles))
+        self._evict_tiles()
+
+        # ways crossing a tile border are in both tiles, and where they
+        # meet ways of a single tile is only known once the tiles are
+        # stitched together, so the edges are built from all of them
+        nodes, ways, waynodes = _osm.merge_osm_elements(loaded_tiles)
+        self.nodes, self.edges = _osm.network_from_osm_elements(nodes, ways, waynodes)
+        self._clip_to_bbox()
+
+    def _get_extract_cache_filename(self):
+        """
+        Returns: cache filename of the network built
+            from the osm extract.
+        """
+        fetch_parameters = self._get_fetch_parameters(self.network_type, self.osm_extract)
+        key = hashlib.md5(json.dumps(fetch_parameters, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        basename = os.path.basename(self.osm_extract).split('.')[0]
+        return CACHE_DIRECTORY + 'extract_{}_{}_{}'.format(self.network_type, basename, key)
+
+    def _load_osm_extract(self):
+        """
+        Build the network of the whole osm extract and cache it
+        (listed in the manifest), unless it is already cached,
+        then clip it to the current query.
+        """
+        filename = self._get_extract_cache_filename()
+        if _network_cache.network_exists(filename):
+            self.nodes, self.edges = self._read_cached_network(filename)
+            self._clip_to_bbox()
+            return
+        start_time = time.time()
+        custom_osm_filter = OSM_BIKE_FILTER if self.network_type == 'bike' else None
+        nodes, edges = _osm.read_osm_extract(self.osm_extract, self.network_type, custom_osm_filter)
+        self._drop_unused_columns(edges)
+        if self.logger:
+            self.logger.info('Read {:,} nodes and {:,} edges from {} in {:,.2f} seconds'.format(
+                len(nodes), len(edges), self.osm_extract, time.time() - start_time))
+
+        with _CACHE_LOCK:
+            _network_cache.write_network(filename, nodes, edges)
+        self._add_to_manifest(filename, [nodes['y'].min(), nodes['x'].min(),
+                                         nodes['y'].max(), nodes['x'].max()])
+
+        self.nodes = nodes
+        self.edges = edges
+        self._clip_to_bbox()
+
+    def _drop_unused_columns(self, edges):
+        """
+        Drop the edge columns (osm tags) that are never used.
+        Args:
+            edges: DataFrame of edges.
+        """
+        if self.network_type == 'drive':
+            edges.drop(['access', 'hgv', 'lanes', 'maxspeed', 'tunnel'], inplace=True, axis=1, errors='ignore')
+        elif self.network_type == 'walk':
+            edges.drop(['access', 'bridge', 'lanes', 'service', 'tunnel'], inplace=True, axis=1, errors='ignore')
+
+    def _fetch_osm_elements(self, bbox):
+        """
+        Fetch the highways in bbox from OSM (retrying failed requests).
+        Args:
+            bbox: [lat_min, lon_min, lat_max, lon_max].
+        Returns: nodes, ways and waynodes DataFrames, as osmnet
+            parses them.
         Raises:
             UnableToConnectException: network connection is unavailable.
         """
         try:
-            if self.network_type == 'bike':
-                osm_bike_filter = '["highway"!~"motor|proposed|construction|abandoned|platform|raceway"]["foot"!~"no"]["bicycle"!~"no"]'
-                self.nodes, self.edges = network_from_bbox(lat_min=self.bbox[0], lng_min=self.bbox[1],
-                                                               lat_max=self.bbox[2], lng_max=self.bbox[3],
-                                                               custom_osm_filter=osm_bike_filter)
-            else:
-                self.nodes, self.edges = network_from_bbox(
-                    lat_min=self.bbox[0], lng_min=self.bbox[1],
-                    lat_max=self.bbox[2], lng_max=self.bbox[3],
-                    network_type=self.network_type)
-                if self.network_type == 'drive':
-                    self.edges.drop(['access', 'hgv', 'lanes', 'maxspeed', 'tunnel'], inplace=True, axis=1)
-                else:
-                    self.edges.drop(['access', 'bridge', 'lanes', 'service', 'tunnel'], inplace=True, axis=1)
-            filename = self._get_filename()
-            self.nodes.to_hdf(filename, 'nodes', complevel=5)
-            self.edges.to_hdf(filename, 'edges', complevel=5)
+            custom_osm_filter = OSM_BIKE_FILTER if self.network_type == 'bike' else None
+            elements = _osm.fetch_osm_elements(bbox, self.network_type, custom_osm_filter,
+                                               url=self.overpass_url, retries=self.fetch_retries,
+                                               backoff=self.fetch_backoff, logger=self.logger)
             if self.logger:
                 self.logger.info('Finished querying osm')
-                self.logger.debug('Cached network to %s', filename)
+            return elements
         except BaseException as e:
             request_error = """Error trying to download OSM network.
             Did you reverse lat/long?
@@ -224,17 +481,287 @@ class NetworkInterface:
                 self.logger.error(request_error)
             raise UnableToConnectException()
 
-    def _get_edges_as_list(self):
+    def _get_tiles(self):
+        """
+        Returns: list of (row, col) grid tiles covering
+            the current query.
+        """
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        rows = range(math.floor(lat_min / self.tile_size), math.floor(lat_max / self.tile_size) + 1)
+        cols = range(math.floor(lon_min / self.tile_size), math.floor(lon_max / self.tile_size) + 1)
+        return [(row, col) for row in rows for col in cols]
+
+    def _get_tile_bbox(self, tile):
+        """
+        Args:
+            tile: (row, col) grid tile.
+        Returns: [lat_min, lon_min, lat_max, lon_max] of tile.
+        """
+        row, col = tile
+        return [row * self.tile_size, col * self.tile_size,
+                (row + 1) * self.tile_size, (col + 1) * self.tile_size]
+
+    def _get_tile_filename(self, tile):
+        """
+        Args:
+            tile: (row, col) grid tile.
+        Returns: cache filename of tile.
+        """
+        row, col = tile
+        return os.path.join(self.tile_directory, '{}_{}_{}_{}'.format(self.network_type,
+                                                                      self.tile_size, row, col))
+
+    def _get_tile_index_filename(self):
+        """
+        Returns: filename of the index of cached tiles
+            (size and last use of each tile).
+        """
+        return os.path.join(self.tile_directory, 'index.json')
+
+    def _read_tile_index(self):
+        """
+        Returns: dictionary of {tile filename: {'size': bytes,
+            'last_used': timestamp}}.
+        """
+        try:
+            with open(self._get_tile_index_filename(), 'r') as file:
+                tile_index = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        # legacy .h5 tiles are listed by their columnar path (and fetched again)
+        return {_network_cache.get_path(filename): entry for filename, entry in tile_index.items()}
+
+    def _write_tile_index(self, tile_index):
+        """
+        Args:
+            tile_index: dictionary of {tile filename: {'size': bytes,
+                'last_used': timestamp}}.
+        """
+        filename = self._get_tile_index_filename()
+        # partitions written by other processes use their own temp file
+        temp_filename = '{}.tmp{}'.format(filename, os.getpid())
+        with open(temp_filename, 'w') as file:
+            json.dump(tile_index, file)
+        os.replace(temp_filename, filename)
+
+    @staticmethod
+    def _write_tile(filename, nodes, ways, waynodes):
+        """
+        Cache the osm elements of a tile.
+        Args:
+            filename: cache filename of the tile.
+            nodes: DataFrame of nodes (indexed by id).
+            ways: DataFrame of ways (indexed by id).
+            waynodes: DataFrame of way nodes (indexed by way id).
+        """
+        _network_cache.write_tables(filename, {'nodes': nodes.reset_index(),
+                                               'ways': ways.reset_index(),
+                                               'waynodes': waynodes.reset_index()})
+
+    @staticmethod
+    def _read_tile(filename):
+        """
+        Args:
+            filename: cache filename of the tile.
+        Returns: nodes, ways and waynodes DataFrames of the tile.
+        """
+        tables = _network_cache.read_tables(filename, {'nodes': None, 'ways': None, 'waynodes': None})
+        return tables['nodes'].set_index('id'), tables['ways'].set_index('id'), \
+            tables['waynodes'].set_index('way_id')
+
+    def _load_tile(self, tile):
+        """
+        Read the osm elements of a tile from the cache, or
+        fetch and cache them.
+        Args:
+            tile: (row, col) grid tile.
+        Returns: nodes, ways and waynodes DataFrames of tile.
+        Raises:
+            UnableToConnectException: network connection is unavailable.
+        """
+        filename = self._get_tile_filename(tile)
+        with _CACHE_LOCK:
+            # tiles cached as networks (by earlier versions) are fetched again
+            fetch = 'ways' not in _network_cache.get_table_names(filename)
+            if not fetch:
+                nodes, ways, waynodes = self._read_tile(filename)
+                if self.logger:
+                    self.logger.debug('Read tile from cache: %s', filename)
+        if fetch:
+            nodes, ways, waynodes = self._fetch_osm_elements(self._get_tile_bbox(tile))
+            # keep only the coordinates and the tags edges are cached with
+            nodes = nodes[['lat', 'lon']]
+            ways = ways[[column for column in _network_cache.EDGE_COLUMNS if column in ways.columns]]
+        with _CACHE_LOCK:
+            if fetch:
+                if not os.path.exists(self.tile_directory):
+                    os.makedirs(self.tile_directory)
+                _network_cache.remove_network(filename)
+                self._write_tile(filename, nodes, ways, waynodes)
+                if self.logger:
+                    self.logger.debug('Cached tile to %s', filename)
+            tile_index = self._read_tile_index()
+            tile_index[filename] = {'size': _network_cache.get_size(filename), 'last_used': time.time()}
+            self._write_tile_index(tile_index)
+        return nodes, ways, waynodes
+
+    def _evict_tiles(self):
+        """
+        Remove the least recently used tiles (and artifacts) until
+        the tile cache fits in max_cache_size.
+        """
+        if self.max_cache_size is None:
+            return
+        with _CACHE_LOCK:
+            tile_index = self._read_tile_index()
+            cache_size = sum(entry['size'] for entry in tile_index.values())
+            for filename in sorted(tile_index, key=lambda tile_filename: tile_index[tile_filename]['last_used']):
+                if cache_size <= self.max_cache_size:
+                    break
+                cache_size -= tile_index.pop(filename)['size']
+                _network_cache.remove_network(filename)
+                if self.logger:
+                    self.logger.debug('Evicted from cache: %s', filename)
+            self._write_tile_index(tile_index)
+
+    def _clip_to_bbox(self):
+        """
+        Remove the nodes outside of the current query, and
+        the edges to or from them.
+        """
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        in_bbox = (self.nodes['y'] >= lat_min) & (self.nodes['y'] <= lat_max) & \
+                  (self.nodes['x'] >= lon_min) & (self.nodes['x'] <= lon_max)
+        self.nodes = self.nodes[in_bbox]
+        node_ids = self.nodes['id'].values
+        self.edges = self.edges[np.isin(self.edges['from'].values, node_ids) &
+                                np.isin(self.edges['to'].values, node_ids)]
+
+    def _get_projection_origin(self):
+        """
+        Returns: (lon, lat) center of the local projection.
+        """
+        if self._projection_origin is None:
+            self._projection_origin = (float(self.nodes['x'].mean()), float(self.nodes['y'].mean()))
+        return self._projection_origin
+
+    def project_coordinates(self, lons, lats):
+        """
+        Project coordinates onto a local equirectangular plane
+        centered on the network, so that euclidean distances are
+        (approximately) meters.
+        Args:
+            lons: array of longitudes.
+            lats: array of latitudes.
+        Returns: numpy array of shape (n, 2) of x, y in meters.
+        """
+        lon_origin, lat_origin = self._get_projection_origin()
+        meters_per_degree = math.pi / 180 * EARTH_RADIUS_METERS
+        x = (np.asarray(lons, dtype=np.float64) - lon_origin) * meters_per_degree * math.cos(math.radians(lat_origin))
+        y = (np.asarray(lats, dtype=np.float64) - lat_origin) * meters_per_degree
+        return np.column_stack([x, y])
+
+    def get_node_locs(self, node_ids):
+        """
+        Args:
+            node_ids: array of node ids.
+        Returns: numpy array of the position of each node in self.nodes.
+        """
+        return pd.Index(self.nodes['id'].values).get_indexer(node_ids)
+
+    def _get_artifact_directory(self):
         """
-        Returns: a list of all edges as tuples (from, to).
+        Returns: directory of the artifacts (node index, trimming
+            result) cached for the network of the current query. It
+            is kept in the tile cache, listed in the tile index.
         """
-        return list(zip(self.edges['from'], self.edges['to']))
+        return os.path.join(self.tile_directory, 'artifacts', os.path.basename(self._get_filename()))
 
-    def _get_vertices_as_list(self):
+    def _use_artifacts(self):
+        """
+        List the artifacts of the current query in the tile index as
+        just used, so they count against max_cache_size and are
+        evicted least recently used first.
         """
-        Returns: a list of all node ids.
+        directory = self._get_artifact_directory()
+        with _CACHE_LOCK:
+            if not os.path.isdir(directory):
+                return
+            tile_index = self._read_tile_index()
+            tile_index[directory] = {'size': _network_cache.get_size(directory), 'last_used': time.time()}
+            self._write_tile_index(tile_index)
+        self._evict_tiles()
+
+    def _get_node_index_filename(self):
         """
-        return list(self.nodes['id'])
+        Returns: filename of the node index cached
+            for this network.
+        """
+        return os.path.join(self._get_artifact_directory(), 'node_index.pkl')
+
+    def _read_node_index(self):
+        """
+        Returns: the cached node index for this network, or None
+            if it is missing or was built for different nodes.
+        """
+        filename = self._get_node_index_filename()
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'rb') as file:
+                cached = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if cached.get('num_nodes') != len(self.nodes) or \
+                cached.get('projection_origin') != self._get_projection_origin():
+            return None
+        self._use_artifacts()
+        return cached['node_index']
+
+    def _write_node_index(self):
+        """
+        Cache the node index for this network.
+        """
+        filename = self._get_node_index_filename()
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'wb') as file:
+                pickle.dump({'num_nodes': len(self.nodes),
+                             'projection_origin': self._get_projection_origin(),
+                             'node_index': self._node_index}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            if self.logger:
+                self.logger.debug('Unable to cache node index: %s', e)
+            return
+        self._use_artifacts()
+
+    def get_node_index(self):
+        """
+        Returns: a cKDTree over the projected nodes, in the order
+            of self.nodes. Built once per network and cached.
+        """
+        if self._node_index is None and self.bbox is not None:
+            self._node_index = self._read_node_index()
+            if self._node_index is not None and self.logger:
+                self.logger.debug('Read node index from cache: %s', self._get_node_index_filename())
+        if self._node_index is None:
+            self._node_index = scipy.spatial.cKDTree(self.project_coordinates(self.nodes['x'], self.nodes['y']))
+            if self.bbox is not None:
+                self._write_node_index()
+        return self._node_index
+
+    def get_edge_index(self):
+        """
+        Returns: an STRtree over the projected edges, in the
+            order of self.edges (built once per network).
+        """
+        if self._edge_index is None:
+            coordinates = self.project_coordinates(self.nodes['x'], self.nodes['y'])
+            from_locs = self.get_node_locs(self.edges['from'].values)
+            to_locs = self.get_node_locs(self.edges['to'].values)
+            segments = np.stack([coordinates[from_locs], coordinates[to_locs]], axis=1)
+            self._edge_index = STRtree(shapely.linestrings(segments))
+        return self._edge_index
 
     def _apply_connected_nodes(self, nodes_to_keep):
         """
@@ -243,24 +770,103 @@ class NetworkInterface:
         Args:
             nodes_to_keep: array of node indeces.
         """
-        self.nodes = self.nodes[self.nodes['id'].isin(nodes_to_keep)]
-        self.edges = self.edges[self.edges['from'].isin(nodes_to_keep) & self.edges['to'].isin(nodes_to_keep)]
+        self.nodes = self.nodes[np.isin(self.nodes['id'].values, nodes_to_keep)]
+        self.edges = self.edges[np.isin(self.edges['from'].values, nodes_to_keep) &
+                                np.isin(self.edges['to'].values, nodes_to_keep)]
+
+    def _get_connected_nodes_filename(self):
+        """
+        Returns: filename of the connected component trimming
+            result cached for this network.
+        """
+        return os.path.join(self._get_artifact_directory(), 'connected_nodes.pkl')
+
+    def _get_network_fingerprint(self):
+        """
+        Returns: hex digest of the node ids and edges of the
+            (untrimmed) network.
+        """
+        fingerprint = hashlib.md5()
+        for values in [self.nodes['id'].values, self.edges['from'].values, self.edges['to'].values]:
+            fingerprint.update(np.ascontiguousarray(values, dtype=np.int64).tobytes())
+        return fingerprint.hexdigest()
+
+    def _read_connected_nodes(self, fingerprint):
+        """
+        Args:
+            fingerprint: fingerprint of the untrimmed network.
+        Returns: the cached array of the ids of the nodes in the
+            largest strongly connected component, or None if it is
+            missing, was computed for a different network or by a
+            different trimming version.
+        """
+        filename = self._get_connected_nodes_filename()
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'rb') as file:
+                cached = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if cached.get('trimming_version') != TRIMMING_VERSION or \
+                cached.get('fingerprint') != fingerprint:
+            return None
+        self._use_artifacts()
+        return cached['connected_nodes']
+
+    def _write_connected_nodes(self, fingerprint, connected_nodes):
+        """
+        Cache the trimming result for this network.
+        Args:
+            fingerprint: fingerprint of the untrimmed network.
+            connected_nodes: array of node ids to keep.
+        """
+        filename = self._get_connected_nodes_filename()
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'wb') as file:
+                pickle.dump({'trimming_version': TRIMMING_VERSION,
+                             'fingerprint': fingerprint,
+                             'connected_nodes': connected_nodes}, file, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            if self.logger:
+                self.logger.debug('Unable to cache connected nodes: %s', e)
+            return
+        self._use_artifacts()
+
+    def _get_connected_nodes(self):
+        """
+        Returns: array of the ids of the nodes in the largest
+            strongly connected component.
+        Raises:
+            ConnectedComponentTrimmingFailed: caused by undefined behavior from extension.
+        """
+        try:
+            keep_mask = _p2pExtension.getConnectedNetworkMask(self.get_node_locs(self.edges['from'].values),
+                                                              self.get_node_locs(self.edges['to'].values),
+                                                              len(self.nodes))
+            return self.nodes['id'].values[keep_mask]
+        except BaseException:
+            raise ConnectedComponentTrimmingFailed()
 
     def _remove_disconnected_components(self):
         """
         Remove all nodes and edges that are not
         a part of the largest strongly connected component.
+        The result is cached for the network.
         Raises:
             ConnectedComponentTrimmingFailed: caused by undefined behavior from extension.
         """
         len_edges_before = len(self.edges)
         len_nodes_before = len(self.nodes)
         start_time = time.time()
-        try:
-            trimmer = _p2pExtension.pyNetworkUtility(self._get_edges_as_list(), self._get_vertices_as_list())
-            nodes_of_main_connected_component = trimmer.getConnectedNetworkNodes()
-        except BaseException:
-            raise ConnectedComponentTrimmingFailed()
+        fingerprint = self._get_network_fingerprint()
+        nodes_of_main_connected_component = self._read_connected_nodes(fingerprint)
+        if nodes_of_main_connected_component is None:
+            nodes_of_main_connected_component = self._get_connected_nodes()
+            self._write_connected_nodes(fingerprint, nodes_of_main_connected_component)
+        elif self.logger:
+            self.logger.debug('Read connected nodes from cache: %s', self._get_connected_nodes_filename())
 
         self._apply_connected_nodes(nodes_of_main_connected_component)
 
@@ -48,6 +48,16 @@ class ReadTMXFailedException(Exception):
         super().__init__(errors)
 
 
+class WriteArrowFailedException(Exception):
+    def __init__(self, errors=''):
+        super().__init__(errors)
+
+
+class ReadArrowFailedException(Exception):
+    def __init__(self, errors=''):
+        super().__init__(errors)
+
+
 class ReadCSVFailedException(Exception):
     def __init__(self, errors=''):
         super().__init__(errors)
@@ -68,6 +78,11 @@ class UnableToBuildMatrixException(Exception):
         super().__init__(errors)
 
 
+class MatrixBuildCancelledException(Exception):
+    def __init__(self, errors=''):
+        super().__init__(errors)
+
+
 class FileNotFoundException(Exception):
     def __init__(self, errors=''):
         super().__init__(errors)
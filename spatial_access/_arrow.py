@@ -0,0 +1,333 @@
+# Logan Noel (github.com/lmnoel)
+#
+# ©2017-2019, Center for Spatial Data Science
+
+import json
+import numpy as np
+import pandas as pd
+
+from spatial_access._readers import PARQUET_EXTENSIONS, FEATHER_EXTENSIONS, _get_extension
+
+ARROW_EXTENSIONS = FEATHER_EXTENSIONS | {'arrow', 'ipc'}
+LAYOUTS = {'long', 'wide'}
+
+ORIGIN_COLUMN = 'origin'
+DEST_COLUMN = 'dest'
+COST_COLUMN = 'cost'
+
+_METADATA_KEY = b'spatial_access'
+
+
+def is_arrow_filename(filename):
+    """
+    Args:
+        filename: string.
+    Returns: true if filename is a parquet or arrow (IPC) file.
+    """
+    return _get_extension(filename) in PARQUET_EXTENSIONS | ARROW_EXTENSIONS
+
+
+def _get_id_type(ids_are_string):
+    """
+    Args:
+        ids_are_string: boolean.
+    Returns: arrow type of the ids. String ids are dictionary
+        encoded (written once, referenced by code).
+    """
+    import pyarrow
+    if ids_are_string:
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.int64()
+
+
+def _encode_ids(ids, codes, ids_are_string):
+    """
+    Args:
+        ids: arrow array of ids.
+        codes: array of positions in ids.
+        ids_are_string: boolean.
+    Returns: arrow array of ids[codes] (of _get_id_type).
+    """
+    import pyarrow
+    codes = pyarrow.array(codes, type=pyarrow.int32())
+    if ids_are_string:
+        return pyarrow.DictionaryArray.from_arrays(codes, ids)
+    return ids.take(codes)
+
+
+def _decode_ids(column):
+    """
+    Args:
+        column: arrow (chunked) array of ids, optionally
+            dictionary encoded.
+    Returns: codes (array of positions in ids), ids (list)
+        and whether the ids are strings.
+    """
+    import pyarrow
+    column = column.combine_chunks() if isinstance(column, pyarrow.ChunkedArray) else column
+    if pyarrow.types.is_dictionary(column.type):
+        codes = column.indices.to_numpy(zero_copy_only=False)
+        ids = column.dictionary
+    else:
+        codes, ids = pd.factorize(column.to_numpy(zero_copy_only=False))
+        ids = pyarrow.array(ids)
+    ids_are_string = pyarrow.types.is_string(ids.type) or pyarrow.types.is_large_string(ids.type)
+    if not ids_are_string and not pyarrow.types.is_integer(ids.type):
+        raise ValueError('ids should be strings or integers, not {}'.format(ids.type))
+    return codes, ids.to_pylist(), ids_are_string
+
+
+def _get_schema(dest_ids, sources_are_string, dests_are_string, value_dtype, layout):
+    """
+    Args:
+        dest_ids: list of dest ids.
+        sources_are_string: boolean.
+        dests_are_string: boolean.
+        value_dtype: numpy dtype of the matrix values.
+        layout: 'long' or 'wide' (see matrix_to_batches).
+    Returns: pyarrow Schema of the matrix, with the metadata
+        read back by table_to_matrix.
+    """
+    import pyarrow
+    cost_type = pyarrow.from_numpy_dtype(value_dtype)
+    if layout == 'long':
+        fields = [(ORIGIN_COLUMN, _get_id_type(sources_are_string)),
+                  (DEST_COLUMN, _get_id_type(dests_are_string)),
+                  (COST_COLUMN, cost_type)]
+    else:
+        fields = [(ORIGIN_COLUMN, _get_id_type(sources_are_string))]
+        fields += [(str(dest_id), cost_type) for dest_id in dest_ids]
+    metadata = {'layout': layout, 'dests_are_string': dests_are_string}
+    return pyarrow.schema(fields, metadata={_METADATA_KEY: json.dumps(metadata).encode('utf-8')})
+
+
+def matrix_to_batches(value_chunks, source_ids, dest_ids, sources_are_string, dests_are_string,
+                      value_dtype, layout='long'):
+    """
+    Args:
+        value_chunks: iterable of (first_row, values) blocks of rows,
+            values a dense array of value_dtype holding rows
+            [first_row, first_row + len(values)) of the matrix. The
+            maximum value of the dtype marks unreachable pairs.
+        source_ids: list of source ids.
+        dest_ids: list of dest ids.
+        sources_are_string: boolean.
+        dests_are_string: boolean.
+        value_dtype: numpy dtype of the matrix values.
+        layout: 'long', one (origin, dest, cost) row per reachable
+            pair, or 'wide', one row per origin with a cost column
+            per dest (null where unreachable).
+    Returns: pyarrow Schema, and a generator of one pyarrow
+        RecordBatch per block of rows.
+    Raises:
+        ValueError: unknown layout.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError('layout should be one of {}, not {}'.format(sorted(LAYOUTS), layout))
+    schema = _get_schema(dest_ids, sources_are_string, dests_are_string, value_dtype, layout)
+    return schema, _generate_batches(value_chunks, source_ids, dest_ids, sources_are_string,
+                                     dests_are_string, schema, layout)
+
+
+def _generate_batches(value_chunks, source_ids, dest_ids, sources_are_string, dests_are_string, schema, layout):
+    """
+    Yields: one pyarrow RecordBatch of schema per block of
+        value_chunks (see matrix_to_batches).
+    """
+    import pyarrow
+    source_ids = pyarrow.array(source_ids, type=pyarrow.string() if sources_are_string else pyarrow.int64())
+    dest_ids = pyarrow.array(dest_ids, type=pyarrow.string() if dests_are_string else pyarrow.int64())
+    for first_row, values in value_chunks:
+        undefined = np.iinfo(values.dtype).max
+        if layout == 'long':
+            row_codes, col_codes = np.nonzero(values != undefined)
+            arrays = [_encode_ids(source_ids, first_row + row_codes, sources_are_string),
+                      _encode_ids(dest_ids, col_codes, dests_are_string),
+                      pyarrow.array(values[row_codes, col_codes])]
+        else:
+            arrays = [_encode_ids(source_ids, np.arange(first_row, first_row + len(values)), sources_are_string)]
+            for col_loc in range(values.shape[1]):
+                column = values[:, col_loc]
+                arrays.append(pyarrow.array(column, mask=column == undefined))
+        yield pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _get_metadata(table):
+    """
+    Args:
+        table: pyarrow Table.
+    Returns: dictionary of metadata written by matrix_to_batches. Tables
+        from other tools are taken to be long if they have origin,
+        dest and cost columns, and wide if their first column is origin.
+    Raises:
+        ValueError: a table from another tool is in neither layout.
+    """
+    schema_metadata = table.schema.metadata or {}
+    if _METADATA_KEY in schema_metadata:
+        return json.loads(schema_metadata[_METADATA_KEY].decode('utf-8'))
+    if {ORIGIN_COLUMN, DEST_COLUMN, COST_COLUMN} <= set(table.column_names):
+        return {'layout': 'long'}
+    if table.num_columns > 0 and table.column_names[0] == ORIGIN_COLUMN:
+        return {'layout': 'wide', 'dests_are_string': True}
+    raise ValueError('tables should have {}, {} and {} columns, or {} as the first column; found {}'
+                     .format(ORIGIN_COLUMN, DEST_COLUMN, COST_COLUMN, ORIGIN_COLUMN, table.column_names))
+
+
+def _get_cost_dtype(table, cost_columns):
+    """
+    Args:
+        table: pyarrow Table.
+        cost_columns: names of the cost columns.
+    Returns: uint16, or uint32 if any cost column is wider than 16 bits.
+    Raises:
+        ValueError: a cost column is not of an integer type (costs
+            are whole seconds or meters, and are not rounded).
+    """
+    import pyarrow
+    dtype = np.dtype(np.uint16)
+    for name in cost_columns:
+        column_type = table.schema.field(name).type
+        if not pyarrow.types.is_integer(column_type):
+            raise ValueError('costs should be integers, not {} (column {})'.format(column_type, name))
+        if column_type.bit_width > 16:
+            dtype = np.dtype(np.uint32)
+    return dtype
+
+
+def _as_costs(column, dtype):
+    """
+    Args:
+        column: arrow (chunked) array of costs, without nulls.
+        dtype: uint16 or uint32.
+    Returns: numpy array of costs (a view of the arrow buffer
+        where the types match).
+    Raises:
+        ValueError: a cost is negative or does not fit in dtype.
+    """
+    costs = column.to_numpy()
+    if costs.size > 0 and (costs.min() < 0 or costs.max() >= np.iinfo(dtype).max):
+        raise ValueError('costs should be between 0 and {}'.format(np.iinfo(dtype).max - 1))
+    return costs.astype(dtype, copy=False)
+
+
+def table_to_matrix(table, values_per_chunk):
+    """
+    Args:
+        table: pyarrow Table in long or wide layout (see matrix_to_batches).
+            Pairs with a null cost are unreachable.
+        values_per_chunk: int, about how many values to give per block.
+    Returns: value_chunks, source_ids, dest_ids, sources_are_string,
+        dests_are_string and value_dtype (uint16 or uint32). value_chunks
+        yields (first_row, values) blocks of rows in order, values a dense
+        array of value_dtype holding rows [first_row, first_row + len(values))
+        of the matrix (the maximum value of the dtype where unreachable).
+    Raises:
+        ValueError: the table is not a transit matrix, has non-integer
+            costs or a wide table repeats an origin. Costs out of range
+            of the dtype raise while iterating over wide tables.
+        KeyError: a long table is missing a column.
+    """
+    metadata = _get_metadata(table)
+    if metadata['layout'] == 'long':
+        row_codes, source_ids, sources_are_string = _decode_ids(table.column(ORIGIN_COLUMN))
+        col_codes, dest_ids, dests_are_string = _decode_ids(table.column(DEST_COLUMN))
+        dtype = _get_cost_dtype(table, [COST_COLUMN])
+        costs = table.column(COST_COLUMN)
+        if costs.null_count > 0:
+            # pairs with a null cost are left unreachable
+            is_valid = costs.is_valid().to_numpy(zero_copy_only=False)
+            row_codes = row_codes[is_valid]
+            col_codes = col_codes[is_valid]
+            costs = costs.drop_null()
+        costs = _as_costs(costs, dtype)
+        rows_per_chunk = max(1, values_per_chunk // max(1, len(dest_ids)))
+        value_chunks = _generate_long_chunks(row_codes, col_codes, costs, len(source_ids), len(dest_ids),
+                                             dtype, rows_per_chunk)
+        return value_chunks, source_ids, dest_ids, sources_are_string, dests_are_string, dtype
+
+    if table.num_columns < 1:
+        raise ValueError('wide tables should have an origin column')
+    row_codes, source_ids, sources_are_string = _decode_ids(table.column(0))
+    source_ids = [source_ids[code] for code in row_codes]
+    if len(set(source_ids)) != len(source_ids):
+        raise ValueError('wide tables should have one row per origin')
+    dests_are_string = metadata['dests_are_string']
+    dest_names = table.column_names[1:]
+    dest_ids = dest_names if dests_are_string else [int(name) for name in dest_names]
+    dtype = _get_cost_dtype(table, dest_names)
+    rows_per_chunk = max(1, values_per_chunk // max(1, len(dest_ids)))
+    value_chunks = _generate_wide_chunks(table, dtype, rows_per_chunk)
+    return value_chunks, source_ids, dest_ids, sources_are_string, dests_are_string, dtype
+
+
+def _generate_long_chunks(row_codes, col_codes, costs, rows, columns, dtype, rows_per_chunk):
+    """
+    Yields: (first_row, values) blocks of rows_per_chunk rows of the
+        rows x columns matrix with costs at (row_codes, col_codes).
+    """
+    order = np.argsort(row_codes, kind='stable')
+    row_codes = row_codes[order]
+    col_codes = col_codes[order]
+    costs = costs[order]
+    for first_row in range(0, rows, rows_per_chunk):
+        last_row = min(rows, first_row + rows_per_chunk)
+        start, end = np.searchsorted(row_codes, [first_row, last_row])
+        values = np.full((last_row - first_row, columns), np.iinfo(dtype).max, dtype=dtype)
+        values[row_codes[start:end] - first_row, col_codes[start:end]] = costs[start:end]
+        yield first_row, values
+
+
+def _generate_wide_chunks(table, dtype, rows_per_chunk):
+    """
+    Yields: (first_row, values) blocks of rows_per_chunk rows of
+        the cost columns of a wide table.
+    Raises:
+        ValueError: a cost is negative or does not fit in dtype.
+    """
+    for first_row in range(0, table.num_rows, rows_per_chunk):
+        block = table.slice(first_row, rows_per_chunk)
+        values = np.empty((block.num_rows, block.num_columns - 1), dtype=dtype)
+        for col_loc in range(block.num_columns - 1):
+            column = block.column(col_loc + 1)
+            values[:, col_loc] = _as_costs(column.fill_null(0), dtype)
+            if column.null_count > 0:
+                values[column.is_null().to_numpy(zero_copy_only=False), col_loc] = np.iinfo(dtype).max
+        yield first_row, values
+
+
+def write_batches(schema, batches, filename, row_group_size=None):
+    """
+    Args:
+        schema: pyarrow Schema.
+        batches: iterable of pyarrow RecordBatch of schema.
+        filename: parquet or arrow (IPC) filename.
+        row_group_size: optional int, maximum number of rows per
+            parquet row group (or arrow record batch).
+    """
+    import pyarrow
+    if _get_extension(filename) in PARQUET_EXTENSIONS:
+        import pyarrow.parquet
+        with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch, row_group_size=row_group_size)
+        return
+    import pyarrow.ipc
+    with pyarrow.ipc.new_file(filename, schema) as writer:
+        for batch in batches:
+            writer.write_table(pyarrow.Table.from_batches([batch], schema=schema), max_chunksize=row_group_size)
+
+
+def read_table(filename):
+    """
+    Args:
+        filename: parquet or arrow (IPC) filename. Arrow files
+            are memory mapped rather than read.
+    Returns: pyarrow Table.
+    """
+    import pyarrow
+    if _get_extension(filename) in PARQUET_EXTENSIONS:
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(filename)
+    import pyarrow.ipc
+    with pyarrow.memory_map(filename, 'r') as source:
+        return pyarrow.ipc.open_file(source).read_all()
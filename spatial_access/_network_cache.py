@@ -0,0 +1,211 @@
+# Logan Noel (github.com/lmnoel)
+#
+# ©2017-2019, Center for Spatial Data Science
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+# columns of the cached tables used to build transit matrices
+NODE_COLUMNS = ['id', 'x', 'y']
+EDGE_COLUMNS = ['from', 'to', 'distance', 'highway', 'oneway']
+
+LEGACY_EXTENSION = '.h5'
+_METADATA_FILENAME = 'columns.json'
+
+
+def get_path(filename):
+    """
+    Args:
+        filename: cache entry filename, with or without the legacy
+            .h5 extension.
+    Returns: path of the (columnar) cache entry.
+    """
+    if filename.endswith(LEGACY_EXTENSION):
+        return filename[:-len(LEGACY_EXTENSION)]
+    return filename
+
+
+def network_exists(path):
+    """
+    Args:
+        path: cache entry path.
+    Returns: true if the network is cached, in either format.
+    """
+    return os.path.isdir(path) or os.path.isfile(path + LEGACY_EXTENSION)
+
+
+def get_size(path):
+    """
+    Args:
+        path: cache entry path.
+    Returns: size (bytes) of the cached network.
+    """
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path))
+    return os.path.getsize(path + LEGACY_EXTENSION)
+
+
+def remove_network(path):
+    """
+    Remove a cached network, in either format.
+    Args:
+        path: cache entry path.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    if os.path.isfile(path + LEGACY_EXTENSION):
+        os.remove(path + LEGACY_EXTENSION)
+
+
+def _get_column_filename(path, table_name, column):
+    return os.path.join(path, '{}.{}.npy'.format(table_name, column))
+
+
+def _write_table(path, table_name, table):
+    """
+    Write each column of table as an uncompressed .npy file.
+    String columns are written as integer codes into a
+    list of categories.
+    Args:
+        path: directory to write to.
+        table_name: 'nodes' or 'edges'.
+        table: DataFrame.
+    Returns: dictionary of {column: categories (or None)}.
+    """
+    categories = {}
+    for column in table.columns:
+        values = table[column]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            np.save(_get_column_filename(path, table_name, column), values.values)
+            categories[column] = None
+        else:
+            categorical = pd.Categorical(values)
+            np.save(_get_column_filename(path, table_name, column), categorical.codes)
+            categories[column] = [str(category) for category in categorical.categories]
+    return categories
+
+
+def write_tables(path, tables):
+    """
+    Cache tables as one .npy file per column, so reads
+    can memory map just the columns they need. Indexes
+    are not written.
+    Args:
+        path: cache entry path (a directory).
+        tables: dictionary of {table name: DataFrame}.
+    """
+    temp_path = '{}.tmp{}'.format(path, os.getpid())
+    if os.path.isdir(temp_path):
+        shutil.rmtree(temp_path)
+    os.makedirs(temp_path)
+    metadata = {table_name: _write_table(temp_path, table_name, table)
+                for table_name, table in tables.items()}
+    with open(os.path.join(temp_path, _METADATA_FILENAME), 'w') as file:
+        json.dump(metadata, file)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(temp_path, path)
+
+
+def write_network(path, nodes, edges):
+    """
+    Cache a network (see write_tables).
+    Args:
+        path: cache entry path (a directory).
+        nodes: DataFrame of nodes.
+        edges: DataFrame of edges.
+    """
+    write_tables(path, {'nodes': nodes, 'edges': edges})
+
+
+def get_table_names(path):
+    """
+    Args:
+        path: cache entry path.
+    Returns: list of the names of the tables in a columnar
+        cache entry (empty if it is missing or legacy).
+    """
+    try:
+        with open(os.path.join(path, _METADATA_FILENAME), 'r') as file:
+            return list(json.load(file))
+    except (OSError, ValueError):
+        return []
+
+
+def _read_table(path, table_name, table_categories, columns):
+    """
+    Args:
+        path: cache entry path.
+        table_name: 'nodes' or 'edges'.
+        table_categories: dictionary of {column: categories (or None)}.
+        columns: list of columns to read, or None for all. Columns
+            missing from the table are skipped.
+    Returns: DataFrame.
+    """
+    if columns is None:
+        columns = list(table_categories)
+    data = {}
+    for column in columns:
+        if column not in table_categories:
+            continue
+        values = np.load(_get_column_filename(path, table_name, column), mmap_mode='r')
+        if table_categories[column] is None:
+            data[column] = values
+        else:
+            # code -1 (missing) selects the trailing nan
+            lookup = np.array(table_categories[column] + [np.nan], dtype=object)
+            data[column] = lookup[values]
+    return pd.DataFrame(data)
+
+
+def read_tables(path, columns):
+    """
+    Args:
+        path: cache entry path (a directory).
+        columns: dictionary of {table name: list of columns to
+            read, or None for all}.
+    Returns: dictionary of {table name: DataFrame}.
+    """
+    with open(os.path.join(path, _METADATA_FILENAME), 'r') as file:
+        metadata = json.load(file)
+    return {table_name: _read_table(path, table_name, metadata[table_name], table_columns)
+            for table_name, table_columns in columns.items()}
+
+
+def _migrate_network(path):
+    """
+    Rewrite a legacy .h5 cache entry in the columnar format,
+    keeping the .h5 file (which may be shipped with the package
+    or shared with older versions).
+    Args:
+        path: cache entry path.
+    """
+    legacy_filename = path + LEGACY_EXTENSION
+    write_network(path, pd.read_hdf(legacy_filename, 'nodes'),
+                  pd.read_hdf(legacy_filename, 'edges'))
+
+
+def read_network(path, node_columns=NODE_COLUMNS, edge_columns=EDGE_COLUMNS):
+    """
+    Read a cached network (migrating it first, once, if it is
+    in the legacy .h5 format).
+    Args:
+        path: cache entry path.
+        node_columns: list of node columns to read, or None for all.
+        edge_columns: list of edge columns to read, or None for all.
+    Returns: nodes (indexed by id) and edges (indexed by
+        (from, to)) DataFrames.
+    """
+    if not os.path.isdir(path):
+        _migrate_network(path)
+    tables = read_tables(path, {'nodes': node_columns, 'edges': edge_columns})
+    nodes = tables['nodes']
+    edges = tables['edges']
+    if 'id' in nodes.columns:
+        nodes.index = pd.Index(nodes['id'].values, name='id')
+    if 'from' in edges.columns and 'to' in edges.columns:
+        edges.index = pd.MultiIndex.from_arrays([edges['from'].values, edges['to'].values])
+    return nodes, edges
@@ -0,0 +1,530 @@
+# Logan Noel (github.com/lmnoel)
+#
+# ©2017-2019, Center for Spatial Data Science
+
+import re
+import time
+from array import array
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+import pandas as pd
+import requests
+from osmnet.load import osm_filter, parse_network_osm_query, node_pairs
+
+# way tags kept as edge columns (same as osmnet)
+KEEP_OSM_TAGS = ['name', 'ref', 'highway', 'service', 'bridge',
+                 'tunnel', 'access', 'oneway', 'toll', 'lanes',
+                 'maxspeed', 'hgv', 'hov', 'area', 'width',
+                 'est_width', 'junction']
+
+# same as osmnet.utils.great_circle_dist
+OSMNET_EARTH_RADIUS_METERS = 6372795
+
+# number of nodes read between lookups of the nodes we need
+NODE_BATCH_SIZE = 1000000
+
+# same server as osmnet
+OVERPASS_URL = 'http://www.overpass-api.de/api/interpreter'
+
+# status codes of an overloaded (or timed out) Overpass server
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_FILTER_PATTERN = re.compile(r'\["([^"]+)"(!~|~|!=|=)"([^"]*)"\]')
+
+
+def parse_osm_filter(filter_string):
+    """
+    Parse an Overpass way filter (as used by osmnet) into a list
+    of conditions.
+    Args:
+        filter_string: string, for example '["highway"!~"motor"]["foot"!~"no"]'.
+    Returns: list of (key, operator, compiled regex or value) tuples.
+    Raises:
+        ValueError: filter_string is not a sequence of ["key"op"value"].
+    """
+    conditions = []
+    position = 0
+    for match in _FILTER_PATTERN.finditer(filter_string):
+        if match.start() != position:
+            raise ValueError('Unable to parse osm filter: {}'.format(filter_string))
+        key, operator, value = match.groups()
+        if operator in {'~', '!~'}:
+            value = re.compile(value)
+        conditions.append((key, operator, value))
+        position = match.end()
+    if position != len(filter_string):
+        raise ValueError('Unable to parse osm filter: {}'.format(filter_string))
+    return conditions
+
+
+def matches_osm_filter(tags, conditions):
+    """
+    Args:
+        tags: dictionary of way tags.
+        conditions: list of conditions from parse_osm_filter.
+    Returns: true if a way with tags is a highway that passes
+        every condition (with Overpass semantics: negated
+        conditions also pass when the tag is missing).
+    """
+    if 'highway' not in tags:
+        return False
+    for key, operator, value in conditions:
+        tag = tags.get(key)
+        if operator == '~':
+            if tag is None or value.search(tag) is None:
+                return False
+        elif operator == '!~':
+            if tag is not None and value.search(tag) is not None:
+                return False
+        elif operator == '=':
+            if tag != value:
+                return False
+        elif tag == value:
+            return False
+    return True
+
+
+def get_osm_filter(network_type, custom_osm_filter=None):
+    """
+    Args:
+        network_type: string, one of {'walk', 'drive'} (or any type,
+            if custom_osm_filter is given).
+        custom_osm_filter: optional Overpass way filter.
+    Returns: list of conditions for network_type.
+    """
+    if custom_osm_filter is None:
+        custom_osm_filter = osm_filter(network_type)
+    return parse_osm_filter(custom_osm_filter)
+
+
+class _WayCollector:
+    """
+    Accumulate the highways that pass a filter.
+    """
+
+    def __init__(self, conditions):
+        self.conditions = conditions
+        self.way_tags = []
+        self.way_positions = array('q')
+        self.node_ids = array('q')
+
+    def add_way(self, tags, node_ids):
+        """
+        Args:
+            tags: dictionary of way tags.
+            node_ids: list of node ids of the way, in order.
+        """
+        if not matches_osm_filter(tags, self.conditions):
+            return
+        position = len(self.way_tags)
+        self.way_tags.append({key: value for key, value in tags.items() if key in KEEP_OSM_TAGS})
+        self.way_positions.extend([position] * len(node_ids))
+        self.node_ids.extend(node_ids)
+
+
+class _NodeCollector:
+    """
+    Accumulate the coordinates of the nodes we need, in
+    batches so memory stays bounded by the needed nodes.
+    """
+
+    def __init__(self, needed_node_ids):
+        self.needed_node_ids = needed_node_ids
+        self.batch_ids = array('q')
+        self.batch_lons = array('d')
+        self.batch_lats = array('d')
+        self.ids = [np.empty(0, dtype=np.int64)]
+        self.lons = [np.empty(0, dtype=np.float64)]
+        self.lats = [np.empty(0, dtype=np.float64)]
+
+    def add_node(self, node_id, lon, lat):
+        self.batch_ids.append(node_id)
+        self.batch_lons.append(lon)
+        self.batch_lats.append(lat)
+        if len(self.batch_ids) >= NODE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Keep the needed nodes of the current batch.
+        """
+        ids = np.frombuffer(self.batch_ids, dtype=np.int64)
+        if len(ids) > 0:
+            keep = np.isin(ids, self.needed_node_ids)
+            self.ids.append(ids[keep].copy())
+            self.lons.append(np.frombuffer(self.batch_lons, dtype=np.float64)[keep].copy())
+            self.lats.append(np.frombuffer(self.batch_lats, dtype=np.float64)[keep].copy())
+        self.batch_ids = array('q')
+        self.batch_lons = array('d')
+        self.batch_lats = array('d')
+
+    def get_nodes(self):
+        """
+        Returns: DataFrame of lon and lat indexed by node id.
+        """
+        self.flush()
+        return pd.DataFrame({'lon': np.concatenate(self.lons),
+                             'lat': np.concatenate(self.lats)},
+                            index=pd.Index(np.concatenate(self.ids), name='id'))
+
+
+def _iterate_xml_elements(filename, tag):
+    """
+    Stream the top level elements of an .osm xml file.
+    Args:
+        filename: .osm filename.
+        tag: 'node' or 'way'.
+    Yields: elements named tag (cleared after use).
+    """
+    context = ElementTree.iterparse(filename, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event != 'end' or element.tag not in {'node', 'way', 'relation'}:
+            continue
+        if element.tag == tag:
+            yield element
+        root.clear()
+
+
+def _read_xml(filename, conditions):
+    """
+    Args:
+        filename: .osm filename.
+        conditions: list of conditions from parse_osm_filter.
+    Returns: (_WayCollector, _NodeCollector) of the file.
+    """
+    ways = _WayCollector(conditions)
+    for element in _iterate_xml_elements(filename, 'way'):
+        tags = {child.get('k'): child.get('v') for child in element if child.tag == 'tag'}
+        ways.add_way(tags, [int(child.get('ref')) for child in element if child.tag == 'nd'])
+
+    nodes = _NodeCollector(np.unique(np.frombuffer(ways.node_ids, dtype=np.int64)))
+    for element in _iterate_xml_elements(filename, 'node'):
+        nodes.add_node(int(element.get('id')), float(element.get('lon')), float(element.get('lat')))
+    return ways, nodes
+
+
+def _read_pbf(filename, conditions):
+    """
+    Args:
+        filename: .osm.pbf filename (requires pyosmium).
+        conditions: list of conditions from parse_osm_filter.
+    Returns: (_WayCollector, _NodeCollector) of the file.
+    """
+    import osmium
+
+    ways = _WayCollector(conditions)
+
+    class WayHandler(osmium.SimpleHandler):
+        def way(self, way):
+            ways.add_way({tag.k: tag.v for tag in way.tags}, [node.ref for node in way.nodes])
+
+    WayHandler().apply_file(filename)
+
+    nodes = _NodeCollector(np.unique(np.frombuffer(ways.node_ids, dtype=np.int64)))
+
+    class NodeHandler(osmium.SimpleHandler):
+        def node(self, node):
+            if node.location.valid():
+                nodes.add_node(node.id, node.location.lon, node.location.lat)
+
+    NodeHandler().apply_file(filename)
+    return ways, nodes
+
+
+def _great_circle_distance(lat_a, lon_a, lat_b, lon_b):
+    """
+    Args:
+        lat_a, lon_a, lat_b, lon_b: numpy arrays of
+            coordinates in degrees.
+    Returns: numpy array of distances in meters (as osmnet).
+    """
+    lat_a, lon_a, lat_b, lon_b = map(np.radians, (lat_a, lon_a, lat_b, lon_b))
+    half_chord = np.sin((lat_b - lat_a) / 2) ** 2 + \
+        np.cos(lat_a) * np.cos(lat_b) * np.sin((lon_b - lon_a) / 2) ** 2
+    return 2 * OSMNET_EARTH_RADIUS_METERS * np.arcsin(np.sqrt(half_chord))
+
+
+def read_osm_extract(filename, network_type, custom_osm_filter=None):
+    """
+    Build the nodes and edges tables osmnet.network_from_bbox
+    returns from a local OSM extract, streaming the file twice
+    (ways, then the nodes they use).
+
+    Args:
+        filename: .osm (xml) or .osm.pbf filename. pbf requires
+            the optional pyosmium package.
+        network_type: string, one of {'walk', 'drive'} (or any type,
+            if custom_osm_filter is given).
+        custom_osm_filter: optional Overpass way filter.
+    Returns: nodes and edges DataFrames.
+    Raises:
+        ValueError: the extract has no connected node pairs.
+    """
+    conditions = get_osm_filter(network_type, custom_osm_filter)
+    if filename.lower().endswith('.pbf'):
+        ways, nodes = _read_pbf(filename, conditions)
+    else:
+        ways, nodes = _read_xml(filename, conditions)
+    node_table = nodes.get_nodes()
+
+    way_positions = np.frombuffer(ways.way_positions, dtype=np.int64)
+    node_ids = np.frombuffer(ways.node_ids, dtype=np.int64)
+
+    # drop way nodes missing from the extract (ways cut at its border)
+    found = np.isin(node_ids, node_table.index.values)
+    way_positions = way_positions[found]
+    node_ids = node_ids[found]
+
+    # edges connect consecutive intersections (nodes used 2+ times) of a way
+    unique_ids, counts = np.unique(node_ids, return_counts=True)
+    is_intersection = np.isin(node_ids, unique_ids[counts > 1])
+    way_positions = way_positions[is_intersection]
+    node_ids = node_ids[is_intersection]
+    is_pair = (way_positions[:-1] == way_positions[1:]) & (node_ids[:-1] != node_ids[1:])
+    from_ids = node_ids[:-1][is_pair]
+    to_ids = node_ids[1:][is_pair]
+    if len(from_ids) == 0:
+        raise ValueError('{} has no connected node pairs'.format(filename))
+
+    from_locs = node_table.loc[from_ids]
+    to_locs = node_table.loc[to_ids]
+    distances = _great_circle_distance(from_locs['lat'].values, from_locs['lon'].values,
+                                       to_locs['lat'].values, to_locs['lon'].values).round(6)
+    edges = pd.DataFrame({'from': from_ids, 'to': to_ids, 'distance': distances})
+    way_tags = pd.DataFrame.from_records(ways.way_tags, columns=[tag for tag in KEEP_OSM_TAGS
+                                                                 if any(tag in tags for tags in ways.way_tags)])
+    edges = edges.join(way_tags.iloc[way_positions[:-1][is_pair]].reset_index(drop=True))
+    edges.index = pd.MultiIndex.from_arrays([from_ids, to_ids])
+
+    used_ids = np.union1d(from_ids, to_ids)
+    nodes_table = node_table.loc[used_ids].rename(columns={'lon': 'x', 'lat': 'y'})
+    nodes_table['id'] = nodes_table.index
+    return nodes_table, edges
+
+
+def get_overpass_query(bbox, network_type, custom_osm_filter=None, timeout=180):
+    """
+    Args:
+        bbox: [lat_min, lon_min, lat_max, lon_max].
+        network_type: string, one of {'walk', 'drive'} (or any type,
+            if custom_osm_filter is given).
+        custom_osm_filter: optional Overpass way filter.
+        timeout: int, server side timeout (seconds).
+    Returns: the Overpass query osmnet sends for the highways
+        (and their nodes) in bbox.
+    """
+    if custom_osm_filter is None:
+        custom_osm_filter = osm_filter(network_type)
+    lat_min, lon_min, lat_max, lon_max = bbox
+    return '[out:json][timeout:{timeout}];(way["highway"]{filters}' \
+           '({lat_min:.8f},{lon_min:.8f},{lat_max:.8f},{lon_max:.8f});>;);out;'.format(
+               timeout=timeout, filters=custom_osm_filter, lat_min=lat_min,
+               lon_min=lon_min, lat_max=lat_max, lon_max=lon_max)
+
+
+def request_overpass(query, url=OVERPASS_URL, timeout=180, retries=3, backoff=1.0, logger=None):
+    """
+    Post a query to an Overpass server, retrying with exponential
+    backoff when the server is overloaded or times out (but not
+    when it cannot be reached at all).
+    Args:
+        query: Overpass query.
+        url: Overpass interpreter url.
+        timeout: numeric, timeout (seconds) of each request.
+        retries: int, number of retries after the first request.
+        backoff: numeric, wait (seconds) before the first retry (doubled
+            before each later retry).
+        logger: optional, logger.
+    Returns: dictionary of the json response.
+    Raises:
+        requests.RequestException: the last request failed.
+        ValueError: the server returned invalid json.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = requests.post(url, data={'data': query}, timeout=timeout)
+        except requests.Timeout as error:
+            failure = error
+        else:
+            if response.status_code in RETRY_STATUS_CODES:
+                failure = requests.HTTPError('{} returned status code {}'.format(url, response.status_code),
+                                             response=response)
+            else:
+                response.raise_for_status()
+                response_json = response.json()
+                # the server timed out or ran out of memory
+                remark = response_json.get('remark', '')
+                if 'runtime error' not in remark:
+                    return response_json
+                failure = requests.HTTPError('{} returned: {}'.format(url, remark), response=response)
+        if attempt == retries:
+            raise failure
+        wait = backoff * 2 ** attempt
+        if logger:
+            logger.debug('Overpass request failed (%s), retrying in %.1f seconds', failure, wait)
+        time.sleep(wait)
+
+
+def _empty_network():
+    """
+    Returns: empty nodes and edges DataFrames, with the
+        columns osmnet.network_from_bbox returns.
+    """
+    nodes = pd.DataFrame({'x': pd.Series(dtype=np.float64), 'y': pd.Series(dtype=np.float64),
+                          'id': pd.Series(dtype=np.int64)}, index=pd.Index([], dtype=np.int64, name='id'))
+    edges = pd.DataFrame({'from': pd.Series(dtype=np.int64), 'to': pd.Series(dtype=np.int64),
+                          'distance': pd.Series(dtype=np.float64)},
+                         index=pd.MultiIndex.from_arrays([[], []]))
+    return nodes, edges
+
+
+def _has_node_pairs(waynodes):
+    """
+    Args:
+        waynodes: DataFrame of way nodes (indexed by way id, in
+            order along each way), as osmnet parses them.
+    Returns: true if any way connects two intersections (nodes
+        used 2+ times), so osmnet's node_pairs will not raise.
+    """
+    way_ids = waynodes.index.values
+    node_ids = waynodes['node_id'].values
+    counts = waynodes['node_id'].value_counts()
+    is_intersection = np.isin(node_ids, counts.index[counts > 1])
+    way_ids = way_ids[is_intersection]
+    node_ids = node_ids[is_intersection]
+    return bool(((way_ids[:-1] == way_ids[1:]) & (node_ids[:-1] != node_ids[1:])).any())
+
+
+def _empty_osm_elements():
+    """
+    Returns: empty nodes, ways and waynodes DataFrames, as
+        osmnet parses them.
+    """
+    nodes = pd.DataFrame({'lat': pd.Series(dtype=np.float64), 'lon': pd.Series(dtype=np.float64)},
+                         index=pd.Index([], dtype=np.int64, name='id'))
+    ways = pd.DataFrame(index=pd.Index([], dtype=np.int64, name='id'))
+    waynodes = pd.DataFrame({'node_id': pd.Series(dtype=np.int64)},
+                            index=pd.Index([], dtype=np.int64, name='way_id'))
+    return nodes, ways, waynodes
+
+
+def parse_overpass_json(response_json):
+    """
+    Args:
+        response_json: dictionary of the json response.
+    Returns: nodes (indexed by id), ways (indexed by id) and
+        waynodes (indexed by way id, in order along each way)
+        DataFrames, as osmnet parses them (empty if the response
+        has no highways).
+    """
+    elements = response_json.get('elements', [])
+    if not any(element['type'] == 'way' for element in elements):
+        return _empty_osm_elements()
+    return parse_network_osm_query({'elements': elements})
+
+
+def merge_osm_elements(elements):
+    """
+    Stitch together the osm elements of several responses (of
+    overlapping or adjacent areas), keeping the first copy of
+    each node and way, as osmnet does for its sub-queries.
+    Args:
+        elements: list of (nodes, ways, waynodes) DataFrames.
+    Returns: nodes, ways and waynodes DataFrames.
+    """
+    nodes = pd.concat([element_nodes for element_nodes, _, _ in elements])
+    nodes = nodes[~nodes.index.duplicated()]
+    ways = pd.concat([element_ways for _, element_ways, _ in elements], sort=False)
+    response_numbers = np.concatenate([np.full(len(element_ways), response_number, dtype=np.int64)
+                                       for response_number, (_, element_ways, _) in enumerate(elements)])
+    is_first = ~ways.index.duplicated()
+    ways = ways[is_first]
+    # the way nodes of each way, from the response its first copy is in
+    first_response = pd.Series(response_numbers[is_first], index=ways.index)
+    waynodes = pd.concat([element_waynodes[first_response.reindex(element_waynodes.index).values == response_number]
+                          for response_number, (_, _, element_waynodes) in enumerate(elements)])
+    return nodes, ways, waynodes
+
+
+def network_from_osm_elements(nodes, ways, waynodes):
+    """
+    Build the nodes and edges tables osmnet.network_from_bbox
+    returns from osm elements.
+    Args:
+        nodes: DataFrame of nodes, as osmnet parses them.
+        ways: DataFrame of ways, as osmnet parses them.
+        waynodes: DataFrame of way nodes, as osmnet parses them.
+    Returns: nodes and edges DataFrames (empty if there are no
+        highways, or no highways connecting two intersections).
+    """
+    if len(ways) == 0 or not _has_node_pairs(waynodes):
+        return _empty_network()
+    edges = node_pairs(nodes, ways, waynodes, two_way=True)
+    node_ids = sorted(set(edges['from_id'].unique()).union(set(edges['to_id'].unique())))
+    nodes = nodes.loc[node_ids, ['lon', 'lat']].rename(columns={'lon': 'x', 'lat': 'y'})
+    nodes['id'] = nodes.index
+    edges = edges.rename(columns={'from_id': 'from', 'to_id': 'to'})
+    return nodes, edges
+
+
+def network_from_overpass_json(response_json):
+    """
+    Build the nodes and edges tables osmnet.network_from_bbox
+    returns from an Overpass response.
+    Args:
+        response_json: dictionary of the json response.
+    Returns: nodes and edges DataFrames (empty if the response
+        has no highways, or no highways connecting two
+        intersections).
+    """
+    return network_from_osm_elements(*parse_overpass_json(response_json))
+
+
+def fetch_osm_elements(bbox, network_type, custom_osm_filter=None, url=OVERPASS_URL,
+                       timeout=180, retries=3, backoff=1.0, logger=None):
+    """
+    Fetch the highways (and their nodes) in bbox from an
+    Overpass server.
+    Args:
+        bbox: [lat_min, lon_min, lat_max, lon_max].
+        network_type: string, one of {'walk', 'drive'} (or any type,
+            if custom_osm_filter is given).
+        custom_osm_filter: optional Overpass way filter.
+        url: Overpass interpreter url.
+        timeout: numeric, timeout (seconds) of each request.
+        retries: int, number of retries after the first request.
+        backoff: numeric, wait (seconds) before the first retry.
+        logger: optional, logger.
+    Returns: nodes, ways and waynodes DataFrames (see
+        parse_overpass_json).
+    Raises:
+        requests.RequestException: the request failed.
+    """
+    query = get_overpass_query(bbox, network_type, custom_osm_filter, timeout)
+    response_json = request_overpass(query, url=url, timeout=timeout, retries=retries,
+                                     backoff=backoff, logger=logger)
+    return parse_overpass_json(response_json)
+
+
+def fetch_network(bbox, network_type, custom_osm_filter=None, url=OVERPASS_URL,
+                  timeout=180, retries=3, backoff=1.0, logger=None):
+    """
+    Fetch the network in bbox from an Overpass server.
+    Args:
+        bbox: [lat_min, lon_min, lat_max, lon_max].
+        network_type: string, one of {'walk', 'drive'} (or any type,
+            if custom_osm_filter is given).
+        custom_osm_filter: optional Overpass way filter.
+        url: Overpass interpreter url.
+        timeout: numeric, timeout (seconds) of each request.
+        retries: int, number of retries after the first request.
+        backoff: numeric, wait (seconds) before the first retry.
+        logger: optional, logger.
+    Returns: nodes and edges DataFrames.
+    Raises:
+        requests.RequestException: the request failed.
+    """
+    return network_from_osm_elements(*fetch_osm_elements(bbox, network_type, custom_osm_filter, url=url,
+                                                         timeout=timeout, retries=retries,
+                                                         backoff=backoff, logger=logger))
@@ -0,0 +1,85 @@
+# Logan Noel (github.com/lmnoel)
+#
+# ©2017-2019, Center for Spatial Data Science
+
+import os
+import pandas as pd
+
+PARQUET_EXTENSIONS = {'parquet', 'pq'}
+FEATHER_EXTENSIONS = {'feather'}
+
+
+def _get_extension(filename):
+    """
+    Args:
+        filename: string.
+    Returns: lower case file extension (no ".").
+    """
+    return filename.split('.')[-1].lower()
+
+
+def table_exists(source):
+    """
+    Args:
+        source: DataFrame or filename.
+    Returns: true if source is a DataFrame or an existing file.
+    """
+    if isinstance(source, pd.DataFrame):
+        return True
+    return os.path.isfile(source)
+
+
+def read_column_names(source):
+    """
+    Read only the column names of a table.
+    Args:
+        source: DataFrame, or csv, parquet or feather filename.
+    Returns: list of column names (including a named index
+        for DataFrames).
+    """
+    if isinstance(source, pd.DataFrame):
+        column_names = list(source.columns)
+        if source.index.name is not None and source.index.name not in column_names:
+            column_names.append(source.index.name)
+        return column_names
+    extension = _get_extension(source)
+    if extension in PARQUET_EXTENSIONS:
+        import pyarrow.parquet
+        schema = pyarrow.parquet.read_schema(source)
+        return [name for name in schema.names if not name.startswith('__index_level_')]
+    if extension in FEATHER_EXTENSIONS:
+        import pyarrow.ipc
+        with pyarrow.ipc.open_file(source) as reader:
+            return list(reader.schema.names)
+    return list(pd.read_csv(source, nrows=0).columns)
+
+
+def read_table(source, columns, dtype=None):
+    """
+    Read only the given columns of a table.
+    Args:
+        source: DataFrame, or csv, parquet or feather filename.
+        columns: list of column names to read.
+        dtype: optional dictionary of {column name: dtype}.
+    Returns: DataFrame.
+    Raises:
+        KeyError: a column is not in the table.
+    """
+    missing_columns = set(columns) - set(read_column_names(source))
+    if missing_columns:
+        raise KeyError(', '.join(str(column) for column in missing_columns))
+    if isinstance(source, pd.DataFrame):
+        if source.index.name in columns and source.index.name not in source.columns:
+            source = source.reset_index()
+        table = source[columns]
+    else:
+        extension = _get_extension(source)
+        if extension in PARQUET_EXTENSIONS:
+            table = pd.read_parquet(source, columns=columns)
+        elif extension in FEATHER_EXTENSIONS:
+            table = pd.read_feather(source, columns=columns)
+        else:
+            return pd.read_csv(source, usecols=columns, dtype=dtype)
+    if dtype:
+        table = table.astype(dtype)
+    return table
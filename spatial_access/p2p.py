@@ -6,14 +6,21 @@
 import time
 import logging
 import os
-import scipy.spatial
-from geopy import distance
+import copy
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import shapely
 import pandas as pd
+import numpy as np
 from numpy import issubdtype, integer, signedinteger
 
 from spatial_access.MatrixInterface import MatrixInterface
 from spatial_access.NetworkInterface import NetworkInterface
+from spatial_access.NetworkInterface import EARTH_RADIUS_METERS
 from spatial_access.Configs import Configs
+from spatial_access import _readers
 
 from spatial_access.SpatialAccessExceptions import PrimaryDataNotFoundException
 from spatial_access.SpatialAccessExceptions import SecondaryDataNotFoundException
@@ -25,6 +32,23 @@ from spatial_access.SpatialAccessExceptions import DuplicateInputException
 from spatial_access.SpatialAccessExceptions import WriteTMXFailedException
 from spatial_access.SpatialAccessExceptions import WriteCSVFailedException
 from spatial_access.SpatialAccessExceptions import ImproperIndecesTypeException
+from spatial_access.SpatialAccessExceptions import UnableToBuildMatrixException
+
+
+def _compute_partition(partition_args):
+    """
+    Compute one row block of a partitioned matrix and write it
+    to tmx. Runs in a worker process.
+
+    Args:
+        partition_args: tuple of (TransitMatrix constructor kwargs,
+            first row, last row (exclusive), output filename).
+    """
+    transit_matrix_kwargs, start, end, outfile = partition_args
+    transit_matrix = TransitMatrix(**transit_matrix_kwargs)
+    transit_matrix.process_row_range(start, end)
+    transit_matrix.write_tmx(outfile)
+    return outfile
 
 
 class TransitMatrix:
@@ -44,10 +68,10 @@ class TransitMatrix:
         """
         Args:
             network_type: string, one of {'walk', 'bike', 'drive', 'otp'}.
-            primary_input: string, csv filename.
-            secondary_input: string, csv filename (omit to calculate an NxN matrix on
-                the primary_input).
-            read_from_file: string, tmx or csv filename.
+            primary_input: string, csv, parquet or feather filename, or a DataFrame.
+            secondary_input: string, csv, parquet or feather filename, or a DataFrame
+                (omit to calculate an NxN matrix on the primary_input).
+            read_from_file: string, tmx, csv, parquet or arrow filename.
             primary_hints: dictionary, map column names to expected values.
             secondary_hints: dictionary, map column names to expected values.
             debug: boolean, enable to see more detailed logging output.
@@ -75,6 +99,15 @@ class TransitMatrix:
         self.primary_data = None
         self.secondary_data = None
 
+        # graph vertices and edges added when snapping to edges
+        self._next_virtual_loc = None
+        # (edge position, fraction along the edge, vertex loc) of
+        # the points snapped to edges
+        self._edge_snaps = []
+
+        # (network node locs, last mile distances) of the snapped inputs
+        self._snapped_points = {}
+
         # start the logger
         self.logger = None
         self.set_logging(debug)
@@ -87,15 +120,25 @@ class TransitMatrix:
             self.configs = Configs()
 
         self._network_interface = NetworkInterface(network_type, logger=self.logger,
-                                                   disable_area_threshold=self.configs.disable_area_threshold)
+                                                   disable_area_threshold=self.configs.disable_area_threshold,
+                                                   tile_size=self.configs.cache_tile_size,
+                                                   max_cache_size=self.configs.max_cache_size,
+                                                   osm_extract=self.configs.osm_extract,
+                                                   overpass_url=self.configs.overpass_url,
+                                                   fetch_workers=self.configs.fetch_workers,
+                                                   fetch_retries=self.configs.fetch_retries)
 
         self.matrix_interface = MatrixInterface(logger=self.logger,
-                                                require_extended_range=self.configs.require_extended_range)
+                                                require_extended_range=self.configs.require_extended_range,
+                                                thread_limit=self.configs.thread_limit,
+                                                pin_threads=self.configs.pin_threads,
+                                                max_memory=self.configs.max_memory,
+                                                spill_directory=self.configs.spill_directory)
 
         if network_type not in {'drive', 'walk', 'bike', 'otp'}:
             raise UnknownModeException(network_type)
 
-        if self.primary_input == self.secondary_input and self.primary_input is not None:
+        if self.primary_input is not None and self._is_same_input(self.primary_input, self.secondary_input):
             raise DuplicateInputException("Gave duplicate inputs: {}".format(self.primary_input))
 
         # need to supply either:
@@ -149,6 +192,16 @@ class TransitMatrix:
 
         return filename
 
+    @staticmethod
+    def _is_same_input(primary_input, secondary_input):
+        """
+        Returns: true if both inputs are the same file or
+            the same DataFrame.
+        """
+        if isinstance(primary_input, pd.DataFrame) or isinstance(secondary_input, pd.DataFrame):
+            return primary_input is secondary_input
+        return primary_input == secondary_input
+
     @staticmethod
     def _get_type_of_series(series):
         """
@@ -159,7 +212,7 @@ class TransitMatrix:
             is not one of the expected types.
         """
 
-        if type(series[0]) == str:
+        if type(series.iloc[0]) == str:
             return str
         elif issubdtype(series.dtype, integer) or issubdtype(series.dtype, signedinteger):
             return integer
@@ -178,12 +231,11 @@ class TransitMatrix:
                 mapping to column names failed.
         """
         if primary:
-            filename = self.primary_input
+            source = self.primary_input
         else:
-            filename = self.secondary_input
+            source = self.secondary_input
 
-        source_data = pd.read_csv(filename)
-        source_data_columns = source_data.columns.values
+        source_data_columns = _readers.read_column_names(source)
 
         # extract the column names
         lon = ''
@@ -214,6 +266,10 @@ class TransitMatrix:
             while idx not in source_data_columns:
                 idx = input('Enter the index name: ')
 
+        # only read the columns we need
+        source_data = _readers.read_table(source, [idx, lon, lat],
+                                          dtype={lon: 'float64', lat: 'float64'})
+
         # drop nan lines
         pre_drop = len(source_data)
         source_data.dropna(subset=[lon, lat], axis='index', inplace=True)
@@ -251,11 +307,11 @@ class TransitMatrix:
             PrimaryDataNotFoundException: Primary data isn't found.
             SecondaryDataNotFoundException: Secondary data isn't found.
         """
-        if not os.path.isfile(self.primary_input):
+        if not _readers.table_exists(self.primary_input):
             self.logger.error("Unable to find primary csv.")
             raise PrimaryDataNotFoundException("Unable to find primary csv")
-        if self.secondary_input:
-            if not os.path.isfile(self.secondary_input):
+        if self.secondary_input is not None:
+            if not _readers.table_exists(self.secondary_input):
                 self.logger.error("Unable to find secondary csv.")
                 raise SecondaryDataNotFoundException("Unable to find secondary csv")
         else:
@@ -266,23 +322,12 @@ class TransitMatrix:
         except KeyError:
             raise UnableToParsePrimaryDataException()
 
-        if self.secondary_input:
+        if self.secondary_input is not None:
             try:
                 self._parse_csv(False)
             except KeyError:
                 raise UnableToParseSecondaryDataException()
 
-    def _reduce_node_indeces(self):
-        """
-        Map the network indeces to location.
-        Returns:
-            dictionary of {node index : node location}
-        """
-        simple_node_indeces = {}
-        for position, id_ in enumerate(self._network_interface.nodes['id']):
-            simple_node_indeces[id_] = position
-        return simple_node_indeces
-
     def _parse_network(self):
         """
         Cleans and generates the city network.
@@ -291,36 +336,54 @@ class TransitMatrix:
         start_time = time.time()
 
         edges = self._network_interface.edges
+        from_column = self._network_interface.get_node_locs(edges['from'].values)
+        to_column = self._network_interface.get_node_locs(edges['to'].values)
 
+        virtual_edges = self._get_virtual_edges()
+        if virtual_edges is not None:
+            edges = pd.concat([edges, virtual_edges], ignore_index=True, sort=False)
+            from_column = np.concatenate([from_column, virtual_edges['from_loc'].values])
+            to_column = np.concatenate([to_column, virtual_edges['to_loc'].values])
+
+        distances = edges['distance'].values
+        node_penalty = 0
         if self.configs.use_meters:
-            edges['edge_weight'] = edges['distance']
+            edge_weight_column = distances
         elif self.network_type == 'walk':
-            edges['edge_weight'] = edges['distance'] / self.configs._get_walk_speed() \
-                                        + self.configs.walk_node_penalty
+            edge_weight_column = distances / self.configs._get_walk_speed()
+            node_penalty = self.configs.walk_node_penalty
         elif self.network_type == 'bike':
-            edges['edge_weight'] = edges['distance'] / self.configs._get_bike_speed() \
-                                        + self.configs.bike_node_penalty
+            edge_weight_column = distances / self.configs._get_bike_speed()
+            node_penalty = self.configs.bike_node_penalty
         elif self.network_type == 'drive':
             driving_cost_matrix = self.configs._get_driving_cost_matrix()
-            edges = pd.merge(edges, driving_cost_matrix, how='left', left_on='highway', right_index=True)
-            edges['unit_cost'].fillna(self.configs._get_default_drive_speed(), inplace=True)
-            edges['edge_weight'] = edges['distance'] / edges['unit_cost'] + self.configs.drive_node_penalty
+            unit_costs = edges['highway'].map(driving_cost_matrix['unit_cost'])
+            unit_costs = unit_costs.fillna(self.configs._get_default_drive_speed()).values
+            edge_weight_column = distances / unit_costs
+            node_penalty = self.configs.drive_node_penalty
+
+        edge_multipliers = self.configs._get_edge_multipliers()
+        if edge_multipliers is not None and not self.configs.use_meters:
+            edge_keys = pd.MultiIndex.from_arrays([edges['from'].values, edges['to'].values])
+            edge_weight_column = edge_weight_column * edge_multipliers.reindex(edge_keys).fillna(1).values
+        edge_weight_column = edge_weight_column + node_penalty
 
         if self.network_type == 'walk' or self.network_type == 'bike':
-            edges['is_bidirectional'] = True
+            is_bidirectional_column = np.ones(len(edges), dtype=bool)
         elif self.network_type == 'drive':
-            edges['is_bidirectional'] = edges['oneway'] != "yes"
-
-        simple_node_indeces = self._reduce_node_indeces()
+            is_bidirectional_column = (edges['oneway'] != "yes").values
 
-        edges['from_loc'] = edges['from'].map(simple_node_indeces)
-        edges['to_loc'] = edges['to'].map(simple_node_indeces)
-        edges['edge_weight'] = edges['edge_weight'].astype('int16')
+        edge_weight_column = self.matrix_interface._as_value_array(np.trunc(edge_weight_column).astype(np.int64))
 
-        from_column = list(edges['from_loc'])
-        to_column = list(edges['to_loc'])
-        edge_weight_column = list(edges['edge_weight'])
-        is_bidirectional_column = list(edges['is_bidirectional'])
+        if self.configs.simplify_network:
+            num_edges = len(edge_weight_column)
+            keep_mask = np.zeros(self._get_network_vertices(self.primary_data, self.secondary_data), dtype=bool)
+            for node_locs, _ in self._snapped_points.values():
+                keep_mask[node_locs] = True
+            from_column, to_column, edge_weight_column, is_bidirectional_column = \
+                self.matrix_interface.contract_edges(from_column, to_column, edge_weight_column,
+                                                     is_bidirectional_column, keep_mask)
+            self.logger.debug("Contracted {:,} edges to {:,}".format(num_edges, len(edge_weight_column)))
 
         self.matrix_interface.add_edges_to_graph(from_column, to_column, edge_weight_column,
                                                  is_bidirectional_column)
@@ -343,14 +406,8 @@ class TransitMatrix:
         else:
             data = self.secondary_data
 
-        nodes = self._network_interface.nodes[['x', 'y']]
-
         start_time = time.time()
 
-        # make a kd tree in the lat, long dimension
-        node_array = nodes.values
-        kd_tree = scipy.spatial.cKDTree(node_array)
-
         unit_cost = 1
         if self.configs.use_meters:
             unit_cost = 1
@@ -363,36 +420,151 @@ class TransitMatrix:
         else:
             assert False, "Unknown type"
 
-        # map each node in the source/dest data to the nearest
-        # corresponding node in the OSM network
-        # and write to file
-        for row in data.itertuples():
-            origin_id, origin_x, origin_y = row
-            latlong_diff, node_loc = kd_tree.query([origin_x, origin_y], k=1)
-            node_number = nodes.index[node_loc]
-            origin_location = (origin_y, origin_x)
-            closest_node_location = (nodes.loc[node_number].y,
-                                                       nodes.loc[node_number].x)
-
-            # keep track of nodes that are used to snap a user data point
-            edge_distance = distance.distance(origin_location, closest_node_location).m
-
-            edge_weight = int(edge_distance / unit_cost)
-
-            if is_primary:
-                self.matrix_interface.add_user_source_data(network_id=node_loc,
-                                                           user_id=origin_id,
-                                                           weight=edge_weight,
-                                                           is_also_dest=is_also_secondary)
-            else:
-                self.matrix_interface.add_user_dest_data(network_id=node_loc,
-                                                         user_id=origin_id,
-                                                         weight=edge_weight)
+        node_locs, edge_distances = self._snap_points(is_primary)
+        edge_weights = (edge_distances / unit_cost).astype(np.int64)
+
+        if is_primary:
+            self.matrix_interface.add_user_source_data_bulk(network_ids=node_locs,
+                                                            user_ids=data.index.values,
+                                                            weights=edge_weights,
+                                                            is_also_dest=is_also_secondary)
+        else:
+            self.matrix_interface.add_user_dest_data_bulk(network_ids=node_locs,
+                                                          user_ids=data.index.values,
+                                                          weights=edge_weights)
 
         time_delta = time.time() - start_time
         self.logger.debug(
             'Nearest Neighbor matching completed in {:,.2f} seconds'.format(time_delta))
 
+    def _snap_points(self, is_primary):
+        """
+        Snap the primary or secondary dataset to the network (once;
+        later calls return the same result).
+
+        Args:
+            is_primary: true if this is the primary dataset.
+        Returns: (array of the network node loc of each point,
+            array of distances in meters from each point to its node)
+        """
+        key = 'primary' if is_primary else 'secondary'
+        if key in self._snapped_points:
+            return self._snapped_points[key]
+
+        data = self.primary_data if is_primary else self.secondary_data
+        origin_array = data[['lon', 'lat']].values
+        projected_origins = self._network_interface.project_coordinates(origin_array[:, 0], origin_array[:, 1])
+
+        if self.configs.snap_to_edges:
+            node_locs, edge_distances = self._snap_to_edges(projected_origins)
+        else:
+            # map each node in the source/dest data to the nearest
+            # corresponding node in the OSM network, all in one query
+            node_array = self._network_interface.nodes[['x', 'y']].values
+            kd_tree = self._network_interface.get_node_index()
+            _, node_locs = kd_tree.query(projected_origins, k=1, workers=-1)
+
+            # last mile distance from each point to its node
+            edge_distances = self._haversine_distance(origin_array[:, 1], origin_array[:, 0],
+                                                      node_array[node_locs, 1], node_array[node_locs, 0])
+        self._snapped_points[key] = (node_locs, edge_distances)
+        return node_locs, edge_distances
+
+    def _snap_to_edges(self, projected_origins):
+        """
+        Snap each point to the nearest point on the nearest edge,
+        adding a graph vertex there. The edges are split at these
+        vertices by _get_virtual_edges.
+
+        Args:
+            projected_origins: numpy array of shape (n, 2) of
+                projected point coordinates.
+        Returns: (array of the new vertex loc of each point,
+            array of distances in meters from each point to its vertex)
+        """
+        edge_index = self._network_interface.get_edge_index()
+        points = shapely.points(projected_origins)
+        query_locs, edge_distances = edge_index.query_nearest(points, return_distance=True,
+                                                              all_matches=False)
+        edge_positions = np.empty(len(points), dtype=np.int64)
+        edge_positions[query_locs[0]] = query_locs[1]
+        distances = np.empty(len(points))
+        distances[query_locs[0]] = edge_distances
+
+        # how far along its edge each point snaps, from 0 (from) to 1 (to)
+        fractions = shapely.line_locate_point(edge_index.geometries[edge_positions], points, normalized=True)
+        fractions = np.nan_to_num(fractions)
+
+        if self._next_virtual_loc is None:
+            self._next_virtual_loc = self._network_interface.number_of_nodes()
+        virtual_locs = np.arange(self._next_virtual_loc, self._next_virtual_loc + len(points))
+        self._next_virtual_loc += len(points)
+
+        self._edge_snaps.append(pd.DataFrame({'edge_position': edge_positions,
+                                              'fraction': fractions,
+                                              'loc': virtual_locs}))
+        return virtual_locs, distances
+
+    def _get_virtual_edges(self):
+        """
+        Split each edge points were snapped to at the points' vertices,
+        in order along the edge (from -> v1 -> v2 -> ... -> to), so that
+        points on the same edge reach each other directly.
+
+        Returns: DataFrame of the split edges (each keeps the attributes
+            of the edge it splits, and gains from_loc and to_loc columns),
+            or None if no points were snapped to edges.
+        """
+        if not self._edge_snaps:
+            return None
+        snaps = pd.concat(self._edge_snaps, ignore_index=True)
+        snaps = snaps.sort_values(['edge_position', 'fraction'], kind='stable')
+        edge_positions = snaps['edge_position'].values
+        fractions = snaps['fraction'].values
+        locs = snaps['loc'].values
+        is_first = np.r_[True, edge_positions[1:] != edge_positions[:-1]]
+        is_last = np.r_[edge_positions[1:] != edge_positions[:-1], True]
+
+        snapped_edges = self._network_interface.edges.iloc[edge_positions].reset_index(drop=True)
+        from_locs = self._network_interface.get_node_locs(snapped_edges['from'].values)
+        to_locs = self._network_interface.get_node_locs(snapped_edges['to'].values)
+        distances = snapped_edges['distance'].values
+
+        # the segment ending at each vertex starts at the previous
+        # vertex on the same edge, or at the edge's from node
+        previous_locs = np.where(is_first, from_locs, np.roll(locs, 1))
+        previous_fractions = np.where(is_first, 0, np.roll(fractions, 1))
+        segments = snapped_edges.assign(from_loc=previous_locs, to_loc=locs,
+                                        distance=distances * (fractions - previous_fractions))
+        # and the last vertex on each edge connects to its to node
+        last_segments = snapped_edges[is_last].assign(from_loc=locs[is_last], to_loc=to_locs[is_last],
+                                                      distance=distances[is_last] * (1 - fractions[is_last]))
+        return pd.concat([segments, last_segments], ignore_index=True, sort=False)
+
+    def _get_network_vertices(self, *datasets):
+        """
+        Args:
+            datasets: the DataFrames of points that will be snapped.
+        Returns: number of graph vertices needed.
+        """
+        network_vertices = self._network_interface.number_of_nodes()
+        if self.configs.snap_to_edges:
+            network_vertices += sum(len(data) for data in datasets if data is not None)
+        return network_vertices
+
+    @staticmethod
+    def _haversine_distance(lat_a, lon_a, lat_b, lon_b):
+        """
+        Args:
+            lat_a, lon_a, lat_b, lon_b: numpy arrays of
+                coordinates in degrees.
+        Returns: numpy array of great circle distances in meters.
+        """
+        lat_a, lon_a, lat_b, lon_b = map(np.radians, (lat_a, lon_a, lat_b, lon_b))
+        half_chord = np.sin((lat_b - lat_a) / 2) ** 2 + \
+            np.cos(lat_a) * np.cos(lat_b) * np.sin((lon_b - lon_a) / 2) ** 2
+        return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(half_chord))
+
     def write_csv(self, outfile=None):
         """
         Write the transit matrix to csv.
@@ -430,17 +602,57 @@ class TransitMatrix:
             raise WriteTMXFailedException('given filename does not have the correct extension (.tmx)')
         self.matrix_interface.write_tmx(outfile)
 
-    def prefetch_network(self):
+    def write_arrow(self, outfile=None, layout='long', row_group_size=None):
+        """
+        Write the transit matrix to parquet or arrow (IPC), for
+        external tools like Spark or DuckDB. Requires pyarrow.
+
+        Arguments:
+            outfile: optional filename, with a parquet (.parquet, .pq) or
+                arrow (.arrow, .ipc, .feather) extension. Defaults to parquet.
+            layout: 'long', one (origin, dest, cost) row per reachable pair,
+                or 'wide', one row per origin with a cost column per dest.
+            row_group_size: optional int, rows per parquet row group.
+        Raises:
+            WriteArrowFailedException: filename does not have correct extension,
+                or unknown layout.
+        """
+        if not outfile:
+            outfile = self._get_output_filename(self.network_type, extension='parquet')
+        self.matrix_interface.write_arrow(outfile, layout=layout, row_group_size=row_group_size)
+
+    def prefetch_network(self, bbox=None):
         """
         Fetch and cache the osm network.
+
+        Args:
+            bbox: optional, [lat_min, lon_min, lat_max, lon_max] already
+                computed for these inputs.
         """
-        self._load_inputs()
+        if self.primary_data is None:
+            self._load_inputs()
         self.logger.debug("Fetching network (%s) with epsilon: %f",
                           self.network_type, self.configs.epsilon)
         self._network_interface.load_network(self.primary_data,
                                              self.secondary_data,
                                              self.secondary_input is not None,
-                                             self.configs.epsilon)
+                                             self.configs.epsilon,
+                                             bbox=bbox)
+
+    def _share_inputs(self, other):
+        """
+        Use the inputs already parsed by another TransitMatrix
+        instead of parsing them again.
+
+        Args:
+            other: TransitMatrix with the same inputs, after _load_inputs.
+        """
+        self.primary_data = other.primary_data
+        self.secondary_data = other.secondary_data
+        self.primary_hints = other.primary_hints
+        self.secondary_hints = other.secondary_hints
+        self.matrix_interface.primary_ids_are_string = other.matrix_interface.primary_ids_are_string
+        self.matrix_interface.secondary_ids_are_string = other.matrix_interface.secondary_ids_are_string
 
     @staticmethod
     def clear_cache():
@@ -461,7 +673,7 @@ class TransitMatrix:
         Returns: true if the transit matrix is NxN, that is, has
             the same origins and destinations.
         """
-        return self.secondary_input is None
+        return self.secondary_input is None and self.secondary_data is None
 
     def process(self):
         """
@@ -472,38 +684,425 @@ class TransitMatrix:
 
         Raises:
             AssertionError: if this method is called on an OTP-matrix.
+            MatrixBuildCancelledException: if cancel() was called.
         """
         assert self.network_type != 'otp', 'no need to call process for an otp matrix'
         start_time = time.time()
 
         self.prefetch_network()
+        self._build_from_network()
+
+        time_delta = time.time() - start_time
+        self.logger.info('All operations completed in {:,.2f} seconds'.format(time_delta))
+
+    def process_to_csv(self, outfile=None, cutoff=None):
+        """
+        Like process, but write each row of the transit matrix to csv
+        as soon as it is computed, so the whole matrix is never held
+        in memory. Rows are written in the order they finish, as
+        headerless source,dest,value lines (the format read by
+        read_from_file with network_type 'otp'). Unreachable pairs
+        are left out.
+
+        Note: the values of a streamed matrix are not kept, so query
+        methods are unavailable afterwards.
 
+        Arguments:
+            outfile: optional filename.
+            cutoff: optional int. If given, pairs further apart than
+                cutoff are left out.
+        Raises:
+            AssertionError: if this method is called on an OTP-matrix.
+            WriteCSVFailedException: filename does not have correct extension,
+                or the file could not be written.
+            MatrixBuildCancelledException: if cancel() was called.
+        """
+        assert self.network_type != 'otp', 'no need to call process for an otp matrix'
+        if not outfile:
+            outfile = self._get_output_filename(self.network_type, extension='csv')
+        if '.csv' not in outfile:
+            raise WriteCSVFailedException('given filename does not have the correct extension (.csv)')
+        start_time = time.time()
+
+        self.prefetch_network()
+        try:
+            self._build_from_network(stream_filename=outfile, stream_cutoff=cutoff)
+        except UnableToBuildMatrixException:
+            raise WriteCSVFailedException(outfile)
+
+        time_delta = time.time() - start_time
+        self.logger.info('All operations completed in {:,.2f} seconds'.format(time_delta))
+
+    def _build_from_network(self, stream_filename=None, stream_cutoff=None):
+        """
+        Snap the user's data to the loaded network, parse the
+        network and calculate the transit matrix.
+
+        Args:
+            stream_filename: optional, csv to stream the rows to
+                instead of keeping them in memory.
+            stream_cutoff: optional int, drop streamed values above it.
+        Raises:
+            MatrixBuildCancelledException: if cancel() was called.
+        """
+        self.matrix_interface._raise_if_cancelled()
+        is_symmetric = self._is_symmetric()
         rows = len(self.primary_data)
 
-        if self.secondary_input is None:
+        if is_symmetric:
             cols = rows
             self.matrix_interface.secondary_ids_are_string = self.matrix_interface.primary_ids_are_string
         else:
             cols = len(self.secondary_data)
-        self.matrix_interface.prepare_matrix(is_symmetric=self._is_symmetric(),
-                                             is_compressible=self._is_compressible(),
+        self.matrix_interface.prepare_matrix(is_symmetric=is_symmetric,
+                                             is_compressible=self._is_compressible() and stream_filename is None,
                                              rows=rows,
                                              columns=cols,
-                                             network_vertices=self._network_interface.number_of_nodes())
+                                             network_vertices=self._get_network_vertices(self.primary_data,
+                                                                                         self.secondary_data),
+                                             stream_filename=stream_filename,
+                                             stream_cutoff=stream_cutoff)
 
-        if self.secondary_input:
+        if not is_symmetric:
             self._match_to_nearest_neighbor(is_primary=True, is_also_secondary=False)
             self._match_to_nearest_neighbor(is_primary=False, is_also_secondary=False)
         else:
             self._match_to_nearest_neighbor(is_primary=True, is_also_secondary=True)
+        self.matrix_interface._raise_if_cancelled()
 
         self._parse_network()
+        self.matrix_interface._raise_if_cancelled()
 
         # offload primary and secondary input data frames because we don't need them anymore
         self.primary_input = None
         self.secondary_input = None
 
         self.matrix_interface.build_matrix()
+
+    def reweight(self, configs):
+        """
+        Recompute the matrix with new speed settings (for example a new
+        speed_limit_dict or drive_node_penalty), reusing the loaded
+        network and the snapped inputs: only the edge weights and the
+        shortest paths are recomputed. Snapping settings (epsilon and
+        snap_to_edges) are kept from this matrix.
+
+        Args:
+            configs: instance of Configs.
+        Returns: a new, processed TransitMatrix.
+        Raises:
+            AssertionError: if the network has not been loaded (with process()
+                or prefetch_network()).
+        """
+        assert self._network_interface.nodes is not None, 'call process or prefetch_network before reweight'
+        start_time = time.time()
+
+        reweighted = copy.copy(self)
+        reweighted.configs = copy.copy(configs)
+        reweighted.configs.epsilon = self.configs.epsilon
+        reweighted.configs.snap_to_edges = self.configs.snap_to_edges
+        reweighted.matrix_interface = MatrixInterface(logger=self.logger,
+                                                      require_extended_range=configs.require_extended_range,
+                                                      thread_limit=configs.thread_limit,
+                                                      pin_threads=configs.pin_threads,
+                                                      max_memory=configs.max_memory,
+                                                      spill_directory=configs.spill_directory)
+        reweighted.matrix_interface.primary_ids_are_string = self.matrix_interface.primary_ids_are_string
+        reweighted.matrix_interface.secondary_ids_are_string = self.matrix_interface.secondary_ids_are_string
+        reweighted._build_from_network()
+
+        time_delta = time.time() - start_time
+        self.logger.info('Reweighted matrix in {:,.2f} seconds'.format(time_delta))
+        return reweighted
+
+    def process_profiles(self, profiles):
+        """
+        Compute one matrix per cost profile (for example peak, off-peak
+        and night drive speed tables, or edge_multipliers), loading the
+        inputs and the network and snapping the inputs only once. Each
+        profile only rebuilds the edge weights and recomputes the
+        shortest paths (see reweight).
+
+        Args:
+            profiles: dictionary of {profile name: Configs}.
+        Returns: dictionary of {profile name: processed TransitMatrix}.
+        Raises:
+            AssertionError: if this method is called on an OTP-matrix.
+        """
+        assert self.network_type != 'otp', 'no need to call process for an otp matrix'
+        if self._network_interface.nodes is None:
+            self.prefetch_network()
+
+        # snap once, before the profiles share the result
+        self._snap_points(is_primary=True)
+        if not self._is_symmetric():
+            self._snap_points(is_primary=False)
+
+        return {name: self.reweight(configs) for name, configs in profiles.items()}
+
+    def get_speed_scenarios(self, speeds):
+        """
+        Derive travel time matrices for several speeds from a walk or bike
+        matrix computed in meters (Configs(use_meters=True)) by rescaling
+        its values instead of recomputing them. Every walk (or bike) edge
+        has the same speed, so a shortest path in time is a shortest path
+        in meters divided by the speed.
+
+        Note: node penalties are not applied, and values may differ from
+        a full computation by rounding (seconds are truncated once per
+        path instead of once per edge).
+
+        Args:
+            speeds: iterable of speeds (km/hr).
+        Returns: dictionary of {speed: TransitMatrix in seconds}.
+        Raises:
+            AssertionError: if this is not a walk or bike matrix in meters.
+        """
+        assert self.network_type in {'walk', 'bike'}, 'speed scenarios are only for walk and bike matrices'
+        assert self.configs.use_meters, 'speed scenarios require a matrix computed with use_meters=True'
+        scenarios = {}
+        for speed in speeds:
+            scenario = copy.copy(self)
+            scenario.configs = copy.copy(self.configs)
+            scenario.configs.use_meters = False
+            if self.network_type == 'walk':
+                scenario.configs.walk_speed = speed
+                meters_per_second = scenario.configs._get_walk_speed()
+            else:
+                scenario.configs.bike_speed = speed
+                meters_per_second = scenario.configs._get_bike_speed()
+            scenario.matrix_interface = self.matrix_interface.get_scaled_copy(1 / meters_per_second)
+            scenarios[speed] = scenario
+        return scenarios
+
+    @classmethod
+    def process_multimodal(cls, network_types, primary_input, secondary_input=None,
+                           primary_hints=None, secondary_hints=None, debug=False,
+                           configs=None, max_workers=None):
+        """
+        Compute a transit matrix for each of several network types
+        with the same inputs.
+
+        - Load the user's data and compute the bounding box once.
+        - Fetch the networks (or read them from the cache) concurrently.
+        - Calculate each matrix as soon as its network is ready, so
+          fetching the remaining networks overlaps with computation.
+
+        Args:
+            network_types: iterable of network types, each one of
+                {'walk', 'bike', 'drive'}.
+            primary_input: string, csv, parquet or feather filename, or a DataFrame.
+            secondary_input: string, csv, parquet or feather filename, or a DataFrame
+                (omit to calculate NxN matrices on the primary_input).
+            primary_hints: dictionary, map column names to expected values.
+            secondary_hints: dictionary, map column names to expected values.
+            debug: boolean, enable to see more detailed logging output.
+            configs: defaults to None, else pass in an instance of Configs to override
+                default values (shared by all of the matrices).
+            max_workers: optional, maximum number of networks to fetch at
+                once (defaults to the number of network types).
+
+        Returns: dictionary of {network_type: processed TransitMatrix}.
+        Raises:
+            UnknownModeException: If a network type is unknown or is 'otp'.
+        """
+        network_types = list(dict.fromkeys(network_types))
+        for network_type in network_types:
+            if network_type not in {'drive', 'walk', 'bike'}:
+                raise UnknownModeException(network_type)
+        start_time = time.time()
+
+        transit_matrices = {network_type: cls(network_type,
+                                              primary_input=primary_input,
+                                              secondary_input=secondary_input,
+                                              primary_hints=primary_hints,
+                                              secondary_hints=secondary_hints,
+                                              debug=debug,
+                                              configs=configs)
+                            for network_type in network_types}
+
+        first_matrix = transit_matrices[network_types[0]]
+        first_matrix._load_inputs()
+        first_matrix._network_interface._get_bbox(first_matrix.primary_data,
+                                                  first_matrix.secondary_data,
+                                                  first_matrix.secondary_input is not None,
+                                                  first_matrix.configs.epsilon)
+        bbox = first_matrix._network_interface.bbox
+        for transit_matrix in transit_matrices.values():
+            if transit_matrix is not first_matrix:
+                transit_matrix._share_inputs(first_matrix)
+
+        if max_workers is None:
+            max_workers = len(network_types)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetches = {executor.submit(transit_matrix.prefetch_network, bbox): transit_matrix
+                       for transit_matrix in transit_matrices.values()}
+            for fetch in as_completed(fetches):
+                fetch.result()
+                fetches[fetch]._build_from_network()
+
+        time_delta = time.time() - start_time
+        first_matrix.logger.info('All {} network types completed in {:,.2f} seconds'.format(len(network_types),
+                                                                                          time_delta))
+        return transit_matrices
+
+    def process_row_range(self, start, end):
+        """
+        Compute only the rows [start, end) of the matrix (in the order of
+        the primary input), against all of the columns.
+
+        Args:
+            start: int, first row.
+            end: int, last row (exclusive).
+        Raises:
+            AssertionError: if this method is called on an OTP-matrix.
+        """
+        assert self.network_type != 'otp', 'no need to call process for an otp matrix'
+        start_time = time.time()
+
+        self.prefetch_network()
+
+        is_symmetric = self._is_symmetric()
+        if is_symmetric:
+            self.secondary_data = self.primary_data
+        self.primary_data = self.primary_data.iloc[start:end]
+
+        self.matrix_interface.prepare_matrix(is_symmetric=is_symmetric,
+                                             is_compressible=False,
+                                             rows=len(self.primary_data),
+                                             columns=len(self.secondary_data),
+                                             network_vertices=self._get_network_vertices(self.primary_data,
+                                                                                         self.secondary_data),
+                                             row_offset=start)
+
+        self._match_to_nearest_neighbor(is_primary=True, is_also_secondary=False)
+        self._match_to_nearest_neighbor(is_primary=False, is_also_secondary=False)
+
+        self._parse_network()
+        self.matrix_interface._raise_if_cancelled()
+
+        self.primary_input = None
+        self.secondary_input = None
+
+        self.matrix_interface.build_matrix()
         time_delta = time.time() - start_time
 
-        self.logger.info('All operations completed in {:,.2f} seconds'.format(time_delta))
+        self.logger.info('Rows {}-{} completed in {:,.2f} seconds'.format(start, end, time_delta))
+
+    @staticmethod
+    def _get_partition_bounds(rows, num_partitions):
+        """
+        Args:
+            rows: int, number of rows in the matrix.
+            num_partitions: int, number of row blocks.
+
+        Returns: list of (start, end) row ranges of nearly equal size.
+        """
+        num_partitions = max(1, min(num_partitions, rows))
+        base, remainder = divmod(rows, num_partitions)
+        bounds = []
+        start = 0
+        for partition in range(num_partitions):
+            end = start + base + (1 if partition < remainder else 0)
+            bounds.append((start, end))
+            start = end
+        return bounds
+
+    def process_partitioned(self, num_partitions, processes=None, shard_directory=None):
+        """
+        Compute the matrix in row blocks, each in a separate process,
+        and merge the blocks into this TransitMatrix.
+
+        - Load the user's data and fetch the osm network (so every
+          shard reads the same network from the cache).
+        - Compute each block of rows with process_row_range.
+        - Merge the tmx shards.
+
+        Args:
+            num_partitions: int, number of row blocks.
+            processes: int, number of worker processes (defaults to
+                num_partitions).
+            shard_directory: optional, directory in which to keep the tmx
+                shards. The directory can be read back with
+                read_from_file. If None, the shards are written to a
+                temporary directory which is removed after merging.
+        Raises:
+            AssertionError: if this method is called on an OTP-matrix.
+        """
+        assert self.network_type != 'otp', 'no need to call process for an otp matrix'
+        start_time = time.time()
+
+        self.prefetch_network()
+        bounds = self._get_partition_bounds(len(self.primary_data), num_partitions)
+        if processes is None:
+            processes = len(bounds)
+
+        # share the cpus between the worker processes
+        shard_configs = copy.copy(self.configs)
+        if shard_configs.thread_limit is None:
+            shard_configs.thread_limit = max(1, self.matrix_interface._get_available_cpus() // processes)
+
+        transit_matrix_kwargs = {'network_type': self.network_type,
+                                 'primary_input': self.primary_input,
+                                 'secondary_input': self.secondary_input,
+                                 'primary_hints': self.primary_hints,
+                                 'secondary_hints': self.secondary_hints,
+                                 'configs': shard_configs}
+
+        if shard_directory is None:
+            working_directory = tempfile.mkdtemp()
+        else:
+            working_directory = shard_directory
+            if not os.path.exists(working_directory):
+                os.makedirs(working_directory)
+        shard_filenames = [os.path.join(working_directory, 'shard_{:05d}.tmx'.format(partition))
+                           for partition in range(len(bounds))]
+        partition_args = [(transit_matrix_kwargs, start, end, filename)
+                          for (start, end), filename in zip(bounds, shard_filenames)]
+        try:
+            with multiprocessing.Pool(processes) as pool:
+                pool.map(_compute_partition, partition_args)
+            self.matrix_interface.read_tmx_shards(shard_filenames)
+        finally:
+            if shard_directory is None:
+                shutil.rmtree(working_directory)
+
+        self.primary_input = None
+        self.secondary_input = None
+        time_delta = time.time() - start_time
+
+        self.logger.info('All {} partitions completed in {:,.2f} seconds'.format(len(bounds), time_delta))
+
+    def process_async(self, executor=None):
+        """
+        Run process() in the background.
+
+        Args:
+            executor: optional, a thread based concurrent.futures.Executor.
+                If None, a single use thread pool is created.
+        Returns: concurrent.futures.Future which resolves when process()
+            completes, or raises its exceptions. Await it from a coroutine
+            with asyncio.wrap_future.
+        """
+        if executor is not None:
+            return executor.submit(self.process)
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(self.process)
+        executor.shutdown(wait=False)
+        return future
+
+    def get_progress(self):
+        """
+        Returns: tuple of (rows completed, total rows) of the
+            matrix computation.
+        """
+        return self.matrix_interface.get_build_progress()
+
+    def cancel(self):
+        """
+        Request cancellation of a running (or upcoming) process() call.
+        process() raises MatrixBuildCancelledException after the
+        network fetch, the snapping or once the computation has
+        stopped, whichever comes first.
+        """
+        self.matrix_interface.cancel_build()
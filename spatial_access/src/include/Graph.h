@@ -24,6 +24,29 @@ public:
         this->vertices = vertices;
     }
 
+/* Reserve room for num_edges edges (both ways when bidirectional) */
+    void reserveEdges(const network_loc* from_column, const network_loc* to_column,
+                      const unsigned char* is_bidirectional_column, unsigned long int num_edges)
+    {
+        std::vector<unsigned long int> degrees(vertices, 0);
+        for (unsigned long int i = 0; i < num_edges; i++)
+        {
+            if (from_column[i] >= vertices || to_column[i] >= vertices)
+            {
+                throw std::runtime_error("edge incompatible with declared graph structure");
+            }
+            degrees[from_column[i]]++;
+            if (is_bidirectional_column[i])
+            {
+                degrees[to_column[i]]++;
+            }
+        }
+        for (unsigned long int vertex = 0; vertex < vertices; vertex++)
+        {
+            neighbors[vertex].reserve(neighbors[vertex].size() + degrees[vertex]);
+        }
+    }
+
 /* Adds an edge to an undirected graph */
     void addEdge(network_loc src, network_loc dest, value_type weight)
     {
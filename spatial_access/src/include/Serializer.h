@@ -8,6 +8,7 @@
 #include <fstream>
 #include <vector>
 #include <istream>
+#include <stdexcept>
 
 class Serializer {
 public:
@@ -51,6 +52,17 @@ public:
         }
         checkStreamIsGood();
     }
+    template <class T> void write2DArray(const T* value, unsigned long int num_vectors,
+                                         unsigned long int vector_size)
+    {
+        writeNumericType<unsigned long int>(num_vectors);
+        for (unsigned long int i = 0; i < num_vectors; i++)
+        {
+            writeNumericType<unsigned long int>(vector_size);
+            output.write((const char *) (value + i * vector_size), vector_size * sizeof(T));
+        }
+        checkStreamIsGood();
+    }
     void writeBool(bool value);
 private:
     std::ofstream output;
@@ -107,6 +119,26 @@ public:
         checkStreamIsGood();
     }
 
+    // read num_vectors vectors of vector_size values, written by
+    // write2DVector or write2DArray, into contiguous memory
+    template <class T> void read2DArray(T* value, unsigned long int num_vectors,
+                                        unsigned long int vector_size)
+    {
+        if (readNumericType<unsigned long>() != num_vectors)
+        {
+            throw std::runtime_error("unexpected number of vectors");
+        }
+        for (unsigned long int i = 0; i < num_vectors; i++)
+        {
+            if (readNumericType<unsigned long>() != vector_size)
+            {
+                throw std::runtime_error("unexpected vector size");
+            }
+            input.read(reinterpret_cast<char *>(value + i * vector_size), vector_size * sizeof(T));
+        }
+        checkStreamIsGood();
+    }
+
     bool readBool();
 private:
     std::ifstream input;
@@ -17,6 +17,7 @@
 #include "tmxParser.h"
 #include "csvParser.h"
 #include "otpCSV.h"
+#include "mappedValues.h"
 
 #define TMX_VERSION (2)
 
@@ -26,6 +27,9 @@ class dataFrame {
 public:
     static constexpr value_type UNDEFINED = std::numeric_limits<value_type>::max();
     std::vector<std::vector<value_type>> dataset;
+    // if not empty, the values are kept here (row-major, or the compressed
+    // triangle) instead of in dataset
+    mappedValues<value_type> mappedDataset;
     bool isCompressible;
     bool isSymmetric;
     unsigned long int rows;
@@ -63,6 +67,25 @@ private:
         }
     }
 
+    // Replace the values with UNDEFINED, kept in a memory mapped
+    // file in spillDirectory if it is given.
+    void allocateValues(const std::string& spillDirectory)
+    {
+        dataset.clear();
+        mappedDataset = mappedValues<value_type>();
+        if (!spillDirectory.empty())
+        {
+            mappedDataset = mappedValues<value_type>(spillDirectory, dataset_size, UNDEFINED);
+            return;
+        }
+        if (isCompressible)
+        {
+            dataset.emplace_back(dataset_size, UNDEFINED);
+            return;
+        }
+        dataset.assign(rows, std::vector<value_type>(cols, UNDEFINED));
+    }
+
 public:
     void readOTPCSV(const std::string& filename)
     {
@@ -97,29 +120,21 @@ public:
 
     // Methods
     dataFrame() = default;
-    dataFrame(bool isCompressible, bool isSymmetric, unsigned long int rows, unsigned long int cols)
+    // allocate=false indexes the labels but leaves the values
+    // unallocated (for matrices streamed to file). If spillDirectory
+    // is given, the values are kept in a memory mapped file there.
+    dataFrame(bool isCompressible, bool isSymmetric, unsigned long int rows, unsigned long int cols,
+              bool allocate=true, const std::string& spillDirectory="")
     {
         this->isCompressible = isCompressible;
         this->isSymmetric = isSymmetric;
         this->rows = rows;
-        if (isCompressible)
-        {
-            this->cols = rows;
-            initializeDatatsetSize();
-            std::vector<value_type> data(dataset_size, UNDEFINED);
-            dataset.push_back(data);
-        }
-        else
+        this->cols = isCompressible ? rows : cols;
+        initializeDatatsetSize();
+        if (allocate)
         {
-            this->cols = cols;
-            initializeDatatsetSize();
-            for (unsigned int row_loc = 0; row_loc < rows; row_loc++)
-            {
-                std::vector<value_type> data(cols, UNDEFINED);
-                dataset.push_back(data);
-            }
+            allocateValues(spillDirectory);
         }
-
     }
 
     void setMockDataFrame(const std::vector<std::vector<value_type>>& dataset,
@@ -142,11 +157,40 @@ public:
         return dataset_size - row_delta * (row_delta + 1) / 2 + col_loc - row_loc;
     }
 
+    bool
+    isMapped() const
+    {
+        return !mappedDataset.empty();
+    }
+
+    // index of (row_loc, col_loc) in the mapped values
+    unsigned long int
+    mappedLoc(unsigned long int row_loc, unsigned long int col_loc) const
+    {
+        if (row_loc >= rows || col_loc >= cols)
+        {
+            throw std::out_of_range("loc exceeds index of dataframe");
+        }
+        if (!isCompressible)
+        {
+            return row_loc * cols + col_loc;
+        }
+        if (isUnderDiagonal(row_loc, col_loc))
+        {
+            return compressedEquivalentLoc(col_loc, row_loc);
+        }
+        return compressedEquivalentLoc(row_loc, col_loc);
+    }
+
 // Getters/Setters
 
     value_type
     getValueByLoc(unsigned long int row_loc, unsigned long int col_loc) const
     {
+        if (isMapped())
+        {
+            return mappedDataset.at(mappedLoc(row_loc, col_loc));
+        }
         if (isCompressible)
         {
             unsigned long int index;
@@ -163,6 +207,73 @@ public:
     }
 
 
+    // Copy the values into buffer as a dense rows x cols array (row-major).
+    void
+    copyValuesTo(value_type* buffer) const
+    {
+        copyRowsTo(buffer, 0, rows);
+    }
+
+
+    // Copy rows [first_row_loc, first_row_loc + num_rows) into buffer
+    // as a dense num_rows x cols array (row-major).
+    void
+    copyRowsTo(value_type* buffer, unsigned long int first_row_loc, unsigned long int num_rows) const
+    {
+        if (first_row_loc + num_rows > rows)
+        {
+            throw std::out_of_range("rows exceed index of dataframe");
+        }
+        if (!isCompressible)
+        {
+            if (isMapped())
+            {
+                std::copy(mappedDataset.data() + first_row_loc * cols,
+                          mappedDataset.data() + (first_row_loc + num_rows) * cols, buffer);
+                return;
+            }
+            for (unsigned long int row_loc = first_row_loc; row_loc < first_row_loc + num_rows; row_loc++)
+            {
+                std::copy(dataset.at(row_loc).begin(), dataset.at(row_loc).end(),
+                          buffer + (row_loc - first_row_loc) * cols);
+            }
+            return;
+        }
+        for (unsigned long int row_loc = first_row_loc; row_loc < first_row_loc + num_rows; row_loc++)
+        {
+            for (unsigned long int col_loc = 0; col_loc < cols; col_loc++)
+            {
+                buffer[(row_loc - first_row_loc) * cols + col_loc] = getValueByLoc(row_loc, col_loc);
+            }
+        }
+    }
+
+
+    // Multiply every defined value by scale (truncating). Values that
+    // no longer fit in value_type become UNDEFINED.
+    void
+    scaleValues(double scale)
+    {
+        auto scaleValue = [scale](value_type& value) {
+            if (value == UNDEFINED)
+            {
+                return;
+            }
+            double scaled = value * scale;
+            value = scaled >= UNDEFINED ? UNDEFINED : (value_type) scaled;
+        };
+        if (isMapped())
+        {
+            std::for_each(mappedDataset.data(), mappedDataset.data() + dataset_size, scaleValue);
+            return;
+        }
+        for (auto& row : dataset)
+        {
+            std::for_each(row.begin(), row.end(), scaleValue);
+        }
+    }
+
+
     value_type
     getValueById(const row_label_type& row_id, const col_label_type& col_id) const
     {
@@ -263,6 +374,11 @@ public:
     void
     setValueByLoc(unsigned long int row_loc, unsigned long int col_loc, value_type value)
     {
+        if (isMapped())
+        {
+            mappedDataset.at(mappedLoc(row_loc, col_loc)) = value;
+            return;
+        }
         if (isCompressible)
         {
             unsigned long int index;
@@ -287,6 +403,16 @@ public:
         {
             throw std::runtime_error("row loc exceeds index of dataframe");
         }
+        if (isMapped())
+        {
+            unsigned long int left_index = mappedLoc(source_loc, isCompressible ? source_loc : 0);
+            if (left_index + row_data.size() > dataset_size)
+            {
+                throw std::runtime_error("row exceeds index of dataframe");
+            }
+            std::copy(row_data.begin(), row_data.end(), mappedDataset.data() + left_index);
+            return;
+        }
         if (!isCompressible)
         {
 
@@ -301,6 +427,62 @@ public:
         }
     }
 
+    // Replace the contents with a dense row_ids x col_ids
+    // (row-major) array of values.
+    void
+    setValues(const value_type* buffer, const std::vector<row_label_type>& row_ids,
+              const std::vector<col_label_type>& col_ids, const std::string& spillDirectory="")
+    {
+        setIds(row_ids, col_ids, spillDirectory);
+        setRows(buffer, 0, rows);
+    }
+
+
+    // Replace the contents with row_ids x col_ids UNDEFINED values (to
+    // fill with setRows), kept in a memory mapped file in spillDirectory
+    // if it is given.
+    void
+    setIds(const std::vector<row_label_type>& row_ids, const std::vector<col_label_type>& col_ids,
+           const std::string& spillDirectory="")
+    {
+        isCompressible = false;
+        isSymmetric = false;
+        rows = row_ids.size();
+        cols = col_ids.size();
+        rowIdsToLoc.clear();
+        colIdsToLoc.clear();
+        setRowIds(row_ids);
+        setColIds(col_ids);
+        initializeDatatsetSize();
+        allocateValues(spillDirectory);
+    }
+
+
+    // Set rows [first_row_loc, first_row_loc + num_rows) from a dense
+    // num_rows x cols (row-major) array of values.
+    void
+    setRows(const value_type* buffer, unsigned long int first_row_loc, unsigned long int num_rows)
+    {
+        if (isCompressible)
+        {
+            throw std::runtime_error("cannot set rows of a compressed dataFrame");
+        }
+        if (first_row_loc + num_rows > rows)
+        {
+            throw std::out_of_range("rows exceed index of dataframe");
+        }
+        if (isMapped())
+        {
+            std::copy(buffer, buffer + num_rows * cols, mappedDataset.data() + first_row_loc * cols);
+            return;
+        }
+        for (unsigned long int row_loc = first_row_loc; row_loc < first_row_loc + num_rows; row_loc++)
+        {
+            const value_type* row = buffer + (row_loc - first_row_loc) * cols;
+            std::copy(row, row + cols, dataset.at(row_loc).begin());
+        }
+    }
+
     void
     setRowIds(const std::vector<row_label_type>& row_ids)
     {
@@ -338,6 +520,63 @@ public:
 
 
 
+    // Add row_ids to the row index in one pass. Returns the loc of the first.
+    unsigned long int
+    addToRowIndex(const std::vector<row_label_type>& row_ids)
+    {
+        unsigned long int first_index = rowIds.size();
+        rowIds.reserve(first_index + row_ids.size());
+        rowIdsToLoc.reserve(first_index + row_ids.size());
+        for (const auto& row_id : row_ids)
+        {
+            rowIdsToLoc.emplace(row_id, rowIds.size());
+            rowIds.push_back(row_id);
+        }
+        return first_index;
+    }
+
+
+    // Add col_ids to the col index in one pass. Returns the loc of the first.
+    unsigned long int
+    addToColIndex(const std::vector<col_label_type>& col_ids)
+    {
+        unsigned long int first_index = colIds.size();
+        colIds.reserve(first_index + col_ids.size());
+        colIdsToLoc.reserve(first_index + col_ids.size());
+        for (const auto& col_id : col_ids)
+        {
+            colIdsToLoc.emplace(col_id, colIds.size());
+            colIds.push_back(col_id);
+        }
+        return first_index;
+    }
+
+
+    void
+    appendRows(const dataFrame<row_label_type, col_label_type, value_type>& other)
+    {
+        if (isCompressible || other.isCompressible)
+        {
+            throw std::runtime_error("cannot append rows to a compressed dataFrame");
+        }
+        if (isMapped() || other.isMapped())
+        {
+            throw std::runtime_error("cannot append rows to a memory mapped dataFrame");
+        }
+        if (colIds != other.colIds)
+        {
+            throw std::runtime_error("cannot append rows with mismatched columns");
+        }
+        for (unsigned long int row_loc = 0; row_loc < other.rows; row_loc++)
+        {
+            addToRowIndex(other.rowIds.at(row_loc));
+            dataset.push_back(other.dataset.at(row_loc));
+        }
+        rows += other.rows;
+        initializeDatatsetSize();
+    }
+
+
 // Input/Output:
 
     bool
@@ -359,7 +598,9 @@ public:
         writeToStream(std::cout);
     }
 
-    void readCSV(const std::string& infile)
+    // If spillDirectory is given, the values are kept in a memory
+    // mapped file there.
+    void readCSV(const std::string& infile, const std::string& spillDirectory="")
     {
         isCompressible = false;
         isSymmetric = false;
@@ -376,26 +617,54 @@ public:
 
         colReader.readLine(colIds);
         indexCols();
+        cols = this->colIds.size();
 
         std::string line;
         std::string row_label;
         std::string value;
 
+        if (!spillDirectory.empty())
+        {
+            // count the rows first, to map the values before reading them
+            auto body = fileIN.tellg();
+            rows = 0;
+            while (getline(fileIN, line))
+            {
+                rows++;
+            }
+            fileIN.clear();
+            fileIN.seekg(body);
+            initializeDatatsetSize();
+            allocateValues(spillDirectory);
+        }
+
+        std::vector<value_type> row_data;
         while (getline(fileIN, line))
         {
-            this->dataset.emplace_back(std::vector<value_type>());
+            row_data.clear();
             std::istringstream stream(line);
 
             getline(stream, row_label,',');
             rowIds.push_back(rowReader.parse(row_label));
             while(getline(stream, value, ','))
             {
-                this->dataset.at(this->dataset.size() - 1).push_back(valueReader.parse(value));
+                row_data.push_back(valueReader.parse(value));
+            }
+            if (!isMapped())
+            {
+                this->dataset.push_back(row_data);
+            }
+            else if (row_data.size() == cols)
+            {
+                setRowByRowLoc(row_data, rowIds.size() - 1);
+            }
+            else
+            {
+                throw std::runtime_error("row has the wrong number of values");
             }
         }
         fileIN.close();
         rows = this->rowIds.size();
-        cols = this->colIds.size();
         indexRows();
         initializeDatatsetSize();
     }
@@ -421,10 +690,23 @@ public:
 
         rowWriter.writeIds(rowIds);
         colWriter.writeIds(colIds);
-        dataWriter.writeData(dataset);
+        if (!isMapped())
+        {
+            dataWriter.writeData(dataset);
+        }
+        else if (isCompressible)
+        {
+            dataWriter.writeData(mappedDataset.data(), 1, dataset_size);
+        }
+        else
+        {
+            dataWriter.writeData(mappedDataset.data(), rows, cols);
+        }
     }
 
-    void readTMX(const std::string& filename)
+    // If spillDirectory is given, the values are kept in a memory
+    // mapped file there.
+    void readTMX(const std::string& filename, const std::string& spillDirectory="")
     {
         Deserializer deserializer(filename);
 
@@ -432,6 +714,96 @@ public:
         tmxReader<col_label_type> colReader(deserializer);
         tmxReader<value_type> dataReader(deserializer);
 
+        readTMXHeader(rowReader, colReader, dataReader);
+        if (spillDirectory.empty())
+        {
+            dataReader.readData(dataset);
+        }
+        else
+        {
+            allocateValues(spillDirectory);
+            if (isCompressible)
+            {
+                dataReader.readData(mappedDataset.data(), 1, dataset_size);
+            }
+            else
+            {
+                dataReader.readData(mappedDataset.data(), rows, cols);
+            }
+        }
+
+        indexRows();
+        indexCols();
+
+    }
+
+
+    // Read row blocks written by writeTMX into one matrix, in the given
+    // order. If spillDirectory is given, the values are kept in a memory
+    // mapped file there, and the blocks are read into it one at a time.
+    void readTMXShards(const std::vector<std::string>& filenames, const std::string& spillDirectory="")
+    {
+        if (spillDirectory.empty())
+        {
+            readTMX(filenames.at(0));
+            for (unsigned long int i = 1; i < filenames.size(); i++)
+            {
+                dataFrame<row_label_type, col_label_type, value_type> shard;
+                shard.readTMX(filenames.at(i));
+                appendRows(shard);
+            }
+            return;
+        }
+
+        // read the ids of every block to map all the rows up front
+        std::vector<row_label_type> row_ids;
+        std::vector<col_label_type> col_ids;
+        bool is_symmetric = false;
+        for (unsigned long int i = 0; i < filenames.size(); i++)
+        {
+            Deserializer deserializer(filenames.at(i));
+            tmxReader<row_label_type> rowReader(deserializer);
+            tmxReader<col_label_type> colReader(deserializer);
+            tmxReader<value_type> dataReader(deserializer);
+            dataFrame<row_label_type, col_label_type, value_type> header;
+            header.readTMXHeader(rowReader, colReader, dataReader);
+            if (header.isCompressible)
+            {
+                throw std::runtime_error("cannot append rows to a compressed dataFrame");
+            }
+            if (i == 0)
+            {
+                col_ids = header.colIds;
+                is_symmetric = header.isSymmetric;
+            }
+            else if (header.colIds != col_ids)
+            {
+                throw std::runtime_error("cannot append rows with mismatched columns");
+            }
+            row_ids.insert(row_ids.end(), header.rowIds.begin(), header.rowIds.end());
+        }
+        setIds(row_ids, col_ids, spillDirectory);
+        isSymmetric = is_symmetric;
+
+        unsigned long int first_row_loc = 0;
+        for (const auto& filename : filenames)
+        {
+            dataFrame<row_label_type, col_label_type, value_type> shard;
+            shard.readTMX(filename);
+            for (unsigned long int row_loc = 0; row_loc < shard.rows; row_loc++)
+            {
+                setRowByRowLoc(shard.dataset.at(row_loc), first_row_loc + row_loc);
+            }
+            first_row_loc += shard.rows;
+        }
+    }
+
+private:
+
+    // Read the tmx header and ids, leaving the reader at the values.
+    void readTMXHeader(tmxReader<row_label_type>& rowReader, tmxReader<col_label_type>& colReader,
+                       tmxReader<value_type>& dataReader)
+    {
         auto tmx_version = rowReader.readTMXVersion();
         if (tmx_version != TMX_VERSION)
         {
@@ -457,15 +829,9 @@ public:
 
         rowReader.readIds(rowIds);
         colReader.readIds(colIds);
-        dataReader.readData(dataset);
-
-        indexRows();
-        indexCols();
         initializeDatatsetSize();
-
     }
 
-private:
 
     bool
     writeToStream(std::ostream& streamToWrite) const
@@ -0,0 +1,150 @@
+// Logan Noel (github.com/lmnoel)
+//
+// ©2017-2019, Center for Spatial Data Science
+
+#pragma once
+
+#include <string>
+#include <vector>
+#include <algorithm>
+#include <utility>
+#include <stdexcept>
+
+#ifndef _WIN32
+#include <unistd.h>
+#include <sys/mman.h>
+#endif
+
+/* mappedValues: a fixed size array of values kept in a memory mapped
+ * temporary file. The OS keeps the recently used pages of the file in
+ * memory and writes the others back to disk, so the array can be larger
+ * than the available memory. The file is unlinked as soon as it is
+ * mapped, so nothing is left behind if the process dies. */
+template<class value_type>
+class mappedValues {
+private:
+    std::string directory;
+    unsigned long int length = 0;
+    value_type* values = nullptr;
+
+    void allocate()
+    {
+        if (length == 0)
+        {
+            return;
+        }
+#ifdef _WIN32
+        throw std::runtime_error("memory mapped matrices are not supported on this platform");
+#else
+        std::string pattern = directory + "/spatial_access_XXXXXX";
+        std::vector<char> filename(pattern.begin(), pattern.end());
+        filename.push_back('\0');
+        int fd = mkstemp(filename.data());
+        if (fd == -1)
+        {
+            throw std::runtime_error("unable to create file in " + directory);
+        }
+        unlink(filename.data());
+        size_t bytes = length * sizeof(value_type);
+        if (ftruncate(fd, bytes) != 0)
+        {
+            close(fd);
+            throw std::runtime_error("unable to allocate file in " + directory);
+        }
+        void* mapping = mmap(nullptr, bytes, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        close(fd);
+        if (mapping == MAP_FAILED)
+        {
+            throw std::runtime_error("unable to map file in " + directory);
+        }
+        values = static_cast<value_type*>(mapping);
+#endif
+    }
+
+    void release()
+    {
+#ifndef _WIN32
+        if (values)
+        {
+            munmap(values, length * sizeof(value_type));
+        }
+#endif
+        values = nullptr;
+        length = 0;
+    }
+
+public:
+    mappedValues() = default;
+
+    mappedValues(const std::string& directory, unsigned long int length, value_type fill)
+    : directory(directory), length(length)
+    {
+        allocate();
+        std::fill(values, values + length, fill);
+    }
+
+    mappedValues(const mappedValues& other)
+    : directory(other.directory), length(other.length)
+    {
+        allocate();
+        std::copy(other.values, other.values + length, values);
+    }
+
+    mappedValues(mappedValues&& other) noexcept
+    : directory(std::move(other.directory)), length(other.length), values(other.values)
+    {
+        other.values = nullptr;
+        other.length = 0;
+    }
+
+    mappedValues& operator=(mappedValues other)
+    {
+        std::swap(directory, other.directory);
+        std::swap(length, other.length);
+        std::swap(values, other.values);
+        return *this;
+    }
+
+    ~mappedValues()
+    {
+        release();
+    }
+
+    bool empty() const
+    {
+        return length == 0;
+    }
+
+    unsigned long int size() const
+    {
+        return length;
+    }
+
+    value_type* data()
+    {
+        return values;
+    }
+
+    const value_type* data() const
+    {
+        return values;
+    }
+
+    value_type& at(unsigned long int index)
+    {
+        if (index >= length)
+        {
+            throw std::out_of_range("index exceeds mapped values");
+        }
+        return values[index];
+    }
+
+    const value_type& at(unsigned long int index) const
+    {
+        if (index >= length)
+        {
+            throw std::out_of_range("index exceeds mapped values");
+        }
+        return values[index];
+    }
+};
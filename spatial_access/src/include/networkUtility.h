@@ -10,6 +10,8 @@
 #include <unordered_set>
 #include <unordered_map>
 #include <algorithm>
+#include <limits>
+#include <stdexcept>
 
 typedef unsigned long int unsigned_long;
 template<class node_id>
@@ -136,3 +138,218 @@ private:
         return return_stack;
     }
     };
+
+// Mark the nodes of the largest strongly connected component of a
+// graph over dense node indices 0..num_nodes-1 (iterative Tarjan over
+// a CSR adjacency array, linear in the size of the graph).
+inline void
+largestConnectedComponentMask(const unsigned_long* from_indices,
+                              const unsigned_long* to_indices,
+                              unsigned_long num_edges,
+                              unsigned_long num_nodes,
+                              unsigned char* keep_mask)
+{
+    if (num_nodes == 0) {
+        throw std::runtime_error("Found no connected components");
+    }
+
+    // CSR adjacency: the targets of node v are targets[offsets[v]:offsets[v + 1]]
+    std::vector<unsigned_long> offsets(num_nodes + 1, 0);
+    for (unsigned_long i = 0; i < num_edges; i++) {
+        if (from_indices[i] >= num_nodes || to_indices[i] >= num_nodes) {
+            throw std::out_of_range("Edge endpoint is not a node");
+        }
+        offsets[from_indices[i] + 1]++;
+    }
+    for (unsigned_long v = 0; v < num_nodes; v++) {
+        offsets[v + 1] += offsets[v];
+    }
+    std::vector<unsigned_long> targets(num_edges);
+    std::vector<unsigned_long> next_target(offsets.begin(), offsets.end() - 1);
+    for (unsigned_long i = 0; i < num_edges; i++) {
+        targets[next_target[from_indices[i]]++] = to_indices[i];
+    }
+
+    // a node is on the component stack while it is visited
+    // but not yet assigned to a component
+    const unsigned_long UNDEFINED = std::numeric_limits<unsigned_long>::max();
+    std::vector<unsigned_long> index(num_nodes, UNDEFINED);
+    std::vector<unsigned_long> lowlink(num_nodes);
+    std::vector<unsigned_long> component(num_nodes, UNDEFINED);
+    std::vector<unsigned_long> component_stack;
+    // (node, position of its next edge in targets)
+    std::vector<std::pair<unsigned_long, unsigned_long>> call_stack;
+    unsigned_long next_index = 0;
+    unsigned_long num_components = 0;
+    unsigned_long largest_component = 0;
+    unsigned_long largest_component_size = 0;
+
+    for (unsigned_long root = 0; root < num_nodes; root++) {
+        if (index[root] != UNDEFINED) {
+            continue;
+        }
+        index[root] = lowlink[root] = next_index++;
+        component_stack.push_back(root);
+        call_stack.emplace_back(root, offsets[root]);
+        while (!call_stack.empty()) {
+            unsigned_long v = call_stack.back().first;
+            unsigned_long position = call_stack.back().second;
+            if (position < offsets[v + 1]) {
+                call_stack.back().second++;
+                unsigned_long w = targets[position];
+                if (index[w] == UNDEFINED) {
+                    index[w] = lowlink[w] = next_index++;
+                    component_stack.push_back(w);
+                    call_stack.emplace_back(w, offsets[w]);
+                } else if (component[w] == UNDEFINED) {
+                    lowlink[v] = std::min(lowlink[v], index[w]);
+                }
+                continue;
+            }
+            call_stack.pop_back();
+            if (!call_stack.empty()) {
+                unsigned_long u = call_stack.back().first;
+                lowlink[u] = std::min(lowlink[u], lowlink[v]);
+            }
+            if (lowlink[v] == index[v]) {
+                unsigned_long component_size = 0;
+                unsigned_long w;
+                do {
+                    w = component_stack.back();
+                    component_stack.pop_back();
+                    component[w] = num_components;
+                    component_size++;
+                } while (w != v);
+                if (component_size > largest_component_size) {
+                    largest_component_size = component_size;
+                    largest_component = num_components;
+                }
+                num_components++;
+            }
+        }
+    }
+
+    for (unsigned_long v = 0; v < num_nodes; v++) {
+        keep_mask[v] = component[v] == largest_component;
+    }
+}
+
+// Merge chains of degree-2 vertices into single edges, so they are
+// not Dijkstra vertices. A vertex is contracted if it is not kept and
+// its only two edges (to two distinct neighbors) are both bidirectional,
+// or are one way in and one way out. Merged edges get the sum of the
+// weights (so shortest paths between the remaining vertices are
+// unchanged); chains are split where the sum would exceed max_weight.
+// Writes the contracted edges to the contracted_* arrays (which need
+// room for num_edges edges) and returns how many there are.
+inline unsigned_long
+contractDegreeTwoChains(const unsigned_long* from_column,
+                        const unsigned_long* to_column,
+                        const unsigned_long* weight_column,
+                        const unsigned char* is_bidirectional_column,
+                        unsigned_long num_edges,
+                        unsigned_long num_nodes,
+                        const unsigned char* keep_mask,
+                        unsigned_long max_weight,
+                        unsigned_long* contracted_from,
+                        unsigned_long* contracted_to,
+                        unsigned_long* contracted_weights,
+                        unsigned char* contracted_is_bidirectional)
+{
+    // incident edges of each vertex: incident[offsets[v]:offsets[v + 1]]
+    std::vector<unsigned_long> offsets(num_nodes + 1, 0);
+    for (unsigned_long i = 0; i < num_edges; i++) {
+        if (from_column[i] >= num_nodes || to_column[i] >= num_nodes) {
+            throw std::out_of_range("Edge endpoint is not a node");
+        }
+        offsets[from_column[i] + 1]++;
+        if (to_column[i] != from_column[i]) {
+            offsets[to_column[i] + 1]++;
+        }
+    }
+    for (unsigned_long v = 0; v < num_nodes; v++) {
+        offsets[v + 1] += offsets[v];
+    }
+    std::vector<unsigned_long> incident(offsets[num_nodes]);
+    std::vector<unsigned_long> next_incident(offsets.begin(), offsets.end() - 1);
+    for (unsigned_long i = 0; i < num_edges; i++) {
+        incident[next_incident[from_column[i]]++] = i;
+        if (to_column[i] != from_column[i]) {
+            incident[next_incident[to_column[i]]++] = i;
+        }
+    }
+    auto other_end = [&](unsigned_long edge, unsigned_long v) {
+        return from_column[edge] == v ? to_column[edge] : from_column[edge];
+    };
+
+    std::vector<unsigned char> is_contractible(num_nodes, 0);
+    for (unsigned_long v = 0; v < num_nodes; v++) {
+        if (keep_mask[v] || offsets[v + 1] - offsets[v] != 2) {
+            continue;
+        }
+        unsigned_long first_edge = incident[offsets[v]];
+        unsigned_long second_edge = incident[offsets[v] + 1];
+        unsigned_long u = other_end(first_edge, v);
+        unsigned_long w = other_end(second_edge, v);
+        if (u == v || w == v || u == w) {
+            continue;
+        }
+        if (is_bidirectional_column[first_edge] && is_bidirectional_column[second_edge]) {
+            is_contractible[v] = 1;
+        } else if (!is_bidirectional_column[first_edge] && !is_bidirectional_column[second_edge]
+                   && (to_column[first_edge] == v) != (to_column[second_edge] == v)) {
+            is_contractible[v] = 1;
+        }
+    }
+
+    unsigned_long num_contracted = 0;
+    auto add_edge = [&](unsigned_long from, unsigned_long to, unsigned_long weight, unsigned char is_bidirectional) {
+        contracted_from[num_contracted] = from;
+        contracted_to[num_contracted] = to;
+        contracted_weights[num_contracted] = weight;
+        contracted_is_bidirectional[num_contracted] = is_bidirectional;
+        num_contracted++;
+    };
+
+    // walk each chain from a vertex that is not contracted
+    std::vector<unsigned char> is_used(num_edges, 0);
+    for (unsigned_long start = 0; start < num_nodes; start++) {
+        if (is_contractible[start]) {
+            continue;
+        }
+        for (unsigned_long position = offsets[start]; position < offsets[start + 1]; position++) {
+            unsigned_long edge = incident[position];
+            if (is_used[edge] || (!is_bidirectional_column[edge] && from_column[edge] != start)) {
+                continue;
+            }
+            unsigned char is_bidirectional = is_bidirectional_column[edge];
+            unsigned_long chain_start = start;
+            unsigned_long current = start;
+            unsigned_long weight = 0;
+            while (true) {
+                is_used[edge] = 1;
+                if (weight > 0 && weight + weight_column[edge] > max_weight) {
+                    add_edge(chain_start, current, weight, is_bidirectional);
+                    chain_start = current;
+                    weight = 0;
+                }
+                weight += weight_column[edge];
+                current = other_end(edge, current);
+                if (!is_contractible[current]) {
+                    break;
+                }
+                unsigned_long first_edge = incident[offsets[current]];
+                edge = first_edge == edge ? incident[offsets[current] + 1] : first_edge;
+            }
+            add_edge(chain_start, current, weight, is_bidirectional);
+        }
+    }
+
+    // cycles of contractible vertices only are kept as they are
+    for (unsigned_long i = 0; i < num_edges; i++) {
+        if (!is_used[i]) {
+            add_edge(from_column[i], to_column[i], weight_column[i], is_bidirectional_column[i]);
+        }
+    }
+    return num_contracted;
+}
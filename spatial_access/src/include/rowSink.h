@@ -0,0 +1,130 @@
+// Logan Noel (github.com/lmnoel)
+//
+// ©2017-2019, Center for Spatial Data Science
+
+#pragma once
+
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <vector>
+#include <queue>
+#include <string>
+#include <fstream>
+#include <utility>
+#include <algorithm>
+#include <stdexcept>
+
+/* rowSink: a writer thread which appends finished rows to a long
+ * format (source,dest,value) csv, so that the worker threads never
+ * need to hold the whole matrix in memory. */
+template<class row_label_type, class col_label_type, class value_type>
+class rowSink {
+private:
+    typedef std::pair<unsigned long int, std::vector<value_type>> row_block;
+
+    std::ofstream output;
+    const std::vector<row_label_type>& rowIds;
+    const std::vector<col_label_type>& colIds;
+    value_type cutoff;
+    value_type undefined;
+    unsigned long int maxQueuedRows;
+    std::queue<row_block> rows;
+    std::mutex lock;
+    std::condition_variable rowAvailable;
+    std::condition_variable spaceAvailable;
+    bool isClosed = false;
+    bool writeFailed = false;
+    std::thread writer;
+
+    void writeRows()
+    {
+        std::unique_lock<std::mutex> guard(lock);
+        while (true)
+        {
+            rowAvailable.wait(guard, [this]{ return !rows.empty() || isClosed; });
+            if (rows.empty())
+            {
+                break;
+            }
+            row_block block = std::move(rows.front());
+            rows.pop();
+            spaceAvailable.notify_one();
+            // write without holding the lock so workers can keep queueing
+            guard.unlock();
+            writeRow(block.first, block.second);
+            guard.lock();
+        }
+        output.flush();
+        writeFailed = output.fail();
+    }
+
+    void writeRow(unsigned long int row_loc, const std::vector<value_type>& row_data)
+    {
+        const row_label_type& row_label = rowIds.at(row_loc);
+        for (unsigned long int col_loc = 0; col_loc < row_data.size(); col_loc++)
+        {
+            value_type value = row_data.at(col_loc);
+            if (value == undefined || value > cutoff)
+            {
+                continue;
+            }
+            output << row_label << "," << colIds.at(col_loc) << "," << value << "\n";
+        }
+    }
+
+public:
+    rowSink(const std::string& filename,
+            const std::vector<row_label_type>& rowIds,
+            const std::vector<col_label_type>& colIds,
+            value_type cutoff, value_type undefined,
+            unsigned long int maxQueuedRows)
+    : rowIds(rowIds), colIds(colIds), cutoff(cutoff), undefined(undefined),
+      maxQueuedRows(std::max(maxQueuedRows, 1UL))
+    {
+        output.open(filename);
+        if (output.fail())
+        {
+            throw std::runtime_error("unable to write file");
+        }
+        writer = std::thread(&rowSink::writeRows, this);
+    }
+
+    ~rowSink()
+    {
+        close();
+    }
+
+    // queue a finished row, blocking while the writer is
+    // maxQueuedRows behind the workers
+    void push(unsigned long int row_loc, std::vector<value_type>&& row_data)
+    {
+        std::unique_lock<std::mutex> guard(lock);
+        spaceAvailable.wait(guard, [this]{ return rows.size() < maxQueuedRows; });
+        rows.emplace(row_loc, std::move(row_data));
+        rowAvailable.notify_one();
+    }
+
+    // write the remaining rows and wait for the writer to finish
+    void close()
+    {
+        {
+            std::lock_guard<std::mutex> guard(lock);
+            isClosed = true;
+        }
+        rowAvailable.notify_one();
+        if (writer.joinable())
+        {
+            writer.join();
+        }
+        if (output.is_open())
+        {
+            output.close();
+        }
+    }
+
+    bool failed() const
+    {
+        return writeFailed;
+    }
+};
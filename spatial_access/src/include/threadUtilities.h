@@ -10,10 +10,12 @@
 #include <queue>
 #include <iostream>
 #include <algorithm>
+#include <atomic>
 
 #include "Graph.h"
 #include "userDataContainer.h"
 #include "dataFrame.h"
+#include "rowSink.h"
 
 /* jobQueue: a thread-safe queue for dispensing integer jobs*/
 class jobQueue {
@@ -29,6 +31,12 @@ public:
 
 void do_join(std::thread &t);
 
+/* the CPUs this process may run on (empty if unknown on this platform) */
+std::vector<int> getAllowedCpus();
+
+/* pin the calling thread to a single CPU; no-op where unsupported */
+void pinCurrentThreadToCpu(int cpu);
+
 template<class row_label_type, class col_label_type, class value_type> class graphWorkerArgs;
 
 /* A pool of worker threads to execute a job (f_in), which takes arguments (worker_args)*/
@@ -64,12 +72,28 @@ public:
     jobQueue jq;
     userDataContainer<value_type> userSourceData;
     userDataContainer<value_type> userDestData;
+    std::atomic<bool> &cancelRequested;
+    std::atomic<unsigned long int> &rowsCompleted;
+    bool pinThreads = false;
+    unsigned long int rowOffset = 0;
+    std::vector<int> allowedCpus;
+    std::atomic<unsigned int> nextWorkerSlot{0};
+    // if set, finished rows are written here instead of to df
+    rowSink<row_label_type, col_label_type, value_type> *sink = nullptr;
     graphWorkerArgs(Graph<value_type> &graph, userDataContainer<value_type> &userSourceData,
                        userDataContainer<value_type> &userDestData,
-                       dataFrame<row_label_type, col_label_type, value_type> &df)
-    : graph(graph), df(df), jq(), userSourceData(userSourceData), userDestData(userDestData) {}
-    void initialize()
+                       dataFrame<row_label_type, col_label_type, value_type> &df,
+                       std::atomic<bool> &cancelRequested,
+                       std::atomic<unsigned long int> &rowsCompleted)
+    : graph(graph), df(df), jq(), userSourceData(userSourceData), userDestData(userDestData),
+      cancelRequested(cancelRequested), rowsCompleted(rowsCompleted) {}
+    void initialize(bool pinWorkerThreads)
     {
+        pinThreads = pinWorkerThreads;
+        if (pinThreads)
+        {
+            allowedCpus = getAllowedCpus();
+        }
         //initialize job queue
         for (auto i : userSourceData.retrieveUniqueNetworkNodeIds()) {
             jq.insert(i);
@@ -62,6 +62,13 @@ public:
     {
         sharedSerializer.write2DVector(data);
     }
+
+    // write num_vectors contiguous vectors of vector_size values, in the
+    // same layout as a 2D vector
+    void writeData(const T* data, unsigned long int num_vectors, unsigned long int vector_size)
+    {
+        sharedSerializer.write2DArray(data, num_vectors, vector_size);
+    }
 };
 
 template <class T>
@@ -115,6 +122,12 @@ public:
         sharedDeserializer.read2DVector(data);
     }
 
+    // read num_vectors contiguous vectors of vector_size values
+    void readData(T* data, unsigned long int num_vectors, unsigned long int vector_size)
+    {
+        sharedDeserializer.read2DArray(data, num_vectors, vector_size);
+    }
+
 };
 
 class tmxTypeReader{
@@ -127,4 +140,14 @@ public:
         return deserializer.readNumericType<unsigned short>();
     }
 
+    bool readBool()
+    {
+        return deserializer.readBool();
+    }
+
+    unsigned long int readUlong()
+    {
+        return deserializer.readNumericType<unsigned long>();
+    }
+
 };
\ No newline at end of file
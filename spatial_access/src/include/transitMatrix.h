@@ -11,6 +11,10 @@
 #include <functional>
 #include <numeric>
 #include <mutex>
+#include <atomic>
+#include <algorithm>
+#include <memory>
+#include <string>
 
 #include "threadUtilities.h"
 #include "dataFrame.h"
@@ -30,14 +34,26 @@ void graphWorkerHandler(graphWorkerArgs<row_label_type,col_label_type, value_typ
 {
     network_node src;
     bool endNow = false;
+    if (worker_args.pinThreads && !worker_args.allowedCpus.empty())
+    {
+        unsigned int slot = worker_args.nextWorkerSlot++;
+        pinCurrentThreadToCpu(worker_args.allowedCpus.at(slot % worker_args.allowedCpus.size()));
+    }
+    // per-thread scratch space, allocated after pinning so that first touch
+    // places it on the worker's local NUMA node
     std::vector<value_type> dist_vector(worker_args.graph.vertices);
+    std::vector<bool> visited(worker_args.graph.vertices);
     while (!worker_args.jq.empty()) {
+        // stop dispensing jobs once the caller has asked to cancel
+        if (worker_args.cancelRequested.load()) {
+            break;
+        }
         src = worker_args.jq.pop(endNow);
         //exit loop if job queue worker_args is empty
         if (endNow) {
             break;
         }
-        doDijstraFromOneNetworkNode(src, worker_args, dist_vector);
+        doDijstraFromOneNetworkNode(src, worker_args, dist_vector, visited);
     }
 }
 
@@ -77,7 +93,7 @@ void calculateSingleRowOfDataFrame(const std::vector<value_type> &dist,
                     }
                 }
                 calc_imp = dist.at(destNodeId);
-                if ((worker_args.df.isSymmetric) && (destDataPoint.loc == sourceDataPoint.loc))
+                if ((worker_args.df.isSymmetric) && (destDataPoint.loc == sourceDataPoint.loc + worker_args.rowOffset))
                 {
                     fin_imp = 0;
                 }
@@ -105,7 +121,15 @@ void calculateSingleRowOfDataFrame(const std::vector<value_type> &dist,
             }
 
         }
-        worker_args.df.setRowByRowLoc(row_data, sourceDataPoint.loc);
+        if (worker_args.sink)
+        {
+            worker_args.sink->push(sourceDataPoint.loc, std::move(row_data));
+        }
+        else
+        {
+            worker_args.df.setRowByRowLoc(row_data, sourceDataPoint.loc);
+        }
+        worker_args.rowsCompleted++;
 
 
     }
@@ -115,16 +139,16 @@ void calculateSingleRowOfDataFrame(const std::vector<value_type> &dist,
 
 template<class row_label_type, class col_label_type, class value_type>
 void doDijstraFromOneNetworkNode(network_node src, graphWorkerArgs<row_label_type, col_label_type, value_type> &worker_args,
-                                 std::vector<value_type>& dist_vector)
+                                 std::vector<value_type>& dist_vector,
+                                 std::vector<bool>& visited)
 {
     typedef std::pair<value_type, network_node> queue_pair;
-    network_node V = worker_args.graph.vertices;
 
     std::fill(dist_vector.begin(), dist_vector.end(), worker_args.df.UNDEFINED);
+    std::fill(visited.begin(), visited.end(), false);
     dist_vector.at(src) = 0;
     std::priority_queue<queue_pair, std::vector<queue_pair>, std::greater<queue_pair>> queue;
     queue.push(std::make_pair(0, src));
-    std::vector<bool> visited(V, false);
     while (!queue.empty())
     {
         network_node u = queue.top().second;
@@ -157,10 +181,19 @@ public:
     userDataContainer<value_type> userSourceDataContainer;
     userDataContainer<value_type> userDestDataContainer;
     Graph<value_type> graph;
+    std::atomic<bool> cancelRequested{false};
+    std::atomic<unsigned long int> rowsCompleted{0};
+    // index of this matrix's first row within a partitioned symmetric matrix
+    unsigned long int rowOffset = 0;
+    // if set, compute streams rows to this long format csv instead of
+    // storing them (the dataFrame of a streamed matrix holds only labels)
+    std::string streamFilename;
+    value_type streamCutoff = dataFrame<row_label_type, col_label_type, value_type>::UNDEFINED;
 
     // Constructors
-    transitMatrix(bool isCompressible, bool isSymmetric,  unsigned long int rows, unsigned long int cols)
-    : df(isCompressible, isSymmetric, rows, cols) {}
+    transitMatrix(bool isCompressible, bool isSymmetric,  unsigned long int rows, unsigned long int cols,
+                  bool isStreamed=false, const std::string& spillDirectory="")
+    : df(isCompressible, isSymmetric, rows, cols, !isStreamed, spillDirectory) {}
     transitMatrix()= default;
 
     void
@@ -170,6 +203,25 @@ public:
 
     }
 
+    void
+    setRowOffset(unsigned long int offset)
+    {
+        rowOffset = offset;
+    }
+
+    // stream the rows computed by compute to filename as source,dest,value
+    // lines, dropping unreachable cells and cells above cutoff
+    void
+    setStreamingOutput(const std::string& filename, value_type cutoff)
+    {
+        if (df.isCompressible)
+        {
+            throw std::runtime_error("compressible matrices cannot be streamed");
+        }
+        streamFilename = filename;
+        streamCutoff = cutoff;
+    }
+
     void setMockDataFrame(const std::vector<std::vector<value_type>> dataset,
                           const std::vector<row_label_type>& row_ids,
                           const std::vector<col_label_type>& col_ids)
@@ -194,6 +246,37 @@ public:
         this->userDestDataContainer.addPoint(networkNodeId, col_loc, lastMileDistance);
     }
 
+    // Add num_points sources at once: ids, network locs and
+    // last mile distances are parallel arrays.
+    void
+    addUserSourceDataBulk(const network_node* networkNodeIds, const std::vector<row_label_type>& row_ids,
+                          const value_type* lastMileDistances)
+    {
+        unsigned long int num_points = row_ids.size();
+        network_node first_loc = df.addToRowIndex(row_ids);
+        userSourceDataContainer.reserve(num_points);
+        for (unsigned long int i = 0; i < num_points; i++)
+        {
+            userSourceDataContainer.addPoint(networkNodeIds[i], first_loc + i, lastMileDistances[i]);
+        }
+    }
+
+
+    // Add num_points dests at once: ids, network locs and
+    // last mile distances are parallel arrays.
+    void
+    addUserDestDataBulk(const network_node* networkNodeIds, const std::vector<col_label_type>& col_ids,
+                        const value_type* lastMileDistances)
+    {
+        unsigned long int num_points = col_ids.size();
+        network_node first_loc = df.addToColIndex(col_ids);
+        userDestDataContainer.reserve(num_points);
+        for (unsigned long int i = 0; i < num_points; i++)
+        {
+            userDestDataContainer.addPoint(networkNodeIds[i], first_loc + i, lastMileDistances[i]);
+        }
+    }
+
     void addSingleEdgeToGraph(network_node from_loc, network_node to_loc,
                         value_type edge_weight, bool is_bidirectional)
     {
@@ -205,17 +288,19 @@ public:
     }
 
     void
-    addEdgesToGraph(const std::vector<network_node>& from_column,
-            const std::vector<network_node>& to_column,
-            const std::vector<value_type>& edge_weights_column,
-            const std::vector<bool>& is_bidirectional_column)
+    addEdgesToGraph(const network_node* from_column,
+            const network_node* to_column,
+            const value_type* edge_weights_column,
+            const unsigned char* is_bidirectional_column,
+            unsigned long int num_edges)
     {
-        for (unsigned long int i = 0; i < from_column.size(); i++)
+        graph.reserveEdges(from_column, to_column, is_bidirectional_column, num_edges);
+        for (unsigned long int i = 0; i < num_edges; i++)
         {
-            auto from_loc = from_column.at(i);
-            auto to_loc = to_column.at(i);
-            value_type edge_weight = edge_weights_column.at(i);
-            auto is_bidirectional = is_bidirectional_column.at(i);
+            auto from_loc = from_column[i];
+            auto to_loc = to_column[i];
+            value_type edge_weight = edge_weights_column[i];
+            auto is_bidirectional = is_bidirectional_column[i];
             graph.addEdge(from_loc, to_loc, edge_weight);
             if (is_bidirectional)
             {
@@ -241,16 +326,34 @@ public:
     // Calculations
 
     void
-    compute(unsigned int numThreads)
+    compute(unsigned int numThreads, bool pinThreads=false)
     {
+        rowsCompleted = 0;
         try
         {
             graphWorkerArgs<row_label_type, col_label_type, value_type> worker_args(graph, userSourceDataContainer, userDestDataContainer,
-                                                               df);
-            worker_args.initialize();
+                                                               df, cancelRequested, rowsCompleted);
+            worker_args.rowOffset = rowOffset;
+            worker_args.initialize(pinThreads);
+            std::unique_ptr<rowSink<row_label_type, col_label_type, value_type>> sink;
+            if (!streamFilename.empty())
+            {
+                // a few rows per worker is enough to keep the writer busy
+                sink.reset(new rowSink<row_label_type, col_label_type, value_type>(streamFilename,
+                        df.rowIds, df.colIds, streamCutoff, df.UNDEFINED, 4 * numThreads));
+                worker_args.sink = sink.get();
+            }
             workerQueue<row_label_type, col_label_type, value_type> wq(numThreads,
                     graphWorkerHandler<row_label_type, col_label_type, value_type>, worker_args);
             wq.startGraphWorker();
+            if (sink)
+            {
+                sink->close();
+                if (sink->failed())
+                {
+                    throw std::runtime_error("unable to write file");
+                }
+            }
         } catch (...)
         {
             throw std::runtime_error("Failed to compute matrix");
@@ -258,6 +361,95 @@ public:
     }
 
 
+    void
+    requestCancel()
+    {
+        cancelRequested = true;
+    }
+
+    bool
+    wasCancelled() const
+    {
+        return cancelRequested.load();
+    }
+
+    unsigned long int
+    getRowsCompleted() const
+    {
+        return rowsCompleted.load();
+    }
+
+    unsigned long int
+    getRows() const
+    {
+        return df.rows;
+    }
+
+    unsigned long int
+    getCols() const
+    {
+        return df.cols;
+    }
+
+    bool
+    isMapped() const
+    {
+        return df.isMapped();
+    }
+
+    const std::vector<row_label_type>&
+    getRowIds() const
+    {
+        return df.rowIds;
+    }
+
+    const std::vector<col_label_type>&
+    getColIds() const
+    {
+        return df.colIds;
+    }
+
+    void
+    copyValuesTo(value_type* buffer) const
+    {
+        df.copyValuesTo(buffer);
+    }
+
+    void
+    copyRowsTo(value_type* buffer, unsigned long int first_row_loc, unsigned long int num_rows) const
+    {
+        df.copyRowsTo(buffer, first_row_loc, num_rows);
+    }
+
+    void
+    setValues(const value_type* buffer, const std::vector<row_label_type>& row_ids,
+              const std::vector<col_label_type>& col_ids, const std::string& spillDirectory="")
+    {
+        df.setValues(buffer, row_ids, col_ids, spillDirectory);
+    }
+
+    void
+    setIds(const std::vector<row_label_type>& row_ids, const std::vector<col_label_type>& col_ids,
+           const std::string& spillDirectory="")
+    {
+        df.setIds(row_ids, col_ids, spillDirectory);
+    }
+
+    void
+    setRows(const value_type* buffer, unsigned long int first_row_loc, unsigned long int num_rows)
+    {
+        df.setRows(buffer, first_row_loc, num_rows);
+    }
+
+    // Copy the values (and category map) of other, multiplied by scale.
+    void
+    copyScaledFrom(const transitMatrix<row_label_type, col_label_type, value_type>& other, double scale)
+    {
+        df = other.df;
+        df.scaleValues(scale);
+        categoryToDestMap = other.categoryToDestMap;
+    }
+
     const std::vector<std::pair<col_label_type, value_type>>
     getValuesBySource(row_label_type source_id, bool sort) const
     {
@@ -315,6 +507,81 @@ public:
     }
 
 
+    // For each row, a cumulative histogram of the given columns binned by
+    // (group, threshold): entry group * T + t holds the sum of col_weights[i][t]
+    // over the columns i of that group whose value is <= thresholds[t].
+    // thresholds must be sorted in increasing order. One pass over the matrix.
+    const std::vector<std::pair<row_label_type, std::vector<double>>>
+    getRowThresholdHistograms(const std::vector<value_type>& thresholds,
+                              const std::vector<col_label_type>& col_ids,
+                              const std::vector<unsigned long int>& col_groups,
+                              const std::vector<std::vector<double>>& col_weights,
+                              unsigned long int num_groups) const
+    {
+        unsigned long int num_thresholds = thresholds.size();
+        std::vector<network_node> col_locs;
+        col_locs.reserve(col_ids.size());
+        for (const auto& col_id : col_ids)
+        {
+            col_locs.push_back(df.getColLocForId(col_id));
+        }
+        std::vector<std::pair<row_label_type, std::vector<double>>> histograms;
+        histograms.reserve(df.rows);
+        for (network_node row_loc = 0; row_loc < df.rows; row_loc++)
+        {
+            std::vector<double> histogram(num_groups * num_thresholds, 0);
+            for (unsigned long int i = 0; i < col_locs.size(); i++)
+            {
+                value_type value = df.getValueByLoc(row_loc, col_locs.at(i));
+                auto first_bucket = std::lower_bound(thresholds.begin(), thresholds.end(), value) - thresholds.begin();
+                unsigned long int offset = col_groups.at(i) * num_thresholds;
+                const auto& weights = col_weights.at(i);
+                for (unsigned long int t = first_bucket; t < num_thresholds; t++)
+                {
+                    histogram.at(offset + t) += weights.at(t);
+                }
+            }
+            histograms.emplace_back(std::make_pair(df.getRowIdForLoc(row_loc), histogram));
+        }
+        return histograms;
+    }
+
+
+    // For each column, a cumulative histogram of the given rows: entry t holds
+    // the sum of row_weights[i] over the rows i whose value is <= thresholds[t].
+    // thresholds must be sorted in increasing order. One pass over the matrix.
+    const std::vector<std::pair<col_label_type, std::vector<double>>>
+    getColThresholdHistograms(const std::vector<value_type>& thresholds,
+                              const std::vector<row_label_type>& row_ids,
+                              const std::vector<double>& row_weights) const
+    {
+        unsigned long int num_thresholds = thresholds.size();
+        std::vector<std::vector<double>> buckets(df.cols, std::vector<double>(num_thresholds, 0));
+        for (unsigned long int i = 0; i < row_ids.size(); i++)
+        {
+            network_node row_loc = df.getRowLocForId(row_ids.at(i));
+            for (network_node col_loc = 0; col_loc < df.cols; col_loc++)
+            {
+                value_type value = df.getValueByLoc(row_loc, col_loc);
+                auto first_bucket = std::lower_bound(thresholds.begin(), thresholds.end(), value) - thresholds.begin();
+                if (first_bucket < (long int) num_thresholds)
+                {
+                    buckets.at(col_loc).at(first_bucket) += row_weights.at(i);
+                }
+            }
+        }
+        std::vector<std::pair<col_label_type, std::vector<double>>> histograms;
+        histograms.reserve(df.cols);
+        for (network_node col_loc = 0; col_loc < df.cols; col_loc++)
+        {
+            auto& histogram = buckets.at(col_loc);
+            std::partial_sum(histogram.begin(), histogram.end(), histogram.begin());
+            histograms.emplace_back(std::make_pair(df.getColIdForLoc(col_loc), histogram));
+        }
+        return histograms;
+    }
+
+
     value_type
     timeToNearestDestPerCategory(const row_label_type& source_id, const std::string& category) const
     {
@@ -397,13 +664,19 @@ public:
     }
 
     void
-    readTMX(const std::string &infile) {
-        df.readTMX(infile);
+    readTMX(const std::string &infile, const std::string &spillDirectory="") {
+        df.readTMX(infile, spillDirectory);
+    }
+
+    void
+    readTMXShards(const std::vector<std::string> &infiles, const std::string &spillDirectory="")
+    {
+        df.readTMXShards(infiles, spillDirectory);
     }
 
     void
-    readCSV(const std::string &infile) {
-        df.readCSV(infile);
+    readCSV(const std::string &infile, const std::string &spillDirectory="") {
+        df.readCSV(infile, spillDirectory);
     }
 
     void
@@ -16,7 +16,7 @@ public:
     unsigned long int networkNodeId;
     unsigned long int loc;
     value_type lastMileDistance;
-    userDataPoint(unsigned long int networkNodeId, unsigned long int loc, unsigned short int lastMileDistance)
+    userDataPoint(unsigned long int networkNodeId, unsigned long int loc, value_type lastMileDistance)
     : networkNodeId(networkNodeId), loc(loc), lastMileDistance(lastMileDistance) {}
 };
 
@@ -49,24 +49,24 @@ private:
 public:
     userDataContainer()= default;
 
+    void reserve(unsigned long int numPoints)
+    {
+        ids.reserve(ids.size() + numPoints);
+        allNetworkNodeIds.reserve(allNetworkNodeIds.size() + numPoints);
+        data.reserve(data.size() + numPoints);
+    }
+
     void addPoint(unsigned long int networkNodeId, unsigned long int loc, value_type lastMileDistance)
     {
         ids.push_back(loc);
         allNetworkNodeIds.push_back(networkNodeId);
-        userDataPoint<value_type> newDataPoint(networkNodeId, loc, lastMileDistance);
-        if (containsTract(networkNodeId))
+        auto tract = data.find(networkNodeId);
+        if (tract == data.end())
         {
-            data.at(networkNodeId).addPoint(newDataPoint);
-        }
-        else
-        {
-            userDataTract<value_type> newUserDataTract(networkNodeId);
-            newUserDataTract.addPoint(newDataPoint);
-            data.insert(std::make_pair(networkNodeId, newUserDataTract));
+            tract = data.emplace(networkNodeId, userDataTract<value_type>(networkNodeId)).first;
             uniqueNetworkNodeIds.push_back(networkNodeId);
         }
-
-
+        tract->second.addPoint(userDataPoint<value_type>(networkNodeId, loc, lastMileDistance));
     }
     bool containsTract(unsigned long int networkNodeId) const
     {
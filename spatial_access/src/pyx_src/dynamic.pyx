@@ -2,21 +2,39 @@ cdef extern from "include/transitMatrix.h":
     cdef cppclass {{ class_name }} "transitMatrix<{{ row_type_full }}, {{ col_type_full }},{{ value_type_full }}>":
 
 
-        {{ class_name }}(bool, bool, unsigned int, unsigned int) except +
+        {{ class_name }}(bool, bool, unsigned int, unsigned int, bool, string) except +
         {{ class_name }}() except +
 
         void prepareGraphWithVertices(int V) except +
         void addToUserSourceDataContainer(unsigned int, {{ row_type }}, {{ value_type }}) except +
         void addToUserDestDataContainer(unsigned int, {{ col_type }}, {{ value_type }}) except +
-        void addEdgesToGraph(vector[ulong], vector[ulong], vector[{{ value_type }}], vector[bool]) except +
+        void addUserSourceDataBulk(const ulong*, vector[{{ row_type }}], const {{ value_type }}*) except +
+        void addUserDestDataBulk(const ulong*, vector[{{ col_type }}], const {{ value_type }}*) except +
+        void addEdgesToGraph(const ulong*, const ulong*, const {{ value_type }}*, const unsigned char*, ulong) except +
         void addToCategoryMap({{ col_type }}, string) except +
         void setMockDataFrame(vector[vector[{{ value_type }}]], vector[{{ row_type }}], vector[{{ col_type }}]) except +
 
-        void compute(int) except +
+        void compute(int, bool) except + nogil
+        void requestCancel() except +
+        bool wasCancelled() except +
+        unsigned long getRowsCompleted() except +
+        unsigned long getRows() except +
+        unsigned long getCols() except +
+        bool isMapped() except +
+        vector[{{ row_type }}] getRowIds() except +
+        vector[{{ col_type }}] getColIds() except +
+        void copyValuesTo({{ value_type }}*) except +
+        void copyRowsTo({{ value_type }}*, ulong, ulong) except +
+        void setValues(const {{ value_type }}*, vector[{{ row_type }}], vector[{{ col_type }}], string) except +
+        void setIds(vector[{{ row_type }}], vector[{{ col_type }}], string) except +
+        void setRows(const {{ value_type }}*, ulong, ulong) except +
+        void copyScaledFrom({{ class_name }}&, double) except +
         vector[pair[{{ row_type }}, {{ value_type }}]] getValuesByDest({{ col_type }}, bool) except +
         vector[pair[{{ col_type }}, {{ value_type }}]] getValuesBySource({{ row_type }}, bool) except +
         unordered_map[{{ row_type }}, vector[{{ col_type }}]] getDestsInRange({{ value_type }}) except +
         unordered_map[{{ col_type }}, vector[{{ row_type }}]] getSourcesInRange({{ value_type }}) except +
+        vector[pair[{{ row_type }}, vector[double]]] getRowThresholdHistograms(vector[{{ value_type }}], vector[{{ col_type }}], vector[ulong], vector[vector[double]], ulong) except +
+        vector[pair[{{ col_type }}, vector[double]]] getColThresholdHistograms(vector[{{ value_type }}], vector[{{ row_type }}], vector[double]) except +
         {{ value_type }} timeToNearestDestPerCategory({{ row_type }}, string) except +
         {{ value_type }} countDestsInRangePerCategory({{ row_type }}, string, {{ value_type }}) except +
         {{ value_type }} timeToNearestDest({{ row_type }}) except +
@@ -24,19 +42,23 @@ cdef extern from "include/transitMatrix.h":
 
         void writeCSV(string) except +
         void writeTMX(string) except +
-        void readTMX(string) except +
-        void readCSV(string) except +
+        void readTMX(string, string) except +
+        void readTMXShards(vector[string], string) except +
+        void setRowOffset(unsigned long) except +
+        void setStreamingOutput(string, {{ value_type }}) except +
+        void readCSV(string, string) except +
         void readOTPCSV(string) except +
         void printDataFrame() except +
 
 cdef class  {{ py_class_name }}:
     cdef {{ class_name }} *thisptr
 
-    def __cinit__(self, bool isCompressible=False, bool isSymmetric=False, unsigned int rows=0, unsigned int columns=0):
+    def __cinit__(self, bool isCompressible=False, bool isSymmetric=False, unsigned int rows=0, unsigned int columns=0,
+                  bool isStreamed=False, string spillDirectory=b''):
         if rows == 0 and columns == 0:
             self.thisptr = new {{ class_name }}()
         else:
-            self.thisptr = new {{ class_name }}(isCompressible, isSymmetric, rows, columns)
+            self.thisptr = new {{ class_name }}(isCompressible, isSymmetric, rows, columns, isStreamed, spillDirectory)
 
     def __dealloc__(self):
         del self.thisptr
@@ -51,14 +73,98 @@ cdef class  {{ py_class_name }}:
     def addToUserDestDataContainer(self, networkNodeId, id_, lastMileDistance):
         self.thisptr.addToUserDestDataContainer(networkNodeId, id_, lastMileDistance)
 
+    def addUserSourceDataBulk(self, const ulong[::1] networkNodeIds, ids, const {{ value_type }}[::1] lastMileDistances):
+        if not len(ids) == networkNodeIds.shape[0] == lastMileDistances.shape[0]:
+            raise ValueError('arrays should have the same length')
+        if len(ids) > 0:
+            self.thisptr.addUserSourceDataBulk(&networkNodeIds[0], ids, &lastMileDistances[0])
+
+    def addUserDestDataBulk(self, const ulong[::1] networkNodeIds, ids, const {{ value_type }}[::1] lastMileDistances):
+        if not len(ids) == networkNodeIds.shape[0] == lastMileDistances.shape[0]:
+            raise ValueError('arrays should have the same length')
+        if len(ids) > 0:
+            self.thisptr.addUserDestDataBulk(&networkNodeIds[0], ids, &lastMileDistances[0])
+
     def addEdgesToGraph(self, from_column, to_column, edge_weight_column, is_bidirectional_column):
-        self.thisptr.addEdgesToGraph(from_column, to_column, edge_weight_column, is_bidirectional_column)
+        # no copy when the columns are already contiguous arrays of these types
+        cdef const ulong[::1] from_view = numpy.ascontiguousarray(from_column, dtype='L')
+        cdef const ulong[::1] to_view = numpy.ascontiguousarray(to_column, dtype='L')
+        cdef const {{ value_type }}[::1] edge_weight_view = numpy.ascontiguousarray(edge_weight_column, dtype=numpy.{{ 'uint16' if value_type == 'ushort' else 'uint32' }})
+        cdef const unsigned char[::1] is_bidirectional_view = numpy.ascontiguousarray(is_bidirectional_column, dtype=numpy.bool_).view(numpy.uint8)
+        cdef ulong num_edges = from_view.shape[0]
+        if not num_edges == to_view.shape[0] == edge_weight_view.shape[0] == is_bidirectional_view.shape[0]:
+            raise ValueError('columns should have the same length')
+        if num_edges > 0:
+            self.thisptr.addEdgesToGraph(&from_view[0], &to_view[0], &edge_weight_view[0], &is_bidirectional_view[0], num_edges)
 
     def setMockDataFrame(self, dataset, row_ids, col_ids):
         self.thisptr.setMockDataFrame(dataset, row_ids, col_ids)
 
-    def compute(self, numThreads):
-        self.thisptr.compute(numThreads)
+    def compute(self, int numThreads, bool pinThreads=False):
+        # release the GIL so callers can poll progress or cancel from another thread
+        with nogil:
+            self.thisptr.compute(numThreads, pinThreads)
+
+    def requestCancel(self):
+        self.thisptr.requestCancel()
+
+    def wasCancelled(self):
+        return self.thisptr.wasCancelled()
+
+    def getRowsCompleted(self):
+        return self.thisptr.getRowsCompleted()
+
+    def getRows(self):
+        return self.thisptr.getRows()
+
+    def getCols(self):
+        return self.thisptr.getCols()
+
+    def isMapped(self):
+        return self.thisptr.isMapped()
+
+    def getRowIds(self):
+        return self.thisptr.getRowIds()
+
+    def getColIds(self):
+        return self.thisptr.getColIds()
+
+    def getValueArray(self):
+        values = numpy.empty((self.thisptr.getRows(), self.thisptr.getCols()), dtype=numpy.{{ 'uint16' if value_type == 'ushort' else 'uint32' }})
+        cdef {{ value_type }}[:, ::1] view = values
+        if values.size > 0:
+            self.thisptr.copyValuesTo(&view[0, 0])
+        return values
+
+    def getRowValueArray(self, firstRow, numRows):
+        values = numpy.empty((numRows, self.thisptr.getCols()), dtype=numpy.{{ 'uint16' if value_type == 'ushort' else 'uint32' }})
+        cdef {{ value_type }}[:, ::1] view = values
+        if values.size > 0:
+            self.thisptr.copyRowsTo(&view[0, 0], firstRow, numRows)
+        return values
+
+    def setValueArray(self, values, rowIds, colIds, string spillDirectory=b''):
+        cdef {{ value_type }}[:, ::1] view = values
+        cdef {{ value_type }} empty = 0
+        if view.shape[0] != len(rowIds) or view.shape[1] != len(colIds):
+            raise ValueError('values should have shape (len(rowIds), len(colIds))')
+        if values.size > 0:
+            self.thisptr.setValues(&view[0, 0], rowIds, colIds, spillDirectory)
+        else:
+            self.thisptr.setValues(&empty, rowIds, colIds, spillDirectory)
+
+    def setIds(self, rowIds, colIds, string spillDirectory=b''):
+        self.thisptr.setIds(rowIds, colIds, spillDirectory)
+
+    def setRowValueArray(self, values, firstRow):
+        cdef {{ value_type }}[:, ::1] view = values
+        if view.shape[1] != self.thisptr.getCols():
+            raise ValueError('values should have one column per colId')
+        if values.size > 0:
+            self.thisptr.setRows(&view[0, 0], firstRow, view.shape[0])
+
+    def copyScaledFrom(self, {{ py_class_name }} other, double scale):
+        self.thisptr.copyScaledFrom(other.thisptr[0], scale)
 
     def writeCSV(self, outfile):
         self.thisptr.writeCSV(outfile)
@@ -66,11 +172,20 @@ cdef class  {{ py_class_name }}:
     def writeTMX(self, outfile):
         self.thisptr.writeTMX(outfile)
 
-    def readTMX(self, infile):
-        self.thisptr.readTMX(infile)
+    def readTMX(self, infile, string spillDirectory=b''):
+        self.thisptr.readTMX(infile, spillDirectory)
 
-    def readCSV(self, infile):
-        self.thisptr.readCSV(infile)
+    def readTMXShards(self, infiles, string spillDirectory=b''):
+        self.thisptr.readTMXShards(infiles, spillDirectory)
+
+    def setRowOffset(self, offset):
+        self.thisptr.setRowOffset(offset)
+
+    def setStreamingOutput(self, outfile, cutoff):
+        self.thisptr.setStreamingOutput(outfile, cutoff)
+
+    def readCSV(self, infile, string spillDirectory=b''):
+        self.thisptr.readCSV(infile, spillDirectory)
 
     def readOTPCSV(self, infile):
         self.thisptr.readOTPCSV(infile)
@@ -103,4 +218,10 @@ cdef class  {{ py_class_name }}:
         return self.thisptr.getSourcesInRange(range_)
 
     def getDestsInRange(self, range_):
-        return self.thisptr.getDestsInRange(range_)
\ No newline at end of file
+        return self.thisptr.getDestsInRange(range_)
+
+    def getRowThresholdHistograms(self, thresholds, col_ids, col_groups, col_weights, num_groups):
+        return self.thisptr.getRowThresholdHistograms(thresholds, col_ids, col_groups, col_weights, num_groups)
+
+    def getColThresholdHistograms(self, thresholds, row_ids, row_weights):
+        return self.thisptr.getColThresholdHistograms(thresholds, row_ids, row_weights)
\ No newline at end of file
@@ -7,6 +7,8 @@ from libcpp.unordered_map cimport unordered_map
 from libcpp.utility cimport pair
 from libcpp.unordered_set cimport unordered_set
 
+import numpy
+
 ctypedef unsigned short int ushort
 ctypedef unsigned long int ulong
 ctypedef unsigned int uint
@@ -15,12 +17,17 @@ cdef extern from "include/networkUtility.h":
     cdef cppclass NetworkUtility "NetworkUtility<unsigned long int>":
         NetworkUtility(vector[pair[ulong, ulong]], vector[ulong]) except +
         unordered_set[ulong] getConnectedNetworkNodes() except +
+    void largestConnectedComponentMask(const ulong*, const ulong*, ulong, ulong, unsigned char*) except + nogil
+    ulong contractDegreeTwoChains(const ulong*, const ulong*, const ulong*, const unsigned char*, ulong, ulong,
+                                  const unsigned char*, ulong, ulong*, ulong*, ulong*, unsigned char*) except + nogil
 
 
 cdef extern from "include/tmxParser.h":
     cdef cppclass tmxTypeReader:
         tmxTypeReader(string) except +
         ushort readUshort() except +
+        bool readBool() except +
+        ulong readUlong() except +
 
 
 cdef class pyNetworkUtility:
@@ -35,12 +42,68 @@ cdef class pyNetworkUtility:
     def getConnectedNetworkNodes(self):
         return self.thisptr.getConnectedNetworkNodes()
 
+def getConnectedNetworkMask(from_indices, to_indices, ulong num_nodes):
+    # edges are given as arrays of node indices (0..num_nodes - 1);
+    # returns a boolean mask of the nodes in the largest strongly connected component
+    cdef const ulong[::1] from_view = numpy.ascontiguousarray(from_indices, dtype='L')
+    cdef const ulong[::1] to_view = numpy.ascontiguousarray(to_indices, dtype='L')
+    cdef ulong num_edges = from_view.shape[0]
+    if num_edges != to_view.shape[0]:
+        raise ValueError('columns should have the same length')
+    keep_mask = numpy.zeros(num_nodes, dtype=numpy.uint8)
+    cdef unsigned char[::1] keep_mask_view = keep_mask
+    cdef const ulong* from_pointer = &from_view[0] if num_edges > 0 else NULL
+    cdef const ulong* to_pointer = &to_view[0] if num_edges > 0 else NULL
+    cdef unsigned char* keep_mask_pointer = &keep_mask_view[0] if num_nodes > 0 else NULL
+    with nogil:
+        largestConnectedComponentMask(from_pointer, to_pointer, num_edges, num_nodes, keep_mask_pointer)
+    return keep_mask.view(numpy.bool_)
+
+def getContractedNetwork(from_column, to_column, edge_weight_column, is_bidirectional_column,
+                         keep_mask, ulong max_weight):
+    # edges are given as arrays of node indices (0..len(keep_mask) - 1); vertices
+    # in keep_mask are never contracted. Returns the (from, to, weight,
+    # is_bidirectional) columns of the contracted edges
+    cdef const ulong[::1] from_view = numpy.ascontiguousarray(from_column, dtype='L')
+    cdef const ulong[::1] to_view = numpy.ascontiguousarray(to_column, dtype='L')
+    cdef const ulong[::1] edge_weight_view = numpy.ascontiguousarray(edge_weight_column, dtype='L')
+    cdef const unsigned char[::1] is_bidirectional_view = numpy.ascontiguousarray(is_bidirectional_column, dtype=numpy.bool_).view(numpy.uint8)
+    cdef const unsigned char[::1] keep_mask_view = numpy.ascontiguousarray(keep_mask, dtype=numpy.bool_).view(numpy.uint8)
+    cdef ulong num_edges = from_view.shape[0]
+    cdef ulong num_nodes = keep_mask_view.shape[0]
+    if not num_edges == to_view.shape[0] == edge_weight_view.shape[0] == is_bidirectional_view.shape[0]:
+        raise ValueError('columns should have the same length')
+    contracted_from = numpy.empty(num_edges, dtype='L')
+    contracted_to = numpy.empty(num_edges, dtype='L')
+    contracted_weights = numpy.empty(num_edges, dtype='L')
+    contracted_is_bidirectional = numpy.empty(num_edges, dtype=numpy.uint8)
+    if num_edges == 0:
+        return contracted_from, contracted_to, contracted_weights, contracted_is_bidirectional.view(numpy.bool_)
+    cdef ulong[::1] contracted_from_view = contracted_from
+    cdef ulong[::1] contracted_to_view = contracted_to
+    cdef ulong[::1] contracted_weights_view = contracted_weights
+    cdef unsigned char[::1] contracted_is_bidirectional_view = contracted_is_bidirectional
+    cdef const unsigned char* keep_mask_pointer = &keep_mask_view[0] if num_nodes > 0 else NULL
+    cdef ulong num_contracted
+    with nogil:
+        num_contracted = contractDegreeTwoChains(&from_view[0], &to_view[0], &edge_weight_view[0],
+                                                 &is_bidirectional_view[0], num_edges, num_nodes,
+                                                 keep_mask_pointer, max_weight,
+                                                 &contracted_from_view[0], &contracted_to_view[0],
+                                                 &contracted_weights_view[0],
+                                                 &contracted_is_bidirectional_view[0])
+    return (contracted_from[:num_contracted], contracted_to[:num_contracted],
+            contracted_weights[:num_contracted], contracted_is_bidirectional[:num_contracted].view(numpy.bool_))
+
 cdef class pyTMXTypeReader:
     cdef tmxTypeReader *thisptr
     cdef int tmxVersion
     cdef int rowTypeEnum
     cdef int colTypeEnum
     cdef int valueTypeEnum
+    cdef bool isCompressible
+    cdef ulong rows
+    cdef ulong cols
 
     def __cinit__(self, filename):
         self.thisptr = new tmxTypeReader(filename)
@@ -48,6 +111,11 @@ cdef class pyTMXTypeReader:
         self.rowTypeEnum = self.thisptr.readUshort()
         self.colTypeEnum = self.thisptr.readUshort()
         self.valueTypeEnum = self.thisptr.readUshort()
+        self.isCompressible = self.thisptr.readBool()
+        # is symmetric
+        self.thisptr.readBool()
+        self.rows = self.thisptr.readUlong()
+        self.cols = self.thisptr.readUlong()
 
     def __dealloc__(self):
         del self.thisptr
@@ -63,3 +131,12 @@ cdef class pyTMXTypeReader:
 
     def get_value_type_enum(self):
         return self.valueTypeEnum
+
+    def get_is_compressible(self):
+        return self.isCompressible
+
+    def get_rows(self):
+        return self.rows
+
+    def get_cols(self):
+        return self.cols
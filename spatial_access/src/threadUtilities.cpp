@@ -4,6 +4,11 @@
 
 #include "include/threadUtilities.h"
 
+#ifdef __linux__
+#include <sched.h>
+#include <pthread.h>
+#endif
+
 
 /* initialize jobQueue, reserving size for known inputs*/
 
@@ -41,4 +46,34 @@ bool jobQueue::empty() const
 void do_join(std::thread &t)
 {
     t.join();
-}
\ No newline at end of file
+}
+
+std::vector<int> getAllowedCpus()
+{
+    std::vector<int> cpus;
+#ifdef __linux__
+    cpu_set_t cpu_set;
+    CPU_ZERO(&cpu_set);
+    if (sched_getaffinity(0, sizeof(cpu_set), &cpu_set) == 0)
+    {
+        for (int cpu = 0; cpu < CPU_SETSIZE; cpu++)
+        {
+            if (CPU_ISSET(cpu, &cpu_set))
+            {
+                cpus.push_back(cpu);
+            }
+        }
+    }
+#endif
+    return cpus;
+}
+
+void pinCurrentThreadToCpu(int cpu)
+{
+#ifdef __linux__
+    cpu_set_t cpu_set;
+    CPU_ZERO(&cpu_set);
+    CPU_SET(cpu, &cpu_set);
+    pthread_setaffinity_np(pthread_self(), sizeof(cpu_set), &cpu_set);
+#endif
+}
@@ -0,0 +1,20 @@
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def network_cache(tmp_path_factory):
+    """
+    Point the network cache at a temporary copy of the cached
+    networks in data/osm_query_cache, so tests never write
+    to (or migrate) the tracked cache.
+    """
+    import glob
+    import shutil
+    from spatial_access import NetworkInterface as network_interface_module
+    cache_directory = str(tmp_path_factory.mktemp('osm_query_cache')) + '/'
+    for filename in glob.glob(network_interface_module.CACHE_DIRECTORY + '*.h5'):
+        shutil.copy(filename, cache_directory)
+    default_cache_directory = network_interface_module.CACHE_DIRECTORY
+    network_interface_module.CACHE_DIRECTORY = cache_directory
+    yield cache_directory
+    network_interface_module.CACHE_DIRECTORY = default_cache_directory
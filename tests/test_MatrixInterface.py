@@ -4,6 +4,7 @@ from spatial_access.SpatialAccessExceptions import ReadTMXFailedException
 from spatial_access.SpatialAccessExceptions import IndecesNotFoundException
 from spatial_access.SpatialAccessExceptions import FileNotFoundException
 from spatial_access.SpatialAccessExceptions import UnexpectedShapeException
+from spatial_access.SpatialAccessExceptions import MatrixBuildCancelledException
 
 class TestClass:
     def setup_class(self):
@@ -218,3 +219,389 @@ class TestClass:
         interface2.read_file(filename)
         interface2.print_data_frame()
 
+    def _prepare_small_matrix(self, interface=None):
+        if interface is None:
+            interface = MatrixInterface()
+        interface.prepare_matrix(is_symmetric=False,
+                                 is_compressible=False,
+                                 rows=3,
+                                 columns=2,
+                                 network_vertices=4)
+        from_column = [0, 1, 0, 3, 0]
+        to_column = [1, 0, 3, 2, 2]
+        weight_column = [3, 4, 5, 7, 2]
+        is_bidirectional_column = [False, False, False, False, True]
+        interface.add_edges_to_graph(from_column=from_column,
+                                     to_column=to_column,
+                                     edge_weight_column=weight_column,
+                                     is_bidirectional_column=is_bidirectional_column)
+
+        interface.add_user_source_data(2, 10, 5, False)
+        interface.add_user_source_data(1, 11, 4, False)
+        interface.add_user_source_data(0, 12, 1, False)
+
+        interface.add_user_dest_data(0, 21, 4)
+        interface.add_user_dest_data(3, 20, 6)
+        return interface
+
+    def test_8(self):
+        """
+        Test build_matrix_async reports progress
+        and produces the same matrix as build_matrix.
+        """
+        interface = self._prepare_small_matrix()
+        future = interface.build_matrix_async()
+        future.result(timeout=10)
+        assert interface.get_build_progress() == (3, 3)
+
+        expected = self._prepare_small_matrix()
+        expected.build_matrix()
+        for source_id in [10, 11, 12]:
+            assert sorted(interface.get_values_by_source(source_id)) == \
+                sorted(expected.get_values_by_source(source_id))
+
+    def test_9(self):
+        """
+        Test cancel_build raises MatrixBuildCancelledException, also
+        when called before the matrix is prepared, and that the next
+        matrix prepared can still be built.
+        """
+        interface = self._prepare_small_matrix()
+        interface.cancel_build()
+        future = interface.build_matrix_async()
+        try:
+            future.result(timeout=10)
+            assert False
+        except MatrixBuildCancelledException:
+            pass
+
+        self._prepare_small_matrix(interface)
+        interface.build_matrix()
+        assert interface.get_build_progress() == (3, 3)
+
+        interface = MatrixInterface()
+        interface.cancel_build()
+        self._prepare_small_matrix(interface)
+        try:
+            interface.build_matrix()
+            assert False
+        except MatrixBuildCancelledException:
+            pass
+        self._prepare_small_matrix(interface)
+        interface.build_matrix()
+        assert interface.get_build_progress() == (3, 3)
+
+    def test_10(self):
+        """
+        Test configurable thread limit and pinned worker threads.
+        """
+        assert MatrixInterface()._get_thread_limit() >= 1
+        assert MatrixInterface(thread_limit=2)._get_thread_limit() == 2
+
+        interface = self._prepare_small_matrix()
+        interface.pin_threads = True
+        interface.thread_limit = 2
+        interface.build_matrix()
+        assert interface.get_build_progress() == (3, 3)
+
+    def test_11(self):
+        """
+        Test threshold histograms for sources and dests.
+        """
+        interface = self._prepare_small_matrix()
+        interface.build_matrix()
+
+        histograms = interface.get_source_threshold_histograms([5, 10, 15], [21, 20], [0, 1],
+                                                               [[1, 1, 1], [2, 2, 2]], 2)
+        assert histograms == {10: [0, 0, 1, 0, 0, 0],
+                              11: [0, 0, 1, 0, 0, 0],
+                              12: [1, 1, 1, 0, 0, 2]}
+
+        histograms = interface.get_dest_threshold_histograms([5, 10, 15], [10, 11, 12],
+                                                             [1, 10, 100])
+        assert histograms == {21: [100, 100, 111], 20: [0, 0, 100]}
+
+    def test_12(self):
+        """
+        Test get_values_array matches get_values_by_source.
+        """
+        interface = self._prepare_small_matrix()
+        interface.build_matrix()
+        values, source_ids, dest_ids = interface.get_values_array()
+        assert values.shape == (3, 2)
+        assert sorted(source_ids) == [10, 11, 12]
+        assert sorted(dest_ids) == [20, 21]
+        for row, source_id in enumerate(source_ids):
+            for dest_id, value in interface.get_values_by_source(source_id):
+                assert values[row, dest_ids.index(dest_id)] == value
+
+    def test_13(self):
+        """
+        Test bulk user data insertion matches inserting point by point.
+        """
+        expected = self._prepare_small_matrix()
+        expected.build_matrix()
+
+        interface = MatrixInterface()
+        interface.prepare_matrix(is_symmetric=False,
+                                 is_compressible=False,
+                                 rows=3,
+                                 columns=2,
+                                 network_vertices=4)
+        interface.add_edges_to_graph(from_column=[0, 1, 0, 3, 0],
+                                     to_column=[1, 0, 3, 2, 2],
+                                     edge_weight_column=[3, 4, 5, 7, 2],
+                                     is_bidirectional_column=[False, False, False, False, True])
+        interface.add_user_source_data_bulk([2, 1, 0], [10, 11, 12], [5, 4, 1], False)
+        interface.add_user_dest_data_bulk([0, 3], [21, 20], [4, 6])
+        interface.build_matrix()
+
+        for source_id in [10, 11, 12]:
+            assert sorted(interface.get_values_by_source(source_id)) == \
+                sorted(expected.get_values_by_source(source_id))
+
+        try:
+            interface.add_user_dest_data_bulk([0], [22], [70000])
+            assert False
+        except OverflowError:
+            pass
+
+    def test_14(self):
+        """
+        Test add_edges_to_graph accepts numpy arrays and
+        rejects out of range edge weights.
+        """
+        import numpy as np
+        interface = MatrixInterface()
+        interface.prepare_matrix(is_symmetric=False,
+                                 is_compressible=False,
+                                 rows=1,
+                                 columns=1,
+                                 network_vertices=3)
+        interface.add_edges_to_graph(from_column=np.array([0, 1]),
+                                     to_column=np.array([1, 2]),
+                                     edge_weight_column=np.array([3, 4]),
+                                     is_bidirectional_column=np.array([True, False]))
+        interface.add_user_source_data(0, 1, 0, False)
+        interface.add_user_dest_data(2, 2, 0)
+        interface.build_matrix()
+        assert interface.get_values_by_source(1) == [(2, 7)]
+
+        try:
+            interface.add_edges_to_graph([0], [1], [70000], [True])
+            assert False
+        except OverflowError:
+            pass
+
+    def test_15(self):
+        """
+        Test get_scaled_copy scales every value and leaves
+        the original matrix unchanged.
+        """
+        import numpy as np
+        interface = self._prepare_small_matrix()
+        interface.build_matrix()
+        values, source_ids, dest_ids = interface.get_values_array()
+
+        scaled = interface.get_scaled_copy(0.5)
+        scaled_values, scaled_source_ids, scaled_dest_ids = scaled.get_values_array()
+        assert scaled_source_ids == source_ids
+        assert scaled_dest_ids == dest_ids
+        assert (scaled_values == values // 2).all()
+        assert (interface.get_values_array()[0] == values).all()
+
+        # values that overflow become unreachable
+        overflowed = interface.get_scaled_copy(100000)
+        assert (overflowed.get_values_array()[0] == np.iinfo(values.dtype).max).all()
+
+    def test_16(self):
+        """
+        Test writing to and reading from parquet and arrow,
+        in long and wide layouts.
+        """
+        import numpy as np
+        import pyarrow.parquet
+        interface = self._prepare_small_matrix()
+        interface.build_matrix()
+        values, source_ids, dest_ids = interface.get_values_array()
+        for extension in ['parquet', 'arrow']:
+            for layout in ['long', 'wide']:
+                filename = self.datapath + 'test_16_{}.{}'.format(layout, extension)
+                interface.write_arrow(filename, layout=layout, row_group_size=2)
+                interface2 = MatrixInterface()
+                interface2.read_file(filename)
+                values2, source_ids2, dest_ids2 = interface2.get_values_array()
+                assert not interface2.is_extended
+                order = [source_ids2.index(source_id) for source_id in source_ids]
+                dest_order = [dest_ids2.index(dest_id) for dest_id in dest_ids]
+                assert np.array_equal(values2[order][:, dest_order], values)
+
+        # string ids are dictionary encoded
+        interface = MatrixInterface()
+        interface.primary_ids_are_string = True
+        interface.secondary_ids_are_string = True
+        interface.prepare_matrix(is_symmetric=False,
+                                 is_compressible=False,
+                                 rows=2,
+                                 columns=2,
+                                 network_vertices=1)
+        interface._set_mock_data_frame([[1, 2], [3, 65535]], ['a', 'b'], ['c', 'd'])
+        filename = self.datapath + 'test_16_strings.parquet'
+        interface.write_arrow(filename)
+        table = pyarrow.parquet.read_table(filename)
+        assert pyarrow.types.is_dictionary(table.schema.field('origin').type)
+        assert table.num_rows == 3
+        interface2 = MatrixInterface()
+        interface2.read_file(filename)
+        assert interface2.primary_ids_are_string and interface2.secondary_ids_are_string
+        assert dict(interface2.get_values_by_source('a')) == {'c': 1, 'd': 2}
+        assert dict(interface2.get_values_by_source('b')) == {'c': 3, 'd': 65535}
+
+    def test_17(self):
+        """
+        Test reading a long parquet table written by another
+        tool (with null costs), and that bad input raises.
+        """
+        import pandas as pd
+        import pytest
+        from spatial_access.SpatialAccessExceptions import WriteArrowFailedException
+        from spatial_access.SpatialAccessExceptions import ReadArrowFailedException
+        filename = self.datapath + 'test_17.parquet'
+        pd.DataFrame({'origin': [1, 1, 2], 'dest': [5, 6, 5], 'cost': [10, 70000, 30]}).to_parquet(filename)
+        interface = MatrixInterface()
+        interface.read_file(filename)
+        assert interface.is_extended
+        assert dict(interface.get_values_by_source(1)) == {5: 10, 6: 70000}
+        assert dict(interface.get_values_by_source(2)) == {5: 30, 6: 4294967295}
+
+        # a null cost leaves its pair unreachable
+        pd.DataFrame({'origin': [1, 1, 2], 'dest': [5, 6, 5],
+                      'cost': pd.array([10, None, 30], dtype='UInt16')}).to_parquet(filename)
+        interface = MatrixInterface()
+        interface.read_file(filename)
+        assert dict(interface.get_values_by_source(1)) == {5: 10, 6: 65535}
+        assert dict(interface.get_values_by_source(2)) == {5: 30, 6: 65535}
+
+        # a wide table from another tool
+        pd.DataFrame({'origin': [1, 2], '5': [10, 30], '6': pd.array([20, None], dtype='UInt16')}) \
+            .to_parquet(filename)
+        interface = MatrixInterface()
+        interface.read_file(filename)
+        assert dict(interface.get_values_by_source(1)) == {'5': 10, '6': 20}
+        assert dict(interface.get_values_by_source(2)) == {'5': 30, '6': 4294967295}
+
+        for table in [pd.DataFrame({'origin': [1], 'dest': [5], 'cost': [-1]}),
+                      pd.DataFrame({'source': [1, 1], 'destination': [5, 6], 'time': [10, 20]}),
+                      pd.DataFrame({'origin': [1, 1], '5': [10, 20]}),
+                      pd.DataFrame({'origin': [1], 'dest': [5], 'cost': [10.7]}),
+                      pd.DataFrame({'origin': [1], 'dest': [5], 'cost': ['10']}),
+                      pd.DataFrame({'origin': [1], '5': [10.7]})]:
+            table.to_parquet(filename)
+            with pytest.raises(ReadArrowFailedException):
+                MatrixInterface().read_file(filename)
+
+        with pytest.raises(WriteArrowFailedException):
+            interface.write_arrow(self.datapath + 'test_17.parquet', layout='diagonal')
+        with pytest.raises(WriteArrowFailedException):
+            interface.write_arrow(self.datapath + 'test_17.txt')
+
+    def test_18(self):
+        """
+        Test matrices read from every format are memory mapped
+        over max_memory, and get_values_array_chunks matches
+        get_values_array.
+        """
+        import os
+        import numpy as np
+        spill_directory = self.datapath + 'spill'
+        os.makedirs(spill_directory, exist_ok=True)
+        source_ids = [10, 11, 12, 13, 14]
+        dest_ids = [20, 21, 22]
+        dataset = np.arange(15).reshape(5, 3)
+        dataset[1, 2] = 65535
+        interface = MatrixInterface()
+        interface.prepare_matrix(is_symmetric=False,
+                                 is_compressible=False,
+                                 rows=5,
+                                 columns=3,
+                                 network_vertices=1)
+        interface._set_mock_data_frame(dataset.tolist(), source_ids, dest_ids)
+        values = interface.get_values_array()[0]
+        for rows_per_chunk in [1, 2, 5, None]:
+            value_chunks, chunk_source_ids, chunk_dest_ids = interface.get_values_array_chunks(rows_per_chunk)
+            assert chunk_source_ids == source_ids
+            assert chunk_dest_ids == dest_ids
+            chunks = list(value_chunks)
+            assert [first_row for first_row, chunk in chunks] == list(range(0, 5, rows_per_chunk or 5))
+            assert np.array_equal(np.concatenate([chunk for first_row, chunk in chunks]), values)
+
+        filenames = [self.datapath + 'test_18.tmx', self.datapath + 'test_18.csv',
+                     self.datapath + 'test_18.parquet', self.datapath + 'test_18.arrow']
+        interface.write_tmx(filenames[0])
+        interface.write_csv(filenames[1])
+        interface.write_arrow(filenames[2], layout='long')
+        interface.write_arrow(filenames[3], layout='wide')
+        shard_directory = self.datapath + 'test_18_shards'
+        os.makedirs(shard_directory, exist_ok=True)
+        for shard, rows in enumerate([slice(0, 2), slice(2, 5)]):
+            shard_interface = MatrixInterface()
+            shard_interface.prepare_matrix(is_symmetric=False,
+                                           is_compressible=False,
+                                           rows=len(source_ids[rows]),
+                                           columns=3,
+                                           network_vertices=1)
+            shard_interface._set_mock_data_frame(dataset[rows].tolist(), source_ids[rows], dest_ids)
+            shard_interface.write_tmx('{}/{}.tmx'.format(shard_directory, shard))
+        filenames.append(shard_directory)
+
+        for filename in filenames:
+            for max_memory, is_mapped in [(None, False), (1000, False), (1, True)]:
+                interface2 = MatrixInterface(max_memory=max_memory, spill_directory=spill_directory)
+                interface2.read_file(filename)
+                assert interface2.transit_matrix.isMapped() == is_mapped
+                values2, source_ids2, dest_ids2 = interface2.get_values_array()
+                order = [source_ids2.index(source_id) for source_id in source_ids]
+                dest_order = [dest_ids2.index(dest_id) for dest_id in dest_ids]
+                assert np.array_equal(values2[order][:, dest_order], values)
+        # the mapped files are unlinked as soon as they are created
+        assert os.listdir(spill_directory) == []
+
+    def test_19(self):
+        """
+        Test parquet and arrow files are written and read
+        in several blocks of rows.
+        """
+        import numpy as np
+        from spatial_access import _arrow
+        from spatial_access import MatrixInterface as matrix_interface_module
+        interface = MatrixInterface()
+        interface.primary_ids_are_string = True
+        interface.secondary_ids_are_string = True
+        interface.prepare_matrix(is_symmetric=False,
+                                 is_compressible=False,
+                                 rows=5,
+                                 columns=2,
+                                 network_vertices=1)
+        source_ids = ['a', 'b', 'c', 'd', 'e']
+        interface._set_mock_data_frame([[1, 2], [3, 65535], [5, 6], [65535, 65535], [9, 10]],
+                                       source_ids, ['f', 'g'])
+        values = interface.get_values_array()[0]
+        default_values_per_chunk = matrix_interface_module.VALUES_PER_CHUNK
+        # two rows per block
+        matrix_interface_module.VALUES_PER_CHUNK = 4
+        try:
+            for extension in ['parquet', 'arrow']:
+                for layout in ['long', 'wide']:
+                    filename = self.datapath + 'test_19_{}.{}'.format(layout, extension)
+                    interface.write_arrow(filename, layout=layout)
+                    if layout == 'wide':
+                        assert [batch.num_rows for batch in _arrow.read_table(filename).to_batches()] == [2, 2, 1]
+                    value_chunks = _arrow.table_to_matrix(_arrow.read_table(filename), 4)[0]
+                    assert [first_row for first_row, chunk in value_chunks] == [0, 2, 4]
+                    interface2 = MatrixInterface()
+                    interface2.read_file(filename)
+                    values2, source_ids2, dest_ids2 = interface2.get_values_array()
+                    assert source_ids2 == source_ids and dest_ids2 == ['f', 'g']
+                    assert np.array_equal(values2, values)
+        finally:
+            matrix_interface_module.VALUES_PER_CHUNK = default_values_per_chunk
@@ -779,4 +779,82 @@ class TestClass:
             coverage_model.transit_matrix)
         results = coverage_model.calculate(upper_threshold=700, normalize=True)
 
-        assert list(results.index) == [3, 4, 5, 6, 7, 8]
\ No newline at end of file
+        assert list(results.index) == [3, 4, 5, 6, 7, 8]
+
+    def test_33(self):
+        """
+        Test precomputed thresholds give the same results
+        as calculating each threshold from scratch.
+        """
+        for model_class in [AccessCount, AccessSum, TSFCA]:
+            model = model_class('drive',
+                                sources_filename='tests/test_data/sources_a.csv',
+                                destinations_filename='tests/test_data/dests_b.csv',
+                                source_column_names={'idx': 'name', 'lat': 'y', 'lon': 'x',
+                                                     'population': 'pop'},
+                                dest_column_names={'idx': 'name', 'lat': 'y', 'lon': 'x',
+                                                   'capacity': 'capacity', 'category': 'cat'})
+            model.transit_matrix = self.mock_transit_matrix_values(model.transit_matrix)
+            expected = {}
+            for threshold in [100, 300, 600]:
+                model.calculate(threshold)
+                expected[threshold] = model.model_results.copy()
+
+            model.precompute_thresholds([100, 300, 600])
+            for threshold in [600, 100, 300]:
+                model.calculate(threshold)
+                for column in expected[threshold].columns:
+                    for source_id in expected[threshold].index:
+                        assert almost_equal(model.model_results.loc[source_id, column],
+                                            expected[threshold].loc[source_id, column])
+
+    def test_34(self):
+        """
+        Test vectorized AccessModel scores match scoring each source in turn.
+        """
+        model = AccessModel('drive',
+                            sources_filename='tests/test_data/sources_a.csv',
+                            destinations_filename='tests/test_data/dests_b.csv',
+                            source_column_names={'idx': 'name', 'lat': 'y', 'lon': 'x',
+                                                 'population': 'pop'},
+                            dest_column_names={'idx': 'name', 'lat': 'y', 'lon': 'x',
+                                               'capacity': 'capacity', 'category': 'cat'},
+                            decay_function='root')
+        model.transit_matrix = self.mock_transit_matrix_values(model.transit_matrix)
+        category_weight_dict = {'A': [5, 4, 3, 2, 1], 'D': [10, 1]}
+        for decay_function in ['linear', 'root', 'logit', lambda x, y: 1 / (x + 1)]:
+            model.set_decay_function(decay_function)
+            model.calculate(upper_threshold=400, category_weight_dict=category_weight_dict,
+                            vectorized=False)
+            expected = model.model_results.copy()
+            model.calculate(upper_threshold=400, category_weight_dict=category_weight_dict)
+            for column in expected.columns:
+                for source_id in expected.index:
+                    assert almost_equal(model.model_results.loc[source_id, column],
+                                        expected.loc[source_id, column])
+
+    def test_35(self):
+        """
+        Test AccessModel ignores weights for categories missing
+        from the destinations.
+        """
+        model = AccessModel('drive',
+                            sources_filename='tests/test_data/sources_a.csv',
+                            destinations_filename='tests/test_data/dests_b.csv',
+                            source_column_names={'idx': 'name', 'lat': 'y', 'lon': 'x',
+                                                 'population': 'pop'},
+                            dest_column_names={'idx': 'name', 'lat': 'y', 'lon': 'x',
+                                               'capacity': 'capacity', 'category': 'cat'},
+                            decay_function='linear')
+        model.transit_matrix = self.mock_transit_matrix_values(model.transit_matrix)
+        model.calculate(upper_threshold=400, category_weight_dict={'A': [5, 4, 3, 2, 1]})
+        expected = model.model_results.copy()
+        category_weight_dict = {'A': [5, 4, 3, 2, 1], 'not_a_category': [10, 1]}
+        for vectorized in [True, False]:
+            model.calculate(upper_threshold=400, category_weight_dict=category_weight_dict,
+                            vectorized=vectorized)
+            assert list(model.model_results.columns) == list(expected.columns)
+            for column in expected.columns:
+                for source_id in expected.index:
+                    assert almost_equal(model.model_results.loc[source_id, column],
+                                        expected.loc[source_id, column])
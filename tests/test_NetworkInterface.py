@@ -3,6 +3,7 @@ import pandas as pd
 import pytest
 
 from spatial_access.SpatialAccessExceptions import BoundingBoxTooLargeException
+from spatial_access.SpatialAccessExceptions import UnableToConnectException
 
 
 class TestClass:
@@ -74,9 +75,473 @@ class TestClass:
             assert False
         except BoundingBoxTooLargeException:
             assert True
-        
 
 
+    @pytest.mark.timeout(20)
+    def test_5(self):
+        """
+        Tests the node index is cached for the network
+        and reused by later loads.
+        """
+        import os
+        source_df = self.create_example_source_table()
+        walk_interface = NetworkInterface('walk')
+        walk_interface.load_network(source_df, None, False, 0.005)
+        node_index = walk_interface.get_node_index()
+        assert walk_interface.get_node_index() is node_index
+        assert os.path.exists(walk_interface._get_node_index_filename())
+
+        cached_interface = NetworkInterface('walk')
+        cached_interface.load_network(source_df, None, False, 0.005)
+        assert cached_interface._read_node_index() is not None
+        points = cached_interface.project_coordinates(source_df['lon'], source_df['lat'])
+        assert list(cached_interface.get_node_index().query(points)[1]) == list(node_index.query(points)[1])
+
+    @pytest.mark.timeout(20)
+    def test_6(self):
+        """
+        Tests networks are assembled from cached tiles, only
+        missing tiles are fetched (and stitched together with cached
+        tiles without duplicate edges), and tiles are evicted least
+        recently used first.
+        """
+        import os
+        import numpy as np
+        from spatial_access import _network_cache
+        source_df = self.create_example_source_table()
+        full_interface = NetworkInterface('walk')
+        full_interface.load_network(source_df, None, False, 0.005)
+
+        fetched_bboxes = []
+
+        def fetch_osm_elements(bbox):
+            # serve tiles from the cached network instead of OSM, each
+            # edge as a two node way (with the ways crossing the tile
+            # border, as OSM does)
+            fetched_bboxes.append(bbox)
+            nodes = full_interface.nodes
+            in_bbox = (nodes['y'] >= bbox[0]) & (nodes['x'] >= bbox[1]) & \
+                      (nodes['y'] < bbox[2]) & (nodes['x'] < bbox[3])
+            edges = full_interface.edges.reset_index(drop=True).assign(name='street')
+            edges = edges[edges['from'].isin(nodes['id'][in_bbox]) | edges['to'].isin(nodes['id'][in_bbox])]
+            nodes = nodes[in_bbox | nodes['id'].isin(edges['from']) | nodes['id'].isin(edges['to'])]
+            nodes = pd.DataFrame({'lat': nodes['y'].values, 'lon': nodes['x'].values},
+                                 index=pd.Index(nodes['id'].values, name='id'))
+            ways = edges.drop(columns=['from', 'to', 'distance']).rename_axis('id')
+            waynodes = pd.DataFrame({'node_id': np.column_stack([edges['from'], edges['to']]).ravel()},
+                                    index=pd.Index(np.repeat(edges.index.values, 2), name='way_id'))
+            return nodes, ways, waynodes
+
+        tiled_interface = NetworkInterface('walk', tile_size=0.005)
+        tiled_interface.tile_directory = self.datapath + 'tiles/'
+        tiled_interface._fetch_osm_elements = fetch_osm_elements
+        tiled_interface._find_cached_superset = lambda: None
+        tiled_interface.load_network(source_df, None, False, 0.003)
+        first_tiles = set(tiled_interface._get_tiles())
+        num_tiles = len(first_tiles)
+        assert num_tiles > 1
+        assert len(fetched_bboxes) == num_tiles
+        assert len(tiled_interface.nodes) > 0 and len(tiled_interface.edges) > 0
+        lat_min, lon_min, lat_max, lon_max = tiled_interface.bbox
+        assert tiled_interface.nodes['y'].between(lat_min, lat_max).all()
+        assert tiled_interface.nodes['x'].between(lon_min, lon_max).all()
+
+        # a slightly different request reuses the cached tiles (but
+        # fetches a dropped one again)
+        _network_cache.remove_network(tiled_interface._get_tile_filename(min(first_tiles)))
+        tiled_interface.load_network(source_df, None, False, 0.0031)
+        assert len(fetched_bboxes) == num_tiles + 1 + len(set(tiled_interface._get_tiles()) - first_tiles)
+        assert list(tiled_interface.edges.columns) == list(full_interface.edges.columns)
+        assert not tiled_interface.edges.duplicated().any()
+        tile_index = tiled_interface._read_tile_index()
+        assert all(os.path.exists(filename) for filename in tile_index)
+
+        # evict all but the most recently used tile
+        newest = max(tile_index, key=lambda filename: tile_index[filename]['last_used'])
+        tiled_interface.max_cache_size = tile_index[newest]['size']
+        tiled_interface._evict_tiles()
+        assert list(tiled_interface._read_tile_index().keys()) == [newest]
+        assert os.path.exists(newest)
+        assert sum(os.path.exists(filename) for filename in tile_index) == 1
+
+    @pytest.mark.timeout(20)
+    def test_7(self):
+        """
+        Tests a request inside a cached network's bbox is clipped
+        from the smallest such network instead of being fetched,
+        and reading the manifest only writes it if it changed.
+        """
+        source_df = self.create_example_source_table()
+        full_interface = NetworkInterface('walk')
+        full_interface.load_network(source_df, None, False, 0.005)
+
+        def fetch_osm_elements(bbox):
+            assert False, 'network should be clipped from the cache'
+
+        clipped_interface = NetworkInterface('walk')
+        clipped_interface._fetch_osm_elements = fetch_osm_elements
+        clipped_interface._get_bbox(source_df, None, False, 0.003)
+        assert clipped_interface._find_cached_superset() == full_interface._get_filename()
+        manifest = clipped_interface._read_manifest()
+        assert full_interface._get_filename() in [entry['filename'] for entry in manifest]
+
+        # an unchanged manifest is not rewritten
+        def write_manifest(manifest):
+            assert False, 'manifest should not be rewritten'
+        clipped_interface._write_manifest = write_manifest
+        assert clipped_interface._read_manifest() == manifest
+        del clipped_interface._write_manifest
+
+        clipped_interface.load_network(source_df, None, False, 0.003)
+        assert 0 < len(clipped_interface.nodes) < len(full_interface.nodes)
+        lat_min, lon_min, lat_max, lon_max = clipped_interface.bbox
+        assert clipped_interface.nodes['y'].between(lat_min, lat_max).all()
+        assert clipped_interface.nodes['x'].between(lon_min, lon_max).all()
+        assert clipped_interface.edges['from'].isin(clipped_interface.nodes['id']).all()
+        assert clipped_interface.edges['to'].isin(clipped_interface.nodes['id']).all()
+
+        bike_interface = NetworkInterface('bike')
+        bike_interface._get_bbox(source_df, None, False, 0.003)
+        assert 'bike' in bike_interface._find_cached_superset()
+
+    @pytest.mark.timeout(20)
+    def test_8(self):
+        """
+        Tests networks built from a local osm extract match osmnet's
+        node pairs, apply the network type filters and are cached.
+        """
+        from osmnet.load import node_pairs
+        from spatial_access import _osm
+        from spatial_access import _network_cache
+        filename = self.datapath + 'extract.osm'
+        nodes, ways, waynodes = self.write_example_osm_extract(filename)
+
+        extract_nodes, extract_edges = _osm.read_osm_extract(filename, 'walk')
+        walk_ways = ways[ways['highway'] != 'motorway']
+        expected_edges = node_pairs(nodes, walk_ways, waynodes.loc[walk_ways.index])
+        assert list(zip(extract_edges['from'], extract_edges['to'])) == \
+            list(zip(expected_edges['from_id'], expected_edges['to_id']))
+        assert (extract_edges['distance'].values == expected_edges['distance'].values).all()
+        assert list(extract_edges['highway']) == list(expected_edges['highway'])
+        assert set(extract_nodes['id']) == set(extract_edges['from']) | set(extract_edges['to'])
+
+        drive_nodes, drive_edges = _osm.read_osm_extract(filename, 'drive')
+        assert set(drive_edges['highway']) == {'residential', 'motorway'}
+
+        drive_interface = NetworkInterface('drive', osm_extract=filename)
+        source_df = pd.DataFrame({'lat': [41.7905, 41.7915], 'lon': [-87.6005, -87.5985]})
+        drive_interface.load_network(source_df, None, False, 0.0006)
+        assert 0 < len(drive_interface.nodes) < len(drive_nodes)
+        assert 'footway' not in set(drive_interface.edges['highway'])
+
+        # later queries are clipped from the cached extract network
+        def raise_error(*args, **kwargs):
+            raise AssertionError('extract was read again')
+        read_osm_extract = _osm.read_osm_extract
+        _osm.read_osm_extract = raise_error
+        try:
+            inner_df = pd.DataFrame({'lat': [41.7912], 'lon': [-87.5995]})
+            drive_interface.load_network(inner_df, None, False, 0.0008)
+            assert 0 < len(drive_interface.nodes) < len(drive_nodes)
+            assert 'drive_' in drive_interface._find_cached_superset()
+        finally:
+            _osm.read_osm_extract = read_osm_extract
+            _network_cache.remove_network(drive_interface._get_extract_cache_filename())
+
+    @pytest.mark.timeout(20)
+    def test_9(self):
+        """
+        Tests legacy .h5 cache entries are migrated to the columnar
+        format (keeping the .h5 file), and reads return only the
+        needed columns.
+        """
+        import os
+        import numpy as np
+        from spatial_access import _network_cache
+        path = self.datapath + 'walk_cache_entry'
+        nodes = pd.DataFrame({'x': [-87.6, -87.5, -87.4], 'y': [41.7, 41.8, 41.9], 'id': [5, 6, 7]},
+                             index=pd.Index([5, 6, 7], name='id'))
+        edges = pd.DataFrame({'distance': [10.5, 20.25], 'from': [5, 6], 'to': [6, 7],
+                              'highway': ['primary', 'footway'], 'oneway': ['yes', np.nan],
+                              'name': ['Main Street', np.nan]})
+        edges.index = pd.MultiIndex.from_arrays([edges['from'].values, edges['to'].values])
+        nodes.to_hdf(path + '.h5', key='nodes')
+        edges.to_hdf(path + '.h5', key='edges')
+
+        assert _network_cache.network_exists(path)
+        cached_nodes, cached_edges = _network_cache.read_network(path)
+        assert os.path.exists(path + '.h5') and os.path.isdir(path)
+        assert list(cached_nodes.columns) == ['id', 'x', 'y']
+        assert list(cached_edges.columns) == ['from', 'to', 'distance', 'highway', 'oneway']
+        assert cached_nodes.index.equals(nodes.index)
+        assert cached_edges.index.equals(edges.index)
+        assert (cached_nodes['x'] == nodes['x']).all()
+        assert (cached_edges['distance'] == edges['distance']).all()
+        assert list(cached_edges['highway']) == ['primary', 'footway']
+        assert cached_edges['oneway'].iloc[0] == 'yes' and pd.isnull(cached_edges['oneway'].iloc[1])
+        assert cached_edges['oneway'].iloc[1] != 'yes'
+
+        all_nodes, all_edges = _network_cache.read_network(path, None, None)
+        assert set(all_edges.columns) == set(edges.columns)
+        assert all_edges['name'].iloc[0] == 'Main Street'
+
+        _network_cache.remove_network(path)
+        assert not _network_cache.network_exists(path)
+
+    @pytest.mark.timeout(20)
+    def test_10(self):
+        """
+        Tests the connected component trimming result is cached
+        for the network, reused by later loads and recomputed
+        when the trimming version changes, and that cached
+        artifacts are evicted with the tiles.
+        """
+        import os
+        from spatial_access import NetworkInterface as network_interface_module
+        source_df = self.create_example_source_table()
+        walk_interface = NetworkInterface('walk')
+        walk_interface.load_network(source_df, None, False, 0.005)
+        assert os.path.exists(walk_interface._get_connected_nodes_filename())
+
+        def raise_error():
+            raise AssertionError('network was trimmed again')
+        cached_interface = NetworkInterface('walk')
+        cached_interface._get_connected_nodes = raise_error
+        cached_interface.load_network(source_df, None, False, 0.005)
+        assert list(cached_interface.nodes['id']) == list(walk_interface.nodes['id'])
+        assert cached_interface.edges.index.equals(walk_interface.edges.index)
+
+        trimming_version = network_interface_module.TRIMMING_VERSION
+        network_interface_module.TRIMMING_VERSION = trimming_version + 1
+        try:
+            with pytest.raises(AssertionError, match='trimmed again'):
+                cached_interface.load_network(source_df, None, False, 0.005)
+        finally:
+            network_interface_module.TRIMMING_VERSION = trimming_version
+        walk_interface.load_network(source_df, None, False, 0.005)
+
+        artifact_interface = NetworkInterface('walk')
+        artifact_interface.tile_directory = self.datapath + 'artifact_tiles/'
+        artifact_interface.load_network(source_df, None, False, 0.005)
+        artifact_interface.get_node_index()
+        directory = artifact_interface._get_artifact_directory()
+        assert sorted(os.listdir(directory)) == ['connected_nodes.pkl', 'node_index.pkl']
+        tile_index = artifact_interface._read_tile_index()
+        assert tile_index[directory]['size'] == sum(os.path.getsize(os.path.join(directory, filename))
+                                                    for filename in os.listdir(directory))
+        artifact_interface.max_cache_size = 0
+        artifact_interface._evict_tiles()
+        assert not os.path.exists(directory)
+        assert artifact_interface._read_tile_index() == {}
+
+    @pytest.mark.timeout(30)
+    def test_11(self):
+        """
+        Tests tiles are fetched concurrently from an Overpass server
+        (a local stand-in), retried when it is overloaded, and
+        stitched together without duplicate nodes or edges,
+        keeping parallel edges.
+        """
+        import re
+        import json
+        import threading
+        from urllib.parse import parse_qs
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        # a grid of streets, each way crossing the whole area (and
+        # drawn in both directions, so the grid is strongly connected)
+        grid_size = 11
+        node_locations = {1000 + row * grid_size + col: (41.79 + row * 0.0004, -87.6 + col * 0.0004)
+                          for row in range(grid_size) for col in range(grid_size)}
+        ways = [[1000 + row * grid_size + col for col in range(grid_size)] for row in range(grid_size)] + \
+               [[1000 + row * grid_size + col for row in range(grid_size)] for col in range(grid_size)]
+        ways += [list(reversed(way)) for way in ways]
+        # a footway alongside one block of a street
+        footway = [1000 + 3 * grid_size + 3, 1000 + 3 * grid_size + 4]
+        requested_bboxes = []
+        lock = threading.Lock()
+
+        class OverpassHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+                query = parse_qs(body)['data'][0]
+                bbox = [float(coord) for coord in re.search(r'\(([-0-9.]+),([-0-9.]+),([-0-9.]+),([-0-9.]+)\)',
+                                                            query).groups()]
+                with lock:
+                    is_first_request = bbox not in requested_bboxes
+                    requested_bboxes.append(bbox)
+                if is_first_request:
+                    self.send_response(429)
+                    self.end_headers()
+                    return
+                elements = []
+                node_ids = set()
+                for way_id, way in enumerate(ways):
+                    if any(bbox[0] <= node_locations[node][0] <= bbox[2] and
+                           bbox[1] <= node_locations[node][1] <= bbox[3] for node in way):
+                        elements.append({'type': 'way', 'id': way_id, 'nodes': way,
+                                         'tags': {'highway': 'residential'}})
+                        node_ids.update(way)
+                elements.append({'type': 'way', 'id': len(ways), 'nodes': footway,
+                                 'tags': {'highway': 'footway'}})
+                elements.extend({'type': 'node', 'id': node, 'lat': node_locations[node][0],
+                                 'lon': node_locations[node][1]} for node in sorted(node_ids))
+                response = json.dumps({'elements': elements}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), OverpassHandler)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            overpass_url = 'http://127.0.0.1:{}/api/interpreter'.format(server.server_address[1])
+            tiled_interface = NetworkInterface('walk', tile_size=0.002, overpass_url=overpass_url,
+                                               fetch_workers=4, fetch_retries=2)
+            tiled_interface.tile_directory = self.datapath + 'overpass_tiles/'
+            tiled_interface.fetch_backoff = 0.01
+            tiled_interface._find_cached_superset = lambda: None
+            source_df = pd.DataFrame({'lat': [41.7905, 41.7935], 'lon': [-87.5995, -87.5965]})
+            tiled_interface.load_network(source_df, None, False, 0.0)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        num_tiles = len(tiled_interface._get_tiles())
+        assert num_tiles == 4
+        # one overloaded and one successful request per tile
+        assert len(requested_bboxes) == 2 * num_tiles
+        assert not tiled_interface.nodes.index.duplicated().any()
+        assert not tiled_interface.edges.duplicated().any()
+        # the grid between the points has 7 rows and columns of 6 two
+        # way edges, and the footway is parallel to one of them
+        assert len(tiled_interface.nodes) == 7 * 7
+        assert len(tiled_interface.edges) == 2 * 2 * 7 * 6 + 1
+        assert tiled_interface.edges.index.duplicated().sum() == 1
+
+        failing_interface = NetworkInterface('walk', overpass_url=overpass_url, fetch_retries=1)
+        failing_interface.fetch_backoff = 0.01
+        with pytest.raises(UnableToConnectException):
+            failing_interface._fetch_osm_elements([41.79, -87.6, 41.791, -87.599])
+
+    def test_12(self):
+        """
+        Tests Overpass responses with no highways, or with highways
+        but no intersections (a lone road), give empty networks.
+        """
+        from spatial_access import _osm
+        lone_road = {'elements': [{'type': 'node', 'id': 1, 'lat': 41.79, 'lon': -87.6},
+                                  {'type': 'node', 'id': 2, 'lat': 41.791, 'lon': -87.6},
+                                  {'type': 'way', 'id': 10, 'nodes': [1, 2],
+                                   'tags': {'highway': 'residential'}}]}
+        for response_json in [{'elements': []}, lone_road]:
+            nodes, edges = _osm.network_from_overpass_json(response_json)
+            assert len(nodes) == 0 and len(edges) == 0
+            assert {'x', 'y', 'id'} <= set(nodes.columns)
+            assert {'from', 'to', 'distance'} <= set(edges.columns)
+
+    @pytest.mark.timeout(20)
+    def test_13(self):
+        """
+        Tests tiles are stitched together before their edges are
+        built, so streets crossing a tile border connect to cross
+        streets which lie in a single tile.
+        """
+        from spatial_access import _osm
+        # two one way streets crossing a tile border, joined by four
+        # short cross streets (into a loop through every node)
+        node_locations = {1 + row * 4 + col: (41.7905 + row * 0.001, -87.6035 + col * 0.001)
+                          for row in range(2) for col in range(4)}
+        ways = [[1, 2, 3, 4], [8, 7, 6, 5], [5, 1], [2, 6], [3, 7], [4, 8]]
+
+        def get_response_json(bbox):
+            elements = []
+            node_ids = set()
+            for way_id, way in enumerate(ways):
+                if any(bbox[0] <= node_locations[node][0] < bbox[2] and
+                       bbox[1] <= node_locations[node][1] < bbox[3] for node in way):
+                    elements.append({'type': 'way', 'id': way_id, 'nodes': way,
+                                     'tags': {'highway': 'residential'}})
+                    node_ids.update(way)
+            elements.extend({'type': 'node', 'id': node, 'lat': node_locations[node][0],
+                             'lon': node_locations[node][1]} for node in sorted(node_ids))
+            return {'elements': elements}
+
+        tiled_interface = NetworkInterface('walk', tile_size=0.002)
+        tiled_interface.tile_directory = self.datapath + 'stitched_tiles/'
+        tiled_interface._fetch_osm_elements = lambda bbox: _osm.parse_overpass_json(get_response_json(bbox))
+        tiled_interface._find_cached_superset = lambda: None
+        source_df = pd.DataFrame({'lat': [41.7905, 41.7915], 'lon': [-87.6035, -87.6005]})
+        tiled_interface.load_network(source_df, None, False, 0.0)
+        tiles = tiled_interface._get_tiles()
+        assert len(tiles) == 2
+
+        # each tile on its own misses the blocks between the tiles
+        for tile in tiles:
+            _, tile_edges = _osm.network_from_overpass_json(get_response_json(tiled_interface._get_tile_bbox(tile)))
+            assert not ((tile_edges['from'] == 2) & (tile_edges['to'] == 3)).any()
+        _, expected_edges = _osm.network_from_overpass_json(get_response_json([41.79, -87.604, 41.792, -87.6]))
+        assert len(expected_edges) == 2 * 3 + 4
+        assert len(tiled_interface.nodes) == 8
+        assert sorted(zip(tiled_interface.edges['from'], tiled_interface.edges['to'])) == \
+            sorted(zip(expected_edges['from'], expected_edges['to']))
+
+        # and so are tiles read back from the cache
+        tiled_interface._fetch_osm_elements = None
+        tiled_interface.load_network(source_df, None, False, 0.0)
+        assert len(tiled_interface.edges) == len(expected_edges)
+
+    @staticmethod
+    def write_example_osm_extract(filename):
+        """
+        Write a 4x4 grid of residential streets, crossed by a
+        motorway and a footway, as .osm xml.
+        Returns: (nodes, ways, waynodes) tables as osmnet parses them.
+        """
+        node_rows = []
+        for row in range(4):
+            for col in range(4):
+                node_rows.append({'id': 100 + row * 4 + col,
+                                  'lat': 41.79 + row * 0.001,
+                                  'lon': -87.601 + col * 0.001})
+        node_rows.append({'id': 200, 'lat': 41.7885, 'lon': -87.6015})
+        node_rows.append({'id': 201, 'lat': 41.7935, 'lon': -87.5965})
+        way_rows = []
+        waynode_rows = []
+        for row in range(4):
+            way_rows.append({'id': 10 + row, 'highway': 'residential', 'name': 'row {}'.format(row)})
+            waynode_rows.extend({'way_id': 10 + row, 'node_id': 100 + row * 4 + col} for col in range(4))
+        for col in range(4):
+            way_rows.append({'id': 20 + col, 'highway': 'footway' if col == 3 else 'residential'})
+            waynode_rows.extend({'way_id': 20 + col, 'node_id': 100 + row * 4 + col} for row in range(4))
+        way_rows.append({'id': 30, 'highway': 'motorway', 'oneway': 'yes'})
+        waynode_rows.extend({'way_id': 30, 'node_id': node_id} for node_id in [200, 100, 105, 110, 115, 201])
+
+        with open(filename, 'w') as file:
+            file.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+            for node in node_rows:
+                file.write('<node id="{id}" lat="{lat}" lon="{lon}"/>\n'.format(**node))
+            for way in way_rows:
+                file.write('<way id="{}">\n'.format(way['id']))
+                for waynode in waynode_rows:
+                    if waynode['way_id'] == way['id']:
+                        file.write('<nd ref="{}"/>\n'.format(waynode['node_id']))
+                for key, value in way.items():
+                    if key != 'id':
+                        file.write('<tag k="{}" v="{}"/>\n'.format(key, value))
+                file.write('</way>\n')
+            file.write('</osm>\n')
+
+        nodes = pd.DataFrame.from_records(node_rows, index='id')
+        ways = pd.DataFrame.from_records(way_rows, index='id')
+        waynodes = pd.DataFrame.from_records(waynode_rows, index='way_id')
+        return nodes, ways, waynodes
+
     @staticmethod
     def create_example_source_table():
         data = {'name':['regenstein', 'booth', 'uchicago_medicine', 'smart_museum'],
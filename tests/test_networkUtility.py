@@ -36,3 +36,65 @@ class TestClass:
             assert False
         except BaseException:
             return
+
+    def test_3(self):
+        """
+        Tests the array based trimming returns the same component
+        as pyNetworkUtility, as a mask over node indices.
+        """
+        import numpy as np
+        from_indices = np.array([0, 1, 2, 3, 2, 1, 1, 4, 4, 4, 8, 4, 5, 6, 7, 7])
+        to_indices = np.array([1, 2, 3, 2, 6, 5, 4, 0, 5, 8, 0, 5, 6, 5, 6, 3])
+        keep_mask = _p2pExtension.getConnectedNetworkMask(from_indices, to_indices, 9)
+        assert keep_mask.dtype == np.bool_
+        assert set(np.flatnonzero(keep_mask)) == {0, 1, 4, 8}
+
+    def test_4(self):
+        """
+        Tests the array based trimming handles long cycles (no
+        recursion limit) and rejects edges to missing nodes.
+        """
+        import numpy as np
+        import pytest
+        num_nodes = 200000
+        from_indices = np.arange(num_nodes)
+        to_indices = (from_indices + 1) % num_nodes
+        keep_mask = _p2pExtension.getConnectedNetworkMask(from_indices, to_indices, num_nodes + 3)
+        assert keep_mask[:num_nodes].all() and not keep_mask[num_nodes:].any()
+
+        with pytest.raises(IndexError):
+            _p2pExtension.getConnectedNetworkMask([0, 1], [1, 5], 2)
+        with pytest.raises(RuntimeError):
+            _p2pExtension.getConnectedNetworkMask([], [], 0)
+
+    def test_5(self):
+        """
+        Tests degree-2 chains are contracted, except at kept nodes,
+        between one way edges of opposite directions and beyond
+        the maximum weight.
+        """
+        import numpy as np
+        # two way chain 0-1-2-3, one way chain 3->4->5->0 and a one way
+        # edge 6->5, so only nodes 1, 2 and 4 can be contracted
+        from_indices = np.array([0, 1, 2, 3, 4, 5, 6])
+        to_indices = np.array([1, 2, 3, 4, 5, 0, 5])
+        weights = np.array([1, 2, 3, 4, 5, 6, 7])
+        is_bidirectional = np.array([True, True, True, False, False, False, False])
+        keep_mask = np.zeros(7, dtype=bool)
+
+        contracted = _p2pExtension.getContractedNetwork(from_indices, to_indices, weights,
+                                                        is_bidirectional, keep_mask, 100)
+        edges = set(zip(*[column.tolist() for column in contracted]))
+        assert edges == {(0, 3, 6, True), (3, 5, 9, False), (5, 0, 6, False), (6, 5, 7, False)}
+
+        keep_mask[1] = True
+        contracted = _p2pExtension.getContractedNetwork(from_indices, to_indices, weights,
+                                                        is_bidirectional, keep_mask, 100)
+        edges = set(zip(*[column.tolist() for column in contracted]))
+        assert {(0, 1, 1, True), (1, 3, 5, True)} <= edges and len(edges) == 5
+
+        keep_mask[1] = False
+        contracted = _p2pExtension.getContractedNetwork(from_indices, to_indices, weights,
+                                                        is_bidirectional, keep_mask, 4)
+        edges = set(zip(*[column.tolist() for column in contracted]))
+        assert {(0, 2, 3, True), (2, 3, 3, True), (3, 4, 4, False), (4, 5, 5, False)} <= edges
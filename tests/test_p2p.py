@@ -375,3 +375,381 @@ class TestClass:
             assert False
         except UnrecognizedFileTypeException:
             return
+
+    def test_30(self):
+        """
+        Test process_partitioned matches process for
+        an asymmetric matrix.
+        """
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        transit_matrix_1 = TransitMatrix('walk',
+                                         primary_input='tests/test_data/sources.csv',
+                                         secondary_input='tests/test_data/dests.csv',
+                                         primary_hints=hints, secondary_hints=hints)
+        transit_matrix_1.process()
+
+        transit_matrix_2 = TransitMatrix('walk',
+                                         primary_input='tests/test_data/sources.csv',
+                                         secondary_input='tests/test_data/dests.csv',
+                                         primary_hints=hints, secondary_hints=hints)
+        transit_matrix_2.process_partitioned(num_partitions=3)
+
+        for source_id in transit_matrix_1.primary_data.index:
+            assert sorted(transit_matrix_1.matrix_interface.get_values_by_source(source_id)) == \
+                   sorted(transit_matrix_2.matrix_interface.get_values_by_source(source_id))
+
+    def test_31(self):
+        """
+        Test process_partitioned matches process for a
+        symmetric matrix, and that kept shards can be read back.
+        """
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        transit_matrix_1 = TransitMatrix('walk',
+                                         primary_input='tests/test_data/sources.csv',
+                                         primary_hints=hints)
+        transit_matrix_1.process()
+
+        shard_directory = self.datapath + 'test_31_shards'
+        transit_matrix_2 = TransitMatrix('walk',
+                                         primary_input='tests/test_data/sources.csv',
+                                         primary_hints=hints)
+        transit_matrix_2.process_partitioned(num_partitions=2, shard_directory=shard_directory)
+        transit_matrix_3 = TransitMatrix('walk', read_from_file=shard_directory)
+
+        for source_id in transit_matrix_1.primary_data.index:
+            expected = sorted(transit_matrix_1.matrix_interface.get_values_by_source(source_id))
+            assert sorted(transit_matrix_2.matrix_interface.get_values_by_source(source_id)) == expected
+            assert sorted(transit_matrix_3.matrix_interface.get_values_by_source(source_id)) == expected
+
+    def test_32(self):
+        """
+        Test the vectorized last mile distance.
+        """
+        import numpy as np
+        from geopy import distance
+        points_a = [(41.79, -87.60), (41.80, -87.59), (41.78, -87.62)]
+        points_b = [(41.791, -87.601), (41.80, -87.58), (41.70, -87.62)]
+        distances = TransitMatrix._haversine_distance(np.array([point[0] for point in points_a]),
+                                                      np.array([point[1] for point in points_a]),
+                                                      np.array([point[0] for point in points_b]),
+                                                      np.array([point[1] for point in points_b]))
+        for point_a, point_b, value in zip(points_a, points_b, distances):
+            expected = distance.distance(point_a, point_b).m
+            assert abs(value - expected) / expected < 0.005
+
+    def test_33(self):
+        """
+        Test snapping to edges for asymmetric and
+        symmetric matrices, and its accuracy for points
+        on the same edge.
+        """
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        configs = Configs(snap_to_edges=True)
+        transit_matrix_1 = TransitMatrix('walk',
+                                         primary_input='tests/test_data/sources.csv',
+                                         secondary_input='tests/test_data/dests.csv',
+                                         primary_hints=hints, secondary_hints=hints,
+                                         configs=configs)
+        transit_matrix_1.process()
+        for source_id in transit_matrix_1.primary_data.index:
+            for dest_id, value in transit_matrix_1.matrix_interface.get_values_by_source(source_id):
+                assert value < 65535
+
+        transit_matrix_2 = TransitMatrix('walk',
+                                         primary_input='tests/test_data/sources.csv',
+                                         primary_hints=hints,
+                                         configs=configs)
+        transit_matrix_2.process()
+        for source_id in transit_matrix_2.primary_data.index:
+            values = dict(transit_matrix_2.matrix_interface.get_values_by_source(source_id))
+            assert values[source_id] == 0
+            for value in values.values():
+                assert value < 65535
+
+        # points snapped to the same edge reach each
+        # other along the edge, not via its end nodes
+        import numpy as np
+        import pandas as pd
+        from spatial_access import _network_cache
+        extract_filename = self.write_example_osm_extract(self.datapath + 'same_edge.osm')
+        points = pd.DataFrame({'name': ['a', 'b'],
+                               'lat': [41.781, 41.784],
+                               'lon': [-87.599, -87.596]})
+        hints = {'idx': 'name', 'lat': 'lat', 'lon': 'lon'}
+        configs = Configs(osm_extract=extract_filename, snap_to_edges=True, use_meters=True)
+        transit_matrix_3 = TransitMatrix('walk', primary_input=points, primary_hints=hints,
+                                         configs=configs)
+        try:
+            transit_matrix_3.process()
+            expected = TransitMatrix._haversine_distance(np.array([41.781]), np.array([-87.599]),
+                                                         np.array([41.784]), np.array([-87.596]))[0]
+            values = dict(transit_matrix_3.matrix_interface.get_values_by_source('a'))
+            assert abs(values['b'] - expected) / expected < 0.05
+        finally:
+            _network_cache.remove_network(transit_matrix_3._network_interface._get_extract_cache_filename())
+
+    def test_34(self):
+        """
+        Test that DataFrame, parquet and feather inputs give
+        the same matrix as csv inputs.
+        """
+        import pandas as pd
+        import pytest
+        pytest.importorskip('pyarrow')
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        sources = pd.read_csv('tests/test_data/sources.csv')
+        dests = pd.read_csv('tests/test_data/dests.csv')
+        sources.to_parquet(self.datapath + 'sources.parquet')
+        dests.to_feather(self.datapath + 'dests.feather')
+
+        def get_values(primary_input, secondary_input):
+            transit_matrix = TransitMatrix('walk',
+                                           primary_input=primary_input,
+                                           secondary_input=secondary_input,
+                                           primary_hints=hints, secondary_hints=hints)
+            transit_matrix.process()
+            return {source_id: dict(transit_matrix.matrix_interface.get_values_by_source(source_id))
+                    for source_id in transit_matrix.primary_data.index}
+
+        expected = get_values('tests/test_data/sources.csv', 'tests/test_data/dests.csv')
+        assert get_values(sources, dests) == expected
+        assert get_values(self.datapath + 'sources.parquet',
+                          self.datapath + 'dests.feather') == expected
+        assert get_values(sources.set_index('name'), self.datapath + 'dests.feather') == expected
+
+    def test_35(self):
+        """
+        Test that process_multimodal gives the same matrices
+        as processing each network type separately.
+        """
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        configs = Configs(epsilon=0.005)
+        transit_matrices = TransitMatrix.process_multimodal(['walk', 'bike'],
+                                                            primary_input='tests/test_data/sources.csv',
+                                                            primary_hints=hints,
+                                                            configs=configs)
+        assert set(transit_matrices.keys()) == {'walk', 'bike'}
+        for network_type, transit_matrix in transit_matrices.items():
+            assert transit_matrix.network_type == network_type
+            expected = TransitMatrix(network_type,
+                                     primary_input='tests/test_data/sources.csv',
+                                     primary_hints=hints,
+                                     configs=configs)
+            expected.process()
+            for source_id in expected.primary_data.index:
+                assert dict(transit_matrix.matrix_interface.get_values_by_source(source_id)) == \
+                       dict(expected.matrix_interface.get_values_by_source(source_id))
+
+    def test_36(self):
+        """
+        Test speed scenarios derived from a matrix in meters are
+        close to matrices computed at each speed, and that reweight
+        matches a full recomputation.
+        """
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        transit_matrix_1 = TransitMatrix('walk',
+                                         primary_input='tests/test_data/sources.csv',
+                                         secondary_input='tests/test_data/dests.csv',
+                                         primary_hints=hints, secondary_hints=hints,
+                                         configs=Configs(use_meters=True))
+        transit_matrix_1.process()
+        scenarios = transit_matrix_1.get_speed_scenarios([3, 5])
+        assert set(scenarios.keys()) == {3, 5}
+        for speed, scenario in scenarios.items():
+            expected = TransitMatrix('walk',
+                                     primary_input='tests/test_data/sources.csv',
+                                     secondary_input='tests/test_data/dests.csv',
+                                     primary_hints=hints, secondary_hints=hints,
+                                     configs=Configs(walk_speed=speed))
+            expected.process()
+            for source_id in expected.primary_data.index:
+                values = dict(scenario.matrix_interface.get_values_by_source(source_id))
+                for dest_id, value in expected.matrix_interface.get_values_by_source(source_id):
+                    assert abs(int(values[dest_id]) - int(value)) <= 10
+
+        configs = Configs(speed_limit_dict={'residential': 20}, default_drive_speed=30)
+        transit_matrix_2 = TransitMatrix('drive',
+                                         primary_input='tests/test_data/sources.csv',
+                                         secondary_input='tests/test_data/dests.csv',
+                                         primary_hints=hints, secondary_hints=hints)
+        transit_matrix_2.process()
+        reweighted = transit_matrix_2.reweight(configs)
+        expected = TransitMatrix('drive',
+                                 primary_input='tests/test_data/sources.csv',
+                                 secondary_input='tests/test_data/dests.csv',
+                                 primary_hints=hints, secondary_hints=hints,
+                                 configs=configs)
+        expected.process()
+        for source_id in expected.primary_data.index:
+            assert dict(reweighted.matrix_interface.get_values_by_source(source_id)) == \
+                   dict(expected.matrix_interface.get_values_by_source(source_id))
+
+    def test_37(self):
+        """
+        Test process_profiles matches processing each profile
+        separately, including edge multipliers read from a file.
+        """
+        import pandas as pd
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        transit_matrix_1 = TransitMatrix('drive',
+                                         primary_input='tests/test_data/sources.csv',
+                                         secondary_input='tests/test_data/dests.csv',
+                                         primary_hints=hints, secondary_hints=hints)
+        transit_matrix_1.prefetch_network()
+        edges = transit_matrix_1._network_interface.edges
+        multipliers = pd.DataFrame({'from': edges['from'], 'to': edges['to'], 'multiplier': 3})
+        multipliers.to_csv(self.datapath + 'multipliers.csv', index=False)
+
+        profiles = {'peak': Configs(edge_multipliers=self.datapath + 'multipliers.csv'),
+                    'night': Configs(default_drive_speed=60)}
+        transit_matrices = transit_matrix_1.process_profiles(profiles)
+        assert set(transit_matrices.keys()) == {'peak', 'night'}
+
+        for name, configs in profiles.items():
+            expected = TransitMatrix('drive',
+                                     primary_input='tests/test_data/sources.csv',
+                                     secondary_input='tests/test_data/dests.csv',
+                                     primary_hints=hints, secondary_hints=hints,
+                                     configs=configs)
+            expected.process()
+            for source_id in expected.primary_data.index:
+                assert dict(transit_matrices[name].matrix_interface.get_values_by_source(source_id)) == \
+                       dict(expected.matrix_interface.get_values_by_source(source_id))
+
+        baseline = TransitMatrix('drive',
+                                 primary_input='tests/test_data/sources.csv',
+                                 secondary_input='tests/test_data/dests.csv',
+                                 primary_hints=hints, secondary_hints=hints)
+        baseline.process()
+        for source_id in baseline.primary_data.index:
+            peak_values = dict(transit_matrices['peak'].matrix_interface.get_values_by_source(source_id))
+            for dest_id, value in baseline.matrix_interface.get_values_by_source(source_id):
+                assert peak_values[dest_id] >= value
+
+    def test_38(self):
+        """
+        Test simplify_network gives the same matrices as the full
+        network, snapping to nodes and to edges.
+        """
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        for network_type, secondary_input, snap_to_edges in [('walk', None, True),
+                                                              ('drive', 'tests/test_data/dests.csv', False)]:
+            transit_matrices = []
+            for simplify_network in [False, True]:
+                transit_matrix = TransitMatrix(network_type,
+                                               primary_input='tests/test_data/sources.csv',
+                                               secondary_input=secondary_input,
+                                               primary_hints=hints,
+                                               secondary_hints=hints if secondary_input else None,
+                                               configs=Configs(snap_to_edges=snap_to_edges,
+                                                               simplify_network=simplify_network))
+                transit_matrix.process()
+                transit_matrices.append(transit_matrix)
+            for source_id in transit_matrices[0].primary_data.index:
+                assert dict(transit_matrices[0].matrix_interface.get_values_by_source(source_id)) == \
+                       dict(transit_matrices[1].matrix_interface.get_values_by_source(source_id))
+
+    def test_39(self):
+        """
+        Test process_to_csv streams the same values as process,
+        leaving out the values above the cutoff.
+        """
+        import pandas as pd
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        cutoff = 500
+        for network_type, secondary_input in [('walk', None), ('drive', 'tests/test_data/dests.csv')]:
+            kwargs = {'primary_input': 'tests/test_data/sources.csv',
+                      'secondary_input': secondary_input,
+                      'primary_hints': hints,
+                      'secondary_hints': hints if secondary_input else None}
+            expected = TransitMatrix(network_type, **kwargs)
+            expected.process()
+            for stream_cutoff in [None, cutoff]:
+                filename = self.datapath + 'streamed_{}.csv'.format(network_type)
+                transit_matrix = TransitMatrix(network_type, **kwargs)
+                transit_matrix.process_to_csv(filename, cutoff=stream_cutoff)
+                streamed = pd.read_csv(filename, header=None, names=['source', 'dest', 'value'])
+                assert not streamed.duplicated(['source', 'dest']).any()
+                streamed_values = {(source_id, dest_id): value for source_id, dest_id, value
+                                   in streamed.itertuples(index=False)}
+                undefined = 2 ** 16 - 1
+                expected_values = {}
+                for source_id in expected.primary_data.index:
+                    for dest_id, value in expected.matrix_interface.get_values_by_source(source_id):
+                        if value != undefined and (stream_cutoff is None or value <= stream_cutoff):
+                            expected_values[(source_id, dest_id)] = value
+                assert streamed_values == expected_values
+
+    def test_40(self):
+        """
+        Test matrices over max_memory are memory mapped with
+        the same values.
+        """
+        import os
+        hints = {'idx': 'name', 'lat': 'y', 'lon': 'x'}
+        spill_directory = self.datapath + 'spill'
+        os.makedirs(spill_directory, exist_ok=True)
+        for network_type, secondary_input in [('walk', None), ('drive', 'tests/test_data/dests.csv')]:
+            kwargs = {'primary_input': 'tests/test_data/sources.csv',
+                      'secondary_input': secondary_input,
+                      'primary_hints': hints,
+                      'secondary_hints': hints if secondary_input else None}
+            expected = TransitMatrix(network_type, **kwargs)
+            expected.process()
+            transit_matrix = TransitMatrix(network_type, configs=Configs(max_memory=1,
+                                                                         spill_directory=spill_directory),
+                                           **kwargs)
+            transit_matrix.process()
+            assert transit_matrix.matrix_interface.max_memory == 1
+            for source_id in expected.primary_data.index:
+                assert transit_matrix.matrix_interface.get_values_by_source(source_id) == \
+                       expected.matrix_interface.get_values_by_source(source_id)
+            assert transit_matrix.matrix_interface.get_dests_in_range(600) == \
+                   expected.matrix_interface.get_dests_in_range(600)
+
+    def test_41(self):
+        """
+        Test cancel() before process() cancels it, and the
+        next process() call still runs.
+        """
+        import pytest
+        import pandas as pd
+        from spatial_access import _network_cache
+        from spatial_access.SpatialAccessExceptions import MatrixBuildCancelledException
+        extract_filename = self.write_example_osm_extract(self.datapath + 'cancel.osm')
+        points = pd.DataFrame({'name': ['a', 'b'],
+                               'lat': [41.781, 41.784],
+                               'lon': [-87.599, -87.596]})
+        hints = {'idx': 'name', 'lat': 'lat', 'lon': 'lon'}
+        transit_matrix = TransitMatrix('walk', primary_input=points, primary_hints=hints,
+                                       configs=Configs(osm_extract=extract_filename))
+        try:
+            transit_matrix.cancel()
+            with pytest.raises(MatrixBuildCancelledException):
+                transit_matrix.process()
+            assert transit_matrix.get_progress() == (0, 0)
+            transit_matrix.process()
+            assert transit_matrix.get_progress() == (2, 2)
+        finally:
+            _network_cache.remove_network(transit_matrix._network_interface._get_extract_cache_filename())
+
+    @staticmethod
+    def write_example_osm_extract(filename):
+        """
+        Write a loop of three residential streets (the first
+        one a diagonal) as .osm xml.
+        Returns: filename.
+        """
+        with open(filename, 'w') as file:
+            file.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n'
+                       '<node id="1" lat="41.780" lon="-87.600"/>\n'
+                       '<node id="2" lat="41.785" lon="-87.595"/>\n'
+                       '<node id="3" lat="41.790" lon="-87.590"/>\n'
+                       '<node id="4" lat="41.790" lon="-87.600"/>\n'
+                       '<way id="10">\n<nd ref="1"/>\n<nd ref="2"/>\n<nd ref="3"/>\n'
+                       '<tag k="highway" v="residential"/>\n</way>\n'
+                       '<way id="11">\n<nd ref="3"/>\n<nd ref="4"/>\n'
+                       '<tag k="highway" v="residential"/>\n</way>\n'
+                       '<way id="12">\n<nd ref="4"/>\n<nd ref="1"/>\n'
+                       '<tag k="highway" v="residential"/>\n</way>\n</osm>\n')
+        return filename
@@ -472,3 +472,56 @@ class TestClass:
         matrix3.readCSV(filename_csv.encode('utf-8'))
         matrix3.printDataFrame()
 
+
+    def test_8(self):
+        """
+        Test memory mapped (spilled) transitMatrix gives the same
+        values as the in memory one, and survives copying and tmx.
+        """
+        import os
+        import numpy as np
+        spill_directory = self.datapath + 'spill'
+        os.makedirs(spill_directory, exist_ok=True)
+        for use_symmetric_edges, is_compressible, is_symmetric in [(True, True, True), (False, False, False)]:
+            source_data = TestClass.source_data_int
+            dest_data = TestClass.source_data_int if is_symmetric else TestClass.dest_data_int
+            # (test_7 adds to the shared edge weights in place)
+            if use_symmetric_edges:
+                edges = [[0, 1, 2, 3, 2, 4], [1, 2, 3, 4, 4, 0], [2, 1, 3, 4, 1, 1], [True] * 6]
+            else:
+                edges = [[0, 1, 0, 3, 0], [1, 0, 3, 2, 2], [3, 4, 5, 7, 2], [False, False, False, False, True]]
+            matrices = []
+            for directory in [b'', spill_directory.encode('utf-8')]:
+                matrix = _p2pExtension.pyTransitMatrixIxIxUS(isCompressible=is_compressible,
+                                                             isSymmetric=is_symmetric,
+                                                             rows=len(source_data),
+                                                             columns=len(dest_data),
+                                                             spillDirectory=directory)
+                matrix.prepareGraphWithVertices(len(edges[0]))
+                matrix.addEdgesToGraph(edges[0], edges[1], edges[2], edges[3])
+                for source in source_data:
+                    matrix.addToUserSourceDataContainer(source[0], source[1], source[2])
+                for dest in dest_data:
+                    matrix.addToUserDestDataContainer(dest[0], dest[1], dest[2])
+                matrix.compute(2)
+                matrices.append(matrix)
+            matrix, mapped_matrix = matrices
+
+            # the mapped file is unlinked as soon as it is created
+            assert os.listdir(spill_directory) == []
+            assert np.array_equal(matrix.getValueArray(), mapped_matrix.getValueArray())
+            for source in source_data:
+                assert matrix.getValuesBySource(source[1], True) == mapped_matrix.getValuesBySource(source[1], True)
+            assert matrix.getDestsInRange(8) == mapped_matrix.getDestsInRange(8)
+            assert matrix.getSourcesInRange(8) == mapped_matrix.getSourcesInRange(8)
+
+            scaled = _p2pExtension.pyTransitMatrixIxIxUS()
+            scaled.copyScaledFrom(mapped_matrix, 2)
+            assert np.array_equal(scaled.getValueArray(), np.where(matrix.getValueArray() == 65535, 65535,
+                                                                   matrix.getValueArray() * 2))
+
+            filename = self.datapath + 'test_8.tmx'
+            mapped_matrix.writeTMX(filename.encode('utf-8'))
+            matrix2 = _p2pExtension.pyTransitMatrixIxIxUS()
+            matrix2.readTMX(filename.encode('utf-8'))
+            assert np.array_equal(matrix.getValueArray(), matrix2.getValueArray())